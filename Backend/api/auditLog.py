@@ -0,0 +1,130 @@
+from fastapi import APIRouter, HTTPException, Depends, Query
+from typing import Optional
+import sqlite3
+import logging
+
+from db import Database, get_db
+from db.pagination import (
+    DEFAULT_LIMIT, MAX_LIMIT, InvalidPageRequest, SortKey,
+    resolve_sort, where_sql, encode_cursor, decode_cursor, page_response,
+)
+from services.audit import audit_logger, ACTOR_ROLES, ACTIONS, TARGET_TYPES, AUDIT_COLUMNS, day_start, day_end, format_ts
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# 审计日志按时间排序，audit_id 作为同一秒内的决胜列（索引末尾自带）
+AUDIT_SORTS = {
+    "-ts": SortKey("ts", "audit_id", descending=True),
+    "ts": SortKey("ts", "audit_id"),
+}
+
+
+@router.get("/audit-log")
+async def get_audit_log(
+    actor_role: Optional[str] = None,
+    actor_id: Optional[str] = None,
+    action: Optional[str] = None,
+    target_type: Optional[str] = None,
+    target_id: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    sort: str = "-ts",
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    cursor: Optional[str] = None,
+    include_total: bool = False,
+    db: Database = Depends(get_db),
+):
+    """
+    Query the audit log, e.g. every action on book 123 this year:
+    target_type=book&target_id=123&since=2025-01-01
+    since/until are inclusive 'YYYY-MM-DD' dates; sort: -ts (newest first) or ts
+    actor_id and target_id need actor_role / target_type, so that every filter is
+    answered by an index on (role or type, id, ts)
+    """
+    def _query(conn: sqlite3.Connection, key: SortKey, where: list[str], params: list):
+        after = decode_cursor(cursor, sort, len(key.columns))
+        page_where, page_params = list(where), list(params)
+        if after is not None:
+            page_where.append(key.seek())
+            page_params.extend(after)
+
+        rows = conn.execute(f"""
+            SELECT {', '.join(AUDIT_COLUMNS)}
+            FROM audit_log
+            {where_sql(page_where)}
+            ORDER BY {key.order_by()}
+            LIMIT ?
+        """, (*page_params, limit + 1)).fetchall()
+
+        total = None
+        if include_total:
+            total = conn.execute(f"SELECT COUNT(*) FROM audit_log {where_sql(where)}", params).fetchone()[0]
+        return rows, total
+
+    try:
+        key = resolve_sort(sort, AUDIT_SORTS)
+
+        for name, value, allowed in (("actor_role", actor_role, ACTOR_ROLES),
+                                     ("action", action, ACTIONS),
+                                     ("target_type", target_type, TARGET_TYPES)):
+            if value is not None and value not in allowed:
+                raise HTTPException(status_code=400, detail=f"Invalid {name}. Must be one of: {', '.join(allowed)}")
+        if actor_id is not None and actor_role is None:
+            raise HTTPException(status_code=400, detail="actor_id requires actor_role")
+        if target_id is not None and target_type is None:
+            raise HTTPException(status_code=400, detail="target_id requires target_type")
+
+        where, params = [], []
+        for column, value in (("actor_role", actor_role), ("actor_id", actor_id), ("action", action),
+                              ("target_type", target_type), ("target_id", target_id)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                params.append(value)
+        try:
+            if since:
+                where.append("ts >= ?")
+                params.append(day_start(since))
+            if until:
+                where.append("ts < ?")
+                params.append(day_end(until))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="since/until must be YYYY-MM-DD dates")
+
+        results, total = await db.run(_query, key, where, params)
+
+        next_cursor = None
+        if len(results) > limit:
+            results = results[:limit]
+            next_cursor = encode_cursor(sort, key.cursor_values(results[-1]))
+
+        entries = []
+        for row in results:
+            entry = dict(zip(AUDIT_COLUMNS, row))
+            entry["time"] = format_ts(row["ts"])
+            entries.append(entry)
+
+        logger.debug("Audit log query returned %d entries", len(entries))
+
+        return page_response("entries", entries, next_cursor, total)
+
+    except HTTPException:
+        raise
+    except InvalidPageRequest as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except sqlite3.Error as e:
+        logger.error(f"Database error in get_audit_log: {e}")
+        raise HTTPException(status_code=500, detail="Database error")
+    except Exception as e:
+        logger.error(f"Error querying audit log: {e}")
+        raise HTTPException(status_code=500, detail="Server error")
+
+
+@router.get("/audit-log/metrics")
+async def get_audit_log_metrics():
+    """
+    State of the audit write pipeline: mode, queue depth and capacity,
+    events enqueued / written / dropped and the number of batches written
+    """
+    return audit_logger.metrics()
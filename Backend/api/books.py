@@ -1,57 +1,198 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel
 import sqlite3
 import logging
-from datetime import datetime, timedelta
+import json
+import os
+import re
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from db import Database, get_db
+from db.pagination import (
+    DEFAULT_LIMIT, MAX_LIMIT, InvalidPageRequest, SortKey,
+    resolve_sort, encode_cursor, decode_cursor, page_response,
+)
+from services.audit import record_action
+from services.response_cache import etag_response, reader_tag
+from services.search_cache import catalog_version, search_cache, search_key, search_etag, search_metrics
+from services.catalog_snapshot import catalog_snapshot
+from services.reading_stats import reading_report
+from services.activity_calendar import (
+    calendar_cache, parse_day, first_activity_day, activity_series, split_range, segment_key,
+    merge_segments, cached_content,
+)
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# search_books 返回的列
+BOOK_COLUMNS = "b.book_id, b.book_name, b.author, b.publisher, b.publish_year, b.location, b.if_available"
+
+# search_books 允许的排序方式，均有索引支持
+BOOK_SORTS = {
+    "book_name": SortKey("b.book_name", "b.book_id"),
+    "book_id": SortKey("b.book_id"),
+}
+# 相关度排序：bm25 分数越小越相关
+RELEVANCE = SortKey("hits.score", "b.book_id")
+
+# 批量借书/还书一次最多处理多少本
+BULK_LIMIT = int(os.environ.get("LIBRARY_BULK_LIMIT", "50"))
+
+# reader_borrowings 允许的排序方式，"-" 表示倒序
+BORROWING_SORTS = {
+    "-borrow_date": SortKey("br.borrow_date", "br.record_id", descending=True),
+    "borrow_date": SortKey("br.borrow_date", "br.record_id"),
+    "due_date": SortKey("br.due_date", "br.record_id"),
+}
+
+
+def build_fts_query(query: str) -> Optional[str]:
+    """
+    Turn free text into an FTS5 query: every term must match, each one as a prefix
+    """
+    terms = re.findall(r"\w+", query)
+    return " ".join(f'"{term}"*' for term in terms) or None
+
+
+def parse_book_id(query: str) -> Optional[int]:
+    """
+    The book_id a purely numeric query names, or None
+    Only ASCII digits count (int() rejects other Unicode digits), and the value
+    must fit in a SQLite INTEGER
+    """
+    text = query.strip()
+    if not (text.isascii() and text.isdigit()):
+        return None
+    value = int(text)
+    return value if value < 2 ** 63 else None
+
+
+def search_rows(conn: sqlite3.Connection, match: Optional[str], exact_id: Optional[int], key: SortKey,
+                after: Optional[list], limit: int, include_total: bool) -> tuple[list, Optional[int]]:
+    """
+    SQL path of /api/search-books: up to limit + 1 rows after the cursor position, and the total if requested
+    """
+    seek, params = "", []
+    if after is not None and after[0] is not None:
+        seek, params = f"AND {key.seek()}", after
+
+    if match is None:
+        # 空查询按索引顺序分页浏览全部图书
+        where = f"WHERE {key.seek()}" if params else ""
+        rows = conn.execute(f"""
+            SELECT {BOOK_COLUMNS} FROM book b
+            {where}
+            ORDER BY {key.order_by()}
+            LIMIT ?
+        """, (*params, limit + 1)).fetchall()
+        total = conn.execute("SELECT COUNT(*) FROM book").fetchone()[0] if include_total else None
+        return rows, total
+
+    rows = []
+    if key is RELEVANCE:
+        # 纯数字查询：按 book_id 精确查找，放在第一页最前面（分数记为 NULL）
+        if after is None and exact_id is not None:
+            rows.extend(conn.execute(f"SELECT {BOOK_COLUMNS}, NULL AS score FROM book b WHERE b.book_id = ?", (exact_id,)))
+
+        # 书名权重最高，其次作者，最后出版社
+        rows.extend(conn.execute(f"""
+            SELECT {BOOK_COLUMNS}, hits.score
+            FROM (
+                SELECT rowid, bm25(book_fts, 10.0, 5.0, 1.0) AS score
+                FROM book_fts WHERE book_fts MATCH ?
+            ) hits
+            JOIN book b ON b.book_id = hits.rowid
+            WHERE b.book_id IS NOT ? {seek}
+            ORDER BY {key.order_by()}
+            LIMIT ?
+        """, (match, exact_id, *params, limit + 1 - len(rows))))
+    else:
+        rows = conn.execute(f"""
+            SELECT {BOOK_COLUMNS} FROM book b
+            WHERE b.book_id IN (SELECT rowid FROM book_fts WHERE book_fts MATCH ? UNION ALL SELECT ?) {seek}
+            ORDER BY {key.order_by()}
+            LIMIT ?
+        """, (match, exact_id, *params, limit + 1)).fetchall()
+
+    total = None
+    if include_total:
+        total = conn.execute("""
+            SELECT (SELECT COUNT(*) FROM book_fts WHERE book_fts MATCH ? AND rowid IS NOT ?)
+                 + (SELECT COUNT(*) FROM book WHERE book_id = ?)
+        """, (match, exact_id, exact_id)).fetchone()[0]
+    return rows, total
+
+
 @router.get("/search-books")
-async def search_books(query: str):
+async def search_books(
+    query: str,
+    request: Request,
+    sort: Optional[str] = None,
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    cursor: Optional[str] = None,
+    include_total: bool = True,
+    db: Database = Depends(get_db),
+):
     """
     Search for books based on a query string
-    The query will match against book_id, book_name, and author
+    A numeric query first matches book_id exactly; the query is then matched
+    against book_name, author and publisher through the full-text index, ranked by bm25
+    sort: relevance (default for a non-empty query), book_name (default for an
+    empty query) or book_id; pass the returned next_cursor back as cursor for the next page
     """
-    try:
+    match = build_fts_query(query)
+    exact_id = parse_book_id(query)
+    if sort is None:
+        sort = "relevance" if match else "book_name"
 
-        conn = sqlite3.connect('library.db')
-        cursor = conn.cursor()
-        
-        # Search for books by book_id, book_name, or author
-        cursor.execute("""
-            SELECT book_id, book_name, author, publisher, publish_year, location, if_available
-            FROM book 
-            WHERE book_id LIKE ? OR book_name LIKE ? OR author LIKE ?
-            ORDER BY book_name
-        """, (f'%{query}%', f'%{query}%', f'%{query}%'))
-        
-        results = cursor.fetchall()
-        conn.close()
-        
-        # Format results as a list of dictionaries
-        books = []
-        for row in results:
-            book = {
-                "book_id": row[0],
-                "book_name": row[1],
-                "author": row[2],
-                "publisher": row[3],
-                "publish_year": row[4],
-                "location": row[5],
-                "if_available": row[6]
-            }
-            books.append(book)
-        
-        # Print results to backend console
-        print(f"Search results for '{query}': {len(books)} books found")
-        for book in books:
-            print(book)
-        
-        return {"books": books}
-        
+    try:
+        sorts = {"relevance": RELEVANCE, **BOOK_SORTS} if match else BOOK_SORTS
+        key = resolve_sort(sort, sorts)
+
+        # 缓存键以目录版本号开头：图书有任何已提交的变更后，旧结果不会再被命中
+        cache_key = search_key(catalog_version.value, match, exact_id, sort, limit, cursor, include_total)
+        entry = search_cache.get(cache_key)
+        if entry is None:
+            after = decode_cursor(cursor, sort, len(key.columns))
+            if catalog_snapshot.loaded:
+                # 内存快照模式：在线程池中检索，不占用数据库连接
+                results, total = await run_in_threadpool(
+                    catalog_snapshot.search, match, exact_id, sort, after, limit, include_total)
+            else:
+                results, total = await db.run(search_rows, match, exact_id, key, after, limit, include_total)
+
+            next_cursor = None
+            if len(results) > limit:
+                results = results[:limit]
+                next_cursor = encode_cursor(sort, key.cursor_values(results[-1]))
+
+            # Format results as a list of dictionaries
+            books = []
+            for row in results:
+                book = {
+                    "book_id": row[0],
+                    "book_name": row[1],
+                    "author": row[2],
+                    "publisher": row[3],
+                    "publish_year": row[4],
+                    "location": row[5],
+                    "if_available": row[6]
+                }
+                books.append(book)
+
+            logger.debug("Search results for '%s': %d books returned", query, len(books))
+
+            entry = search_cache.put(cache_key, page_response("books", books, next_cursor, total), (),
+                                     search_cache.generation, etag=search_etag(cache_key))
+
+        return etag_response(request, entry)
+
+    except InvalidPageRequest as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except sqlite3.Error as e:
         logger.error(f"Database error in search_books: {e}")
         raise HTTPException(status_code=500, detail="Database error")
@@ -59,22 +200,37 @@ async def search_books(query: str):
         logger.error(f"Error searching books: {e}")
         raise HTTPException(status_code=500, detail="Server error")
 
+@router.get("/search-books/metrics")
+async def get_search_cache_metrics():
+    """
+    State of the search result cache: current catalog version and how often it
+    was bumped, entries and capacity, hits, misses and evictions
+    """
+    return search_metrics()
+
 @router.get("/reader-borrowings")
-async def get_reader_borrowings(student_id: str):
+async def get_reader_borrowings(
+    student_id: str,
+    sort: str = "-borrow_date",
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    cursor: Optional[str] = None,
+    include_total: bool = True,
+    db: Database = Depends(get_db),
+):
     """
     Get borrowing records for a specific reader by their student ID
+    sort: -borrow_date (newest first), borrow_date or due_date
     """
-    try:
-        print("ID")
-        print(student_id)
+    def _list(conn: sqlite3.Connection, key: SortKey):
+        after = decode_cursor(cursor, sort, len(key.columns))
+        seek, params = "", []
+        if after is not None:
+            seek, params = f"AND {key.seek()}", after
 
-        conn = sqlite3.connect('library.db')
-        cursor = conn.cursor()
-        
         # Get borrowing records for the student, join with book information
-        cursor.execute("""
+        rows = conn.execute(f"""
             SELECT
-                br.record_id, 
+                br.record_id,
                 br.student_id,
                 br.book_id,
                 br.borrow_date,
@@ -85,13 +241,25 @@ async def get_reader_borrowings(student_id: str):
                 b.author
             FROM borrow_record br
             JOIN book b ON br.book_id = b.book_id
-            WHERE br.student_id = ?
-            ORDER BY br.borrow_date DESC
-        """, (student_id,))
-        
-        results = cursor.fetchall()
-        conn.close()
-        
+            WHERE br.student_id = ? {seek}
+            ORDER BY {key.order_by()}
+            LIMIT ?
+        """, (student_id, *params, limit + 1)).fetchall()
+
+        total = None
+        if include_total:
+            total = conn.execute("SELECT COUNT(*) FROM borrow_record WHERE student_id = ?", (student_id,)).fetchone()[0]
+        return rows, total
+
+    try:
+        key = resolve_sort(sort, BORROWING_SORTS)
+        results, total = await db.run(_list, key)
+
+        next_cursor = None
+        if len(results) > limit:
+            results = results[:limit]
+            next_cursor = encode_cursor(sort, key.cursor_values(results[-1]))
+
         # Format results as a list of dictionaries
         borrowings = []
         for row in results:
@@ -107,14 +275,13 @@ async def get_reader_borrowings(student_id: str):
                 "author": row[8]
             }
             borrowings.append(borrowing)
-        
-        # Print results to backend console
-        print(f"Found {len(borrowings)} borrowings for student {student_id}")
-        for borrowing in borrowings:
-            print(borrowing)
-        
-        return {"borrowings": borrowings}
-        
+
+        logger.debug("Found %d borrowings for student %s", len(borrowings), student_id)
+
+        return page_response("borrowings", borrowings, next_cursor, total)
+
+    except InvalidPageRequest as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except sqlite3.Error as e:
         logger.error(f"Database error in get_reader_borrowings: {e}")
         raise HTTPException(status_code=500, detail="Database error")
@@ -124,41 +291,65 @@ async def get_reader_borrowings(student_id: str):
 
 
 @router.get("/reader-activity-calendar")
-async def get_reader_activity_calendar(student_id: str):
+async def get_reader_activity_calendar(
+    student_id: str,
+    request: Request,
+    from_date: Optional[str] = Query(None, alias="from"),
+    to_date: Optional[str] = Query(None, alias="to"),
+    db: Database = Depends(get_db),
+):
     """
     Get reading activity calendar data for a specific reader
-    Returns dates and activity counts for the calendar visualization
+    Returns day -> count series for the calendar visualization between from and
+    to (YYYY-MM-DD, inclusive; default from the reader's first loan to today):
+    activity_data (books borrowed), return_data (books returned) and renew_data (renewals)
     """
     try:
+        today = date.today()
+        try:
+            end = parse_day(to_date) if to_date else today
+            start = parse_day(from_date) if from_date else None
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid date, expected YYYY-MM-DD")
+        if start is None:
+            first = await db.run(first_activity_day, student_id)
+            start = min(parse_day(first), end) if first else end
+        if start > end:
+            raise HTTPException(status_code=400, detail="from must not be after to")
+
+        # 已结束的年份和月份按读者缓存，当前月份每次重新统计
+        generation = calendar_cache.generation
+        segments = split_range(start, end, today)
+        entries = {(first, last): calendar_cache.get(segment_key(student_id, first, last))
+                   for first, last, closed in segments if closed}
+
+        def _load(conn: sqlite3.Connection) -> dict:
+            return {
+                (first, last): activity_series(conn, student_id, first, last)
+                for first, last, closed in segments
+                if not closed or entries[(first, last)] is None
+            }
 
-        conn = sqlite3.connect('library.db')
-        cursor = conn.cursor()
-
-        # Get borrowing records grouped by date for the student
-        cursor.execute("""
-            SELECT
-                borrow_date,
-                COUNT(*) as activity_count
-            FROM borrow_record
-            WHERE student_id = ?
-            GROUP BY borrow_date
-        """, (student_id,))
-
-        results = cursor.fetchall()
-        conn.close()
-
-        # Format results as a dictionary of date -> count
-        activity_data = {}
-        for row in results:
-            date = row[0]
-            count = row[1]
-            activity_data[date] = count
-
-        # Print results to backend console
-        print(f"Found activity data for student {student_id}: {activity_data}")
-
-        return {"activity_data": activity_data}
+        loaded = await db.run(_load)
 
+        parts = []
+        for first, last, closed in segments:
+            if not closed:
+                parts.append(loaded[(first, last)])
+                continue
+            entry = entries[(first, last)]
+            if entry is None:
+                entry = calendar_cache.put(segment_key(student_id, first, last), loaded[(first, last)],
+                                           [reader_tag(student_id)], generation)
+            # 请求正好是一个已结束的年份或月份时，直接返回缓存的响应和它的 ETag
+            if len(segments) == 1 and (first, last) == (start, end):
+                return etag_response(request, entry)
+            parts.append(loaded.get((first, last)) or cached_content(entry))
+
+        return etag_response(request, merge_segments(parts, start, end))
+
+    except HTTPException:
+        raise
     except sqlite3.Error as e:
         logger.error(f"Database error in get_reader_activity_calendar: {e}")
         raise HTTPException(status_code=500, detail="Database error")
@@ -168,33 +359,23 @@ async def get_reader_activity_calendar(student_id: str):
 
 
 @router.post("/borrow-book")
-async def borrow_book(student_id: str, book_id: int):
+async def borrow_book(student_id: str, book_id: int, db: Database = Depends(get_db)):
     """
     Borrow a book: update book availability and create a borrow record
     """
-    try:
-
-        conn = sqlite3.connect('library.db')
+    def _borrow(conn: sqlite3.Connection):
         cursor = conn.cursor()
 
-        # Check if book is available
-        cursor.execute("SELECT if_available FROM book WHERE book_id = ?", (book_id,))
-        result = cursor.fetchone()
+        # 条件更新：只有仍可借时才标记为已借出，检查和占用在同一条语句中完成
+        cursor.execute("UPDATE book SET if_available = 0 WHERE book_id = ? AND if_available = 1", (book_id,))
 
-        if not result:
-            conn.close()
-            raise HTTPException(status_code=404, detail="Book not found")
-
-        if_available = result[0]
-        if if_available != 1:
-            conn.close()
+        if cursor.rowcount == 0:
+            # 只有失败时才再查一次，区分图书不存在和已被借出
+            cursor.execute("SELECT 1 FROM book WHERE book_id = ?", (book_id,))
+            if not cursor.fetchone():
+                raise HTTPException(status_code=404, detail="Book not found")
             raise HTTPException(status_code=400, detail="Book is not available for borrowing")
 
-
-        cursor.execute("UPDATE book SET if_available = 0 WHERE book_id = ?", (book_id,))
-
-
-        from datetime import datetime, timedelta
         borrow_date = datetime.now().strftime('%Y-%m-%d')
 
         due_date = (datetime.now() + timedelta(days=20)).strftime('%Y-%m-%d')
@@ -205,19 +386,27 @@ async def borrow_book(student_id: str, book_id: int):
             VALUES (?, ?, ?, ?, ?)
         """, (student_id, book_id, borrow_date, due_date, 0))
 
-        date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        operation = f"Student {student_id} borrowed book {book_id}"
+        # 记录审计日志
+        record_action(conn, "reader", student_id, "borrow", "book", book_id, f"Student {student_id} borrowed book {book_id}")
 
-        cursor.execute("""
-            INSERT INTO operation_log (date, operation)
-            VALUES (?, ?)
-        """, (date, operation))
+        # if_available 变化后搜索结果随之变化
+        db.after_commit(lambda: catalog_snapshot.set_available([book_id], False))
+        db.after_commit(catalog_version.bump)
 
-        conn.commit()
-        conn.close()
+        return borrow_date, due_date
 
+    try:
+        if catalog_snapshot.loaded:
+            # 快照模式下先在内存中检查，明显借不到的请求不进入写队列；是否借出仍以条件更新为准
+            available = catalog_snapshot.availability(book_id)
+            if available is None:
+                raise HTTPException(status_code=404, detail="Book not found")
+            if not available:
+                raise HTTPException(status_code=400, detail="Book is not available for borrowing")
+
+        borrow_date, due_date = await db.transaction(_borrow)
 
-        print(f"Book {book_id} borrowed by student {student_id} on {borrow_date}, due {due_date}")
+        logger.info("Book %s borrowed by student %s on %s, due %s", book_id, student_id, borrow_date, due_date)
 
         return {
             "status": "success",
@@ -226,6 +415,8 @@ async def borrow_book(student_id: str, book_id: int):
             "due_date": due_date
         }
 
+    except HTTPException:
+        raise
     except sqlite3.Error as e:
         logger.error(f"Database error in borrow_book: {e}")
         raise HTTPException(status_code=500, detail="Database error")
@@ -233,88 +424,109 @@ async def borrow_book(student_id: str, book_id: int):
         logger.error(f"Error borrowing book: {e}")
         raise HTTPException(status_code=500, detail="Server error")
 
-@router.get("/reader-reading-report")
-async def get_reading_report_information(student_id: str):
+class BulkCirculationRequest(BaseModel):
+    student_id: str
+    book_ids: list[int]
+
+
+def _bulk_book_ids(request: BulkCirculationRequest) -> list[int]:
     """
-    Generate up to two personalized reading report sentences for a reader.
+    The requested book ids in request order, without duplicates
+    """
+    book_ids = list(dict.fromkeys(request.book_ids))
+    if not book_ids:
+        raise HTTPException(status_code=400, detail="book_ids must not be empty")
+    if len(book_ids) > BULK_LIMIT:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_LIMIT} books can be processed at once")
+    return book_ids
+
+
+@router.post("/borrow-books")
+async def borrow_books(request: BulkCirculationRequest, db: Database = Depends(get_db)):
+    """
+    Borrow several books for one student in a single transaction
+    Every available book is borrowed; the others are reported per item with the
+    error /api/borrow-book would have returned for them
     """
+    def _borrow(conn: sqlite3.Connection):
+        ids = json.dumps(book_ids)
+
+        # 只把仍可借的书标记为已借出，RETURNING 给出实际借到的书
+        borrowed = {row[0] for row in conn.execute("""
+            UPDATE book SET if_available = 0
+            WHERE book_id IN (SELECT value FROM json_each(?))
+              AND if_available = 1
+            RETURNING book_id
+        """, (ids,)).fetchall()}
+
+        # 区分不存在的书和已借出的书
+        existing = borrowed
+        if len(borrowed) < len(book_ids):
+            existing = {row[0] for row in conn.execute(
+                "SELECT book_id FROM book WHERE book_id IN (SELECT value FROM json_each(?))", (ids,)
+            ).fetchall()}
+
+        borrow_date = datetime.now().strftime('%Y-%m-%d')
+        due_date = (datetime.now() + timedelta(days=20)).strftime('%Y-%m-%d')
+
+        borrowed_ids = [book_id for book_id in book_ids if book_id in borrowed]
+        if borrowed_ids:
+            conn.execute("""
+                INSERT INTO borrow_record (student_id, book_id, borrow_date, due_date, renew)
+                SELECT ?, value, ?, ?, 0 FROM json_each(?)
+            """, (request.student_id, borrow_date, due_date, json.dumps(borrowed_ids)))
+            # if_available 变化后搜索结果随之变化
+            db.after_commit(lambda: catalog_snapshot.set_available(borrowed_ids, False))
+            db.after_commit(catalog_version.bump)
+
+        results = []
+        for book_id in book_ids:
+            if book_id in borrowed:
+                # 记录审计日志
+                record_action(conn, "reader", request.student_id, "borrow", "book", book_id, f"Student {request.student_id} borrowed book {book_id}")
+                results.append({"book_id": book_id, "status": "success"})
+            elif book_id in existing:
+                results.append({"book_id": book_id, "status": "error", "code": 400, "detail": "Book is not available for borrowing"})
+            else:
+                results.append({"book_id": book_id, "status": "error", "code": 404, "detail": "Book not found"})
+
+        return results, len(borrowed_ids), borrow_date, due_date
+
     try:
-        conn = sqlite3.connect('library.db')
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT
-                br.borrow_date,
-                br.book_id,
-                br.return_date,
-                b.book_name
-            FROM borrow_record br
-            JOIN book b ON br.book_id = b.book_id
-            WHERE br.student_id = ?
-            ORDER BY br.borrow_date DESC
-        """, (student_id,))
+        book_ids = _bulk_book_ids(request)
+        results, count, borrow_date, due_date = await db.transaction(_borrow)
 
-        results = cursor.fetchall()
-        conn.close()
+        logger.info("%d of %d books borrowed by student %s on %s, due %s", count, len(book_ids), request.student_id, borrow_date, due_date)
 
-        if not results:
-            return {"reports": ["please read more books"]}
+        return {
+            "status": "success",
+            "message": f"Successfully borrowed {count} of {len(book_ids)} books",
+            "borrow_date": borrow_date,
+            "due_date": due_date,
+            "results": results
+        }
 
-        def parse_date(date_str):
-            if not date_str:
-                return None
-            try:
-                return datetime.strptime(date_str, "%Y-%m-%d").date()
-            except ValueError:
-                return None
-
-        def format_month_day(date_obj):
-            if not date_obj:
-                return "Someday"
-            month = date_obj.strftime("%B")
-            day = date_obj.day
-            suffix = "th" if 11 <= day <= 13 else {1: "st", 2: "nd", 3: "rd"}.get(day % 10, "th")
-            return f"{month} {day}{suffix}"
-
-        # Group by borrow date to find multi-book checkouts
-        day_groups = {}
-        for borrow_date, _, _, book_name in results:
-            date_key = parse_date(borrow_date)
-            if not date_key:
-                continue
-            day_groups.setdefault(date_key, []).append(book_name)
-
-        reports = []
-
-        # Template 1: day with most books
-        if day_groups:
-            top_day, books_on_day = max(day_groups.items(), key=lambda item: len(item[1]))
-            if len(books_on_day) >= 2:
-                books_list = ", ".join(books_on_day[:5])
-                reports.append(
-                    f"On {format_month_day(top_day)}, you checked out {len(books_on_day)} books at once — {books_list}. Maybe they sparked a few new ideas."
-                )
-
-        # Template 2: book with longest engagement in last 3 months
-        three_months_ago = datetime.today().date() - timedelta(days=90)
-        engagement = {}
-        for borrow_date, _, return_date, book_name in results:
-            borrow_dt = parse_date(borrow_date)
-            if not borrow_dt or borrow_dt < three_months_ago:
-                continue
-            return_dt = parse_date(return_date) or datetime.today().date()
-            duration = max((return_dt - borrow_dt).days, 1)
-            engagement[book_name] = engagement.get(book_name, 0) + duration
-
-        if engagement:
-            favorite_book = max(engagement.items(), key=lambda item: item[1])[0]
-            reports.append(
-                f"Over the past three months, the book you spent the most time with was {favorite_book} — clearly a favorite in your recent reading history."
-            )
+    except HTTPException:
+        raise
+    except sqlite3.Error as e:
+        logger.error(f"Database error in borrow_books: {e}")
+        raise HTTPException(status_code=500, detail="Database error")
+    except Exception as e:
+        logger.error(f"Error borrowing books: {e}")
+        raise HTTPException(status_code=500, detail="Server error")
+
+@router.get("/reader-reading-report")
+async def get_reading_report_information(student_id: str, db: Database = Depends(get_db)):
+    """
+    Generate up to two personalized reading report sentences for a reader.
+    Reads the reader's precomputed row in reader_reading_stats (see services/reading_stats.py)
+    """
+    try:
+        reports = await db.run(reading_report, student_id)
 
         if not reports:
             return {"reports": ["please read more books"]}
 
-        print(reports)
         return {"reports": reports[:2]}
 
     except sqlite3.Error as e:
@@ -325,57 +537,42 @@ async def get_reading_report_information(student_id: str):
         raise HTTPException(status_code=500, detail="Server error")
 
 @router.get("/reader-return-books")
-async def return_book(student_id: str, book_id: int):
+async def return_book(student_id: str, book_id: int, db: Database = Depends(get_db)):
     """
     Return a book: update book availability and update a borrow record
     """
-    try:
-
-        conn = sqlite3.connect('library.db')
+    def _return(conn: sqlite3.Connection):
         cursor = conn.cursor()
 
         # where的三个条件 student id和book_id可能会重复防止一个学生多次借阅同一本书
+        # 条件更新：按影响行数判断是否存在未归还的记录
+        return_date = datetime.now().strftime('%Y-%m-%d')
         cursor.execute("""
-            SELECT borrow_date, due_date
-            FROM borrow_record
+            UPDATE borrow_record
+            SET return_date = ?
             WHERE student_id = ?
-              AND book_id = ?
-              AND (return_date IS NULL OR return_date = '')
-        """, (student_id, book_id))
-
-        borrow_record = cursor.fetchone()
+            AND book_id = ?
+            AND (return_date IS NULL OR return_date = '')
+        """, (return_date, student_id, book_id))
 
-        if not borrow_record:
-            conn.close()
+        if cursor.rowcount == 0:
             raise HTTPException(status_code=404, detail="Borrow record not found or already returned")
 
-
         cursor.execute("UPDATE book SET if_available = 1 WHERE book_id = ?", (book_id,))
 
+        # 记录审计日志
+        record_action(conn, "reader", student_id, "return", "book", book_id, f"Student {student_id} returned book {book_id}")
 
-        from datetime import datetime
-        return_date = datetime.now().strftime('%Y-%m-%d')
-        cursor.execute("""
-            UPDATE borrow_record
-            SET return_date = ?
-            WHERE student_id = ? 
-            AND book_id = ? 
-            AND (return_date IS NULL OR return_date = '')
-        """, (return_date, student_id, book_id))
-
-        # 记录日志
-        date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        operation = f"Student {student_id} returned book {book_id}"
+        # if_available 变化后搜索结果随之变化
+        db.after_commit(lambda: catalog_snapshot.set_available([book_id], True))
+        db.after_commit(catalog_version.bump)
 
-        cursor.execute("""
-            INSERT INTO operation_log (date, operation)
-            VALUES (?, ?)
-        """, (date, operation))
+        return return_date
 
-        conn.commit()
-        conn.close()
+    try:
+        return_date = await db.transaction(_return)
 
-        print(f"Book {book_id} returned by student {student_id} on {return_date}")
+        logger.info("Book %s returned by student %s on %s", book_id, student_id, return_date)
 
         return {
             "status": "success",
@@ -383,6 +580,8 @@ async def return_book(student_id: str, book_id: int):
             "return_date": return_date,
         }
 
+    except HTTPException:
+        raise
     except sqlite3.Error as e:
         logger.error(f"Database error in return_book: {e}")
         raise HTTPException(status_code=500, detail="Database error")
@@ -391,16 +590,75 @@ async def return_book(student_id: str, book_id: int):
         raise HTTPException(status_code=500, detail="Server error")
 
 
-@router.get("/reader-renew-books")
-async def renew_book(student_id: str, book_id: int):
+@router.post("/return-books")
+async def return_books(request: BulkCirculationRequest, db: Database = Depends(get_db)):
     """
-    Renew a book: update a borrow record
+    Return several books for one student in a single transaction
+    Books without an open borrow record are reported per item
     """
+    def _return(conn: sqlite3.Connection):
+        return_date = datetime.now().strftime('%Y-%m-%d')
+
+        # 关闭该学生这些书的未归还记录，RETURNING 给出实际归还的书
+        returned = {row[0] for row in conn.execute("""
+            UPDATE borrow_record
+            SET return_date = ?
+            WHERE student_id = ?
+              AND book_id IN (SELECT value FROM json_each(?))
+              AND (return_date IS NULL OR return_date = '')
+            RETURNING book_id
+        """, (return_date, request.student_id, json.dumps(book_ids))).fetchall()}
+
+        returned_ids = [book_id for book_id in book_ids if book_id in returned]
+        if returned_ids:
+            conn.execute(
+                "UPDATE book SET if_available = 1 WHERE book_id IN (SELECT value FROM json_each(?))",
+                (json.dumps(returned_ids),)
+            )
+            # if_available 变化后搜索结果随之变化
+            db.after_commit(lambda: catalog_snapshot.set_available(returned_ids, True))
+            db.after_commit(catalog_version.bump)
+
+        results = []
+        for book_id in book_ids:
+            if book_id in returned:
+                # 记录审计日志
+                record_action(conn, "reader", request.student_id, "return", "book", book_id, f"Student {request.student_id} returned book {book_id}")
+                results.append({"book_id": book_id, "status": "success"})
+            else:
+                results.append({"book_id": book_id, "status": "error", "code": 404, "detail": "Borrow record not found or already returned"})
+
+        return results, len(returned_ids), return_date
+
     try:
-        from datetime import datetime, timedelta
+        book_ids = _bulk_book_ids(request)
+        results, count, return_date = await db.transaction(_return)
+
+        logger.info("%d of %d books returned by student %s on %s", count, len(book_ids), request.student_id, return_date)
 
+        return {
+            "status": "success",
+            "message": f"Successfully returned {count} of {len(book_ids)} books",
+            "return_date": return_date,
+            "results": results
+        }
 
-        conn = sqlite3.connect('library.db')
+    except HTTPException:
+        raise
+    except sqlite3.Error as e:
+        logger.error(f"Database error in return_books: {e}")
+        raise HTTPException(status_code=500, detail="Database error")
+    except Exception as e:
+        logger.error(f"Error returning books: {e}")
+        raise HTTPException(status_code=500, detail="Server error")
+
+
+@router.get("/reader-renew-books")
+async def renew_book(student_id: str, book_id: int, db: Database = Depends(get_db)):
+    """
+    Renew a book: update a borrow record
+    """
+    def _renew(conn: sqlite3.Connection):
         cursor = conn.cursor()
 
         # Get the current due date to calculate the new extended due date
@@ -416,7 +674,6 @@ async def renew_book(student_id: str, book_id: int):
         borrow_record = cursor.fetchone()
 
         if not borrow_record:
-            conn.close()
             raise HTTPException(status_code=404, detail="This book can not be renewed")
 
         original_due_date_str = borrow_record[1]
@@ -440,19 +697,15 @@ async def renew_book(student_id: str, book_id: int):
             AND (return_date IS NULL OR return_date = '')
         """, (new_due_date_str, student_id, book_id))
 
-        # 记录日志
-        date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        operation = f"Student {student_id} renewed book {book_id}"
+        # 记录审计日志
+        record_action(conn, "reader", student_id, "renew", "book", book_id, f"Student {student_id} renewed book {book_id}")
 
-        cursor.execute("""
-            INSERT INTO operation_log (date, operation)
-            VALUES (?, ?)
-        """, (date, operation))
+        return new_due_date_str
 
-        conn.commit()
-        conn.close()
+    try:
+        new_due_date_str = await db.transaction(_renew)
 
-        print(f"Book {book_id} renewed by student {student_id}, new due date: {new_due_date_str}")
+        logger.info("Book %s renewed by student %s, new due date: %s", book_id, student_id, new_due_date_str)
 
         return {
             "status": "success",
@@ -460,9 +713,11 @@ async def renew_book(student_id: str, book_id: int):
             "new_due_date": new_due_date_str
         }
 
+    except HTTPException:
+        raise
     except sqlite3.Error as e:
         logger.error(f"Database error in renew_book: {e}")
         raise HTTPException(status_code=500, detail="Database error")
     except Exception as e:
         logger.error(f"Error renewing book: {e}")
-        raise HTTPException(status_code=500, detail="Server error")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Server error")
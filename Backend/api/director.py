@@ -1,73 +1,76 @@
 from annotated_types import Len
-from fastapi import APIRouter, HTTPException, Form
+from fastapi import APIRouter, HTTPException, Depends, Form, Query, Request
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import Optional
 import sqlite3
 import logging
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+from db import Database, get_db
+from db.pagination import (
+    DEFAULT_LIMIT, MAX_LIMIT, InvalidPageRequest, SortKey,
+    resolve_sort, encode_cursor, decode_cursor, page_response,
+)
+from services.directory_index import librarian_directory, fetch_librarian
+from services.audit import record_action
+from services.id_allocator import id_allocator, LIBRARIAN_SEQUENCE
+from services.passwords import password_hasher
+from services.sessions import session_store
+from services.response_cache import profile_cache, etag_response, admin_tag, LIBRARIANS_TAG
+
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# /api/all-librarians 允许的排序方式，均有索引支持
+LIBRARIAN_SORTS = {
+    "admin_id": SortKey("admin_id"),
+    "name": SortKey("name", "admin_id"),
+}
+
 # 搜索管理员
 @router.get("/search-librarian")
-async def search_librarian(query: str):
+async def search_librarian(
+    query: str,
+    sort: str = "relevance",
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    cursor: Optional[str] = None,
+    include_total: bool = True,
+    db: Database = Depends(get_db),
+):
     """
-    search readers
+    search librarians
+    sort: relevance (exact matches first), admin_id or name
     """
     try:
+        after = decode_cursor(cursor, sort, 3 if sort == "relevance" else 2)
 
-        conn = sqlite3.connect('library.db')
-        cursor = conn.cursor()
-        
-        # Search for books by book_id, book_name, or author
-        cursor.execute("""
-            SELECT admin_id, name, email, phone, department
-            FROM librarian_information 
-            WHERE admin_id LIKE ? OR name LIKE ? OR phone LIKE ? OR email LIKE ?
-            ORDER BY admin_id
-        """, (f'%{query}%', f'%{query}%', f'%{query}%', f'%{query}%'))
-        
-        results = cursor.fetchall()
-        conn.close()
-        
-        # Format results as a list of dictionaries
-        librarians = []
-        for row in results:
-            librarian = {
-                "admin_id": row[0],
-                "name": row[1],
-                "email": row[2],
-                "phone": row[3],
-                "department": row[4]
-            }
-            librarians.append(librarian)
-        
-        # Print results to backend console
-        print(f"Search results for '{query}': {len(librarians)} librarians found")
-        for librarian in librarians:
-            print(librarian)
-        
-        return {"librarians": librarians}
-        
+        # 在内存目录索引中按编号、姓名、电话、邮箱做精确/前缀匹配；在线程池中执行，不阻塞事件循环
+        librarians, last, total = await run_in_threadpool(librarian_directory.search, query, sort, after, limit,
+                                                          include_total)
+        next_cursor = encode_cursor(sort, last) if last else None
+
+        logger.debug("Librarian search: %d of %s librarians returned", len(librarians), total)
+
+        return page_response("librarians", librarians, next_cursor, total)
+
+    except InvalidPageRequest as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except sqlite3.Error as e:
-        logger.error(f"Database error in search_readers: {e}")
+        logger.error(f"Database error in search_librarian: {e}")
         raise HTTPException(status_code=500, detail="Database error")
     except Exception as e:
-        logger.error(f"Error searching readers: {e}")
+        logger.error(f"Error searching librarians: {e}")
         raise HTTPException(status_code=500, detail="Server error")
 
 #删除管理员
 @router.delete("/delete-librarian")
-async def delete_librarian(admin_id: str):
+async def delete_librarian(admin_id: str, db: Database = Depends(get_db)):
     """
     Delete a reader by student_id
     Note: This will also delete related borrow records due to foreign key constraints
     """
-    try:
-        conn = sqlite3.connect('library.db')
+    def _delete(conn: sqlite3.Connection):
         cursor = conn.cursor()
 
         # 检查读者是否存在
@@ -75,7 +78,6 @@ async def delete_librarian(admin_id: str):
         result = cursor.fetchone()
         
         if not result:
-            conn.close()
             raise HTTPException(status_code=404, detail="librarian not found")
 
         reader_id = result[0]
@@ -85,22 +87,20 @@ async def delete_librarian(admin_id: str):
         cursor.execute("DELETE FROM librarian_information WHERE admin_id = ?", (admin_id,))
 
         if cursor.rowcount == 0:
-            conn.close()
             raise HTTPException(status_code=404, detail=" not found")
         
-        from datetime import datetime
-        date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        operation = f"director deleted the librarian {admin_id}"
+        # 记录审计日志
+        record_action(conn, "director", None, "delete", "librarian", admin_id, f"director deleted the librarian {admin_id}")
 
-        cursor.execute("""
-            INSERT INTO operation_log (date, operation)
-            VALUES (?, ?)
-        """, (date, operation))
+        db.after_commit(lambda: librarian_directory.remove(admin_id))
+        db.after_commit(lambda: profile_cache.invalidate(admin_tag("librarian", admin_id), LIBRARIANS_TAG))
+        # 已删除账号的会话随之失效
+        db.after_commit(lambda: session_store.revoke_user(admin_id, "librarian"))
 
-        conn.commit()
-        conn.close()
+    try:
+        await db.transaction(_delete)
 
-        print(f"Deleted librarian: {admin_id}")
+        logger.info("Deleted librarian: %s", admin_id)
 
         return {
             "status": "success",
@@ -110,46 +110,81 @@ async def delete_librarian(admin_id: str):
     except HTTPException:
         raise
     except sqlite3.Error as e:
-        logger.error(f"Database error in delete_reader: {e}")
+        logger.error(f"Database error in delete_librarian: {e}")
         raise HTTPException(status_code=500, detail="Database error")
     except Exception as e:
-        logger.error(f"Error deleting reader: {e}")
+        logger.error(f"Error deleting librarian: {e}")
         raise HTTPException(status_code=500, detail="Server error")
 
 
 # 获取所有管理员
 @router.get("/all-librarians")
-async def get_all_librarians():
+async def get_all_librarians(
+    request: Request,
+    sort: str = "admin_id",
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    cursor: Optional[str] = None,
+    include_total: bool = True,
+    db: Database = Depends(get_db),
+):
     """
-    Get all librarians
+    Get all librarians, one page at a time
+    sort: admin_id or name
     """
-    try:
-        conn = sqlite3.connect('library.db')
-        cursor = conn.cursor()
-
-        cursor.execute("""
+    def _list(conn: sqlite3.Connection, key: SortKey):
+        after = decode_cursor(cursor, sort, len(key.columns))
+        where, params = "", []
+        if after is not None:
+            where, params = f"WHERE {key.seek()}", after
+
+        # 多取一行用于判断是否还有下一页
+        rows = conn.execute(f"""
             SELECT admin_id, name, email, phone, department
             FROM librarian_information
-            ORDER BY admin_id
-        """)
-
-        results = cursor.fetchall()
-        conn.close()
-
-        # Format results as a list of dictionaries
-        librarians = []
-        for row in results:
-            librarian = {
-                "id": row[0],  # Use "id" for frontend consistency
-                "name": row[1],
-                "email": row[2],
-                "phone": row[3],
-                "department": row[4]
-            }
-            librarians.append(librarian)
-
-        return {"librarians": librarians}
+            {where}
+            ORDER BY {key.order_by()}
+            LIMIT ?
+        """, (*params, limit + 1)).fetchall()
+
+        total = None
+        if include_total:
+            total = conn.execute("SELECT COUNT(*) FROM librarian_information").fetchone()[0]
+        return rows, total
 
+    try:
+        key = resolve_sort(sort, LIBRARIAN_SORTS)
+
+        # 先查响应缓存，未命中再查数据库；任何管理员的增删改都会使整个列表失效
+        cache_key = ("all-librarians", sort, limit, cursor, include_total)
+        entry = profile_cache.get(cache_key)
+        if entry is None:
+            generation = profile_cache.generation
+            results, total = await db.run(_list, key)
+
+            next_cursor = None
+            if len(results) > limit:
+                results = results[:limit]
+                next_cursor = encode_cursor(sort, key.cursor_values(results[-1]))
+
+            # Format results as a list of dictionaries
+            librarians = []
+            for row in results:
+                librarian = {
+                    "id": row[0],  # Use "id" for frontend consistency
+                    "name": row[1],
+                    "email": row[2],
+                    "phone": row[3],
+                    "department": row[4]
+                }
+                librarians.append(librarian)
+
+            entry = profile_cache.put(cache_key, page_response("librarians", librarians, next_cursor, total),
+                                      [LIBRARIANS_TAG], generation)
+
+        return etag_response(request, entry)
+
+    except InvalidPageRequest as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except sqlite3.Error as e:
         logger.error(f"Database error in get_all_librarians: {e}")
         raise HTTPException(status_code=500, detail="Database error")
@@ -165,79 +200,49 @@ async def add_new_librarian(
     password: str = Form(...),
     email: str = Form(...),
     phone: str = Form(...),
-    department: str = Form(...)
+    department: str = Form(...),
+    db: Database = Depends(get_db)
 ):
-    try:
-        logger.info(f"[DEBUG] Received add-new-librarian request")
-        logger.info(f"[DEBUG] Parameters received - name: '{name}' (type: {type(name)}), password: '{password[:3]}...' (type: {type(password)}), email: '{email}' (type: {type(email)}), phone: '{phone}' (type: {type(phone)}), department: '{department}' (type: {type(department)})")
+    def _add(conn: sqlite3.Connection):
+        cursor = conn.cursor()
+
+        # 从编号序列中分配新的 admin_id
+        next_number = id_allocator.next_id(conn, LIBRARIAN_SEQUENCE)
+        logger.debug("Allocated admin_id %s", next_number)
+
+        # 插入新记录，包含生成的 admin_id
+        cursor.execute("""
+            INSERT INTO librarian_information(admin_id, name, password, email, phone, department)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (next_number, name, password_hash, email, phone, department))
+
+        # 记录审计日志
+        record_action(conn, "director", None, "create", "librarian", next_number, f"director add new librarian {next_number}")
+
+        # 提交后更新内存目录索引
+        row = fetch_librarian(conn, next_number)
+        db.after_commit(lambda: librarian_directory.upsert(row))
+        db.after_commit(lambda: profile_cache.invalidate(LIBRARIANS_TAG))
+
+        return next_number
 
+    try:
         # 检查参数是否为None
         params = {'name': name, 'password': password, 'email': email, 'phone': phone, 'department': department}
         for param_name, param_value in params.items():
             if param_value is None:
-                logger.error(f"[DEBUG] Parameter '{param_name}' is None")
                 raise HTTPException(status_code=422, detail=f"Parameter '{param_name}' cannot be null")
 
-        logger.info(f"Attempting to add new librarian: name={name}, email={email}, phone={phone}, department={department}")
-
-        conn = sqlite3.connect('library.db')
-        cursor = conn.cursor()
-        logger.info("[DEBUG] Database connection established")
-
-        # 获取当前最大序号，用于生成新的 admin_id
-        cursor.execute("SELECT MAX(admin_id) FROM librarian_information")
-        max_result = cursor.fetchone()[0]
-        logger.info(f"[DEBUG] Query result for MAX(admin_id): {max_result} (type: {type(max_result)})")
-        logger.info(f"Max admin_id from database: {max_result}")
-
-        if max_result is None:
-            # 如果还没有任何 librarian 记录，从 1 开始
-            next_number = 1
-            logger.info("No existing librarian records found, starting with next_number = 1")
-        else:
-            # 从最大 admin_id 值中计算下一个
-            # 确保max_result是整数类型
-            max_result_int = int(max_result) if max_result != '' else 0
-            next_number = max_result_int + 1
-            logger.info(f"Calculated next_number from existing records: {next_number}")
-
-        # 检查是否已有相同ID的管理员（以防万一）
-        cursor.execute("SELECT admin_id FROM librarian_information WHERE admin_id = ?", (next_number,))
-        existing = cursor.fetchone()
-        if existing:
-            logger.warning(f"[DEBUG] Admin ID {next_number} already exists! This shouldn't happen.")
-
-        # 插入新记录，包含生成的 admin_id
         # 如果 name 为空或默认值，使用默认名称
         if not name or name.strip() == "":
             name = "default user name, please edit it"
-            logger.info("Using default name for new librarian")
-
-        logger.info(f"[DEBUG] About to execute INSERT statement")
-        logger.info(f"Inserting new librarian with admin_id={next_number}, name={name}, email={email}, phone={phone}, department={department}")
-        cursor.execute("""
-            INSERT INTO librarian_information(admin_id, name, password, email, phone, department)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (next_number, name, password, email, phone, department))
-        logger.info(f"[DEBUG] INSERT statement executed successfully")
-
-        # 记录日志
-        from datetime import datetime
-        date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        operation = f"director add new librarian {next_number}"
-
-        cursor.execute("""
-            INSERT INTO operation_log (date, operation)
-            VALUES (?, ?)
-        """, (date, operation))
+            logger.debug("Using default name for new librarian")
 
-        conn.commit()
-        logger.info("[DEBUG] Transaction committed")
-        conn.close()
-        logger.info("[DEBUG] Database connection closed")
+        # 密码哈希在进程池中计算，不占用写线程
+        password_hash = await password_hasher.hash(password)
+        next_number = await db.transaction(_add)
 
-        logger.info(f"Successfully added new librarian with admin_id: {next_number}")
-        print(f"Add new librarian: {next_number}")
+        logger.info("Add new librarian: %s", next_number)
 
         return {
             "status": "success",
@@ -247,12 +252,10 @@ async def add_new_librarian(
 
     except sqlite3.Error as e:
         logger.error(f"Database error in add_new_librarian: {e}")
-        logger.exception("[DEBUG] Full database error traceback:")
         raise HTTPException(status_code=500, detail="Database error")
     except HTTPException:
         # 重新抛出HTTP异常
         raise
     except Exception as e:
         logger.error(f"Error adding librarian: {e}")
-        logger.exception("[DEBUG] Full error traceback:")
         raise HTTPException(status_code=500, detail="Server error")
\ No newline at end of file
@@ -1,76 +1,65 @@
 from annotated_types import Len
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends, Request
 import sqlite3
 import logging
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+from db import Database, get_db
+from services.directory_index import reader_directory, librarian_directory, fetch_reader, fetch_librarian
+from services.audit import record_action
+from services.id_allocator import id_allocator, format_reader_id, READER_SEQUENCE
+from services.passwords import password_hasher
+from services.response_cache import profile_cache, etag_response, reader_tag, admin_tag, LIBRARIANS_TAG
+
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 @router.get("/reader-log-up")
-async def register_reader(student_id: str, password: str):
-    try:
-        if len(student_id) != 9:
-            raise HTTPException(status_code=500, detail="ID must be 9 digits")
-
-        conn = sqlite3.connect('library.db')
+async def register_reader(student_id: str, password: str, db: Database = Depends(get_db)):
+    def _register(conn: sqlite3.Connection):
         cursor = conn.cursor()
 
         # 检查是否已存在相同的 student_id
         cursor.execute("SELECT 1 FROM reader_information WHERE student_id = ?", (student_id,))
         if cursor.fetchone():
-            conn.close()
             raise HTTPException(status_code=400, detail="this id already had an account")
 
-        # 获取当前最大序号，用于生成新的 reader_id
-        cursor.execute("SELECT MAX(reader_id) FROM reader_information WHERE reader_id LIKE 'reader %'")
-        max_result = cursor.fetchone()[0]
-
-        if max_result is None:
-            # 如果还没有任何 reader 记录，从 1 开始
-            next_number = 1
-        else:
-            # 从 'reader X' 格式中提取數字
-            try:
-                current_max_part = max_result.split(' ')[-1]  # 获取最后一个部分（数字）
-                current_max = int(current_max_part)
-                next_number = current_max + 1
-            except (ValueError, IndexError):
-                # 如果格式不正確，從1開始
-                next_number = 1
-
-        # 生成新的 reader_id
-        new_reader_id = f"reader {next_number}"
+        # 从编号序列中分配新的 reader_id
+        new_reader_id = format_reader_id(id_allocator.next_id(conn, READER_SEQUENCE))
 
         # 插入新記錄，包含生成的 reader_id
         name = "default user name, please edit it"
         cursor.execute("""
             INSERT INTO reader_information(reader_id, student_id, name, password)
             VALUES (?, ?, ?, ?)
-        """, (new_reader_id, student_id, name, password))
+        """, (new_reader_id, student_id, name, password_hash))
 
-        # 记录日志
-        from datetime import datetime
-        date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        operation = f"Student {student_id} logged up with reader_id {new_reader_id}"
+        # 记录审计日志
+        record_action(conn, "reader", student_id, "register", "reader", student_id, f"Student {student_id} logged up with reader_id {new_reader_id}")
 
-        cursor.execute("""
-            INSERT INTO operation_log (date, operation)
-            VALUES (?, ?)
-        """, (date, operation))
+        # 提交后更新内存目录索引
+        row = fetch_reader(conn, student_id)
+        db.after_commit(lambda: reader_directory.upsert(row))
 
-        conn.commit()
-        conn.close()
+        return new_reader_id
 
-        print(f"Registered new reader: {new_reader_id}, student_id: {student_id}")
+    try:
+        if len(student_id) != 9:
+            raise HTTPException(status_code=500, detail="ID must be 9 digits")
+
+        # 密码哈希在进程池中计算，不占用写线程
+        password_hash = await password_hasher.hash(password)
+        new_reader_id = await db.transaction(_register)
+
+        logger.info("Registered new reader: %s, student_id: %s", new_reader_id, student_id)
 
         return {
             "status": "success",
             "message": "Registration successful"
         }
 
+    except HTTPException:
+        raise
     except sqlite3.Error as e:
         logger.error(f"Database error in register_reader: {e}")
         raise HTTPException(status_code=500, detail="Database error")
@@ -79,42 +68,44 @@ async def register_reader(student_id: str, password: str):
         raise HTTPException(status_code=500, detail="Server error")
 
 @router.get("/reader-information")
-async def get_reader_information(student_id: str):
+async def get_reader_information(student_id: str, request: Request, db: Database = Depends(get_db)):
     """
     Get reader information by student ID
     Returns email and phone for the reader
     """
     try:
-        # Connect to SQLite database
-        conn = sqlite3.connect('library.db')
-        cursor = conn.cursor()
-        
-        # Query reader information by student ID
-        cursor.execute("""
-            SELECT student_id, name, email, phone
-            FROM reader_information
-            WHERE student_id = ?
-        """, (student_id,))
-        
-        result = cursor.fetchone()
-        conn.close()
-        
-        if not result:
-            raise HTTPException(status_code=404, detail="Reader not found")
-        
-        # Format the response
-        reader_info = {
-            "student_id": result[0],
-            "name": result[1],
-            "email": result[2],
-            "phone": result[3]
-        }
-        
-        # Print to backend console
-        print(f"Fetched information for student {student_id}: {reader_info}")
-        
-        return {"information": reader_info}
-        
+        # 先查响应缓存，未命中再查数据库
+        key = ("reader-information", student_id)
+        entry = profile_cache.get(key)
+        if entry is None:
+            generation = profile_cache.generation
+
+            # Query reader information by student ID
+            result = await db.fetch_one("""
+                SELECT student_id, name, email, phone
+                FROM reader_information
+                WHERE student_id = ?
+            """, (student_id,))
+
+            if not result:
+                raise HTTPException(status_code=404, detail="Reader not found")
+
+            # Format the response
+            reader_info = {
+                "student_id": result[0],
+                "name": result[1],
+                "email": result[2],
+                "phone": result[3]
+            }
+
+            logger.debug("Fetched information for student %s", student_id)
+
+            entry = profile_cache.put(key, {"information": reader_info}, [reader_tag(student_id)], generation)
+
+        return etag_response(request, entry)
+
+    except HTTPException:
+        raise
     except sqlite3.Error as e:
         logger.error(f"Database error in get_reader_information: {e}")
         raise HTTPException(status_code=500, detail="Database error")
@@ -124,15 +115,11 @@ async def get_reader_information(student_id: str):
 
 
 @router.get("/librarian-director-information")
-async def get_librarian_director_information(admin_id: str, role: str):
+async def get_librarian_director_information(admin_id: str, role: str, request: Request, db: Database = Depends(get_db)):
     """
     Get librarian or director information by admin ID
     """
     try:
-        # Connect to SQLite database
-        conn = sqlite3.connect('library.db')
-        cursor = conn.cursor()
-        
         # 根据角色选择表名
         if role == 'librarian':
             table_name = 'librarian_information'
@@ -140,33 +127,37 @@ async def get_librarian_director_information(admin_id: str, role: str):
             table_name = 'director_information'
         else:
             raise HTTPException(status_code=400, detail="Invalid role. Must be 'librarian' or 'director'")
-        
-        # Query admin information by admin ID
-        cursor.execute(f"""
-            SELECT admin_id, name, email, phone
-            FROM {table_name}
-            WHERE admin_id = ?
-        """, (admin_id,))
-        
-        result = cursor.fetchone()
-        conn.close()
-        
-        if not result:
-            raise HTTPException(status_code=404, detail=f"{role.capitalize()} not found")
-        
-        # Format the response
-        admin_info = {
-            "admin_id": result[0],
-            "name": result[1],
-            "email": result[2] if result[2] else '',
-            "phone": result[3] if result[3] else ''
-        }
-        
-        # Print to backend console
-        print(f"Fetched information for {role} {admin_id}: {admin_info}")
-        
-        return {"information": admin_info}
-        
+
+        # 先查响应缓存，未命中再查数据库
+        key = ("librarian-director-information", role, admin_id)
+        entry = profile_cache.get(key)
+        if entry is None:
+            generation = profile_cache.generation
+
+            # Query admin information by admin ID
+            result = await db.fetch_one(f"""
+                SELECT admin_id, name, email, phone
+                FROM {table_name}
+                WHERE admin_id = ?
+            """, (admin_id,))
+
+            if not result:
+                raise HTTPException(status_code=404, detail=f"{role.capitalize()} not found")
+
+            # Format the response
+            admin_info = {
+                "admin_id": result[0],
+                "name": result[1],
+                "email": result[2] if result[2] else '',
+                "phone": result[3] if result[3] else ''
+            }
+
+            logger.debug("Fetched information for %s %s", role, admin_id)
+
+            entry = profile_cache.put(key, {"information": admin_info}, [admin_tag(role, admin_id)], generation)
+
+        return etag_response(request, entry)
+
     except HTTPException:
         raise
     except sqlite3.Error as e:
@@ -184,16 +175,14 @@ class UpdateReaderInfoRequest(BaseModel):
     name: Optional[str] = None
     email: Optional[str] = None
     phone: Optional[str] = None
-    
+
 
 @router.post("/update-reader-information")
-async def update_reader_information(request: UpdateReaderInfoRequest):
+async def update_reader_information(request: UpdateReaderInfoRequest, db: Database = Depends(get_db)):
     """
     Update reader information
     """
-    try:
-
-        conn = sqlite3.connect('library.db')
+    def _update(conn: sqlite3.Connection):
         cursor = conn.cursor()
 
 
@@ -214,7 +203,6 @@ async def update_reader_information(request: UpdateReaderInfoRequest):
             params.append(request.phone)
 
         if not updates:
-            conn.close()
             raise HTTPException(status_code=400, detail="No fields to update")
 
         # Add student_id to the end of params for WHERE clause
@@ -224,34 +212,29 @@ async def update_reader_information(request: UpdateReaderInfoRequest):
         cursor.execute(query, params)
 
         if cursor.rowcount == 0:
-            conn.close()
             raise HTTPException(status_code=404, detail="Reader not found")
-        
-        # 记录日志
-        from datetime import datetime
-        date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        operation = f"Student {request.student_id} updated the personal information"
 
-        cursor.execute("""
-            INSERT INTO operation_log (date, operation)
-            VALUES (?, ?)
-        """, (date, operation))
+        # 记录审计日志
+        record_action(conn, "reader", request.student_id, "update", "reader", request.student_id, f"Student {request.student_id} updated the personal information")
 
-        conn.commit()
-        conn.close()
+        row = fetch_reader(conn, request.student_id)
+        db.after_commit(lambda: reader_directory.upsert(row))
+        db.after_commit(lambda: profile_cache.invalidate(reader_tag(request.student_id)))
+
+    try:
+        await db.transaction(_update)
 
-        # Print to backend console
-        update_data = {"student_id": request.student_id}
-        if request.name: update_data["name"] = request.name
-        if request.email: update_data["email"] = request.email
-        if request.phone: update_data["phone"] = request.phone
-        print(f"Updated information for student {request.student_id}: {update_data}")
+        # 只记录修改了哪些字段，联系方式不写进日志
+        changed = [field for field in ("name", "email", "phone") if getattr(request, field)]
+        logger.info("Updated information for student %s: %s", request.student_id, ", ".join(changed))
 
         return {
             "status": "success",
             "message": "Reader information updated successfully"
         }
 
+    except HTTPException:
+        raise
     except sqlite3.Error as e:
         logger.error(f"Database error in update_reader_information: {e}")
         raise HTTPException(status_code=500, detail="Database error")
@@ -265,15 +248,14 @@ class UpdateLibrarianDirectorInfoRequest(BaseModel):
     name: Optional[str] = None
     email: Optional[str] = None
     phone: Optional[str] = None
-    
+
 
 @router.post("/update-librarian-director-information")
-async def update_librarian_director_information(request: UpdateLibrarianDirectorInfoRequest):
+async def update_librarian_director_information(request: UpdateLibrarianDirectorInfoRequest, db: Database = Depends(get_db)):
     """
     Update librarian or director information
     """
-    try:
-        conn = sqlite3.connect('library.db')
+    def _update(conn: sqlite3.Connection):
         cursor = conn.cursor()
 
         # 根据角色选择表名
@@ -282,13 +264,11 @@ async def update_librarian_director_information(request: UpdateLibrarianDirector
         elif request.role == 'director':
             table_name = 'director_information'
         else:
-            conn.close()
             raise HTTPException(status_code=400, detail="Invalid role. Must be 'librarian' or 'director'")
 
         # 检查用户是否存在
         cursor.execute(f"SELECT 1 FROM {table_name} WHERE admin_id = ?", (request.admin_id,))
         if not cursor.fetchone():
-            conn.close()
             raise HTTPException(status_code=404, detail=f"{request.role.capitalize()} not found")
 
         updates = []
@@ -308,7 +288,6 @@ async def update_librarian_director_information(request: UpdateLibrarianDirector
             params.append(request.phone)
 
         if not updates:
-            conn.close()
             raise HTTPException(status_code=400, detail="No fields to update")
 
         # 添加 admin_id 到参数列表用于 WHERE 子句
@@ -319,27 +298,25 @@ async def update_librarian_director_information(request: UpdateLibrarianDirector
         cursor.execute(query, params)
 
         if cursor.rowcount == 0:
-            conn.close()
             raise HTTPException(status_code=404, detail=f"{request.role.capitalize()} not found")
-        
-        from datetime import datetime
-        date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        operation = f"Librarian {request.admin_id} update personal information"
 
-        cursor.execute("""
-            INSERT INTO operation_log (date, operation)
-            VALUES (?, ?)
-        """, (date, operation))
+        # 记录审计日志
+        record_action(conn, request.role, request.admin_id, "update", request.role, request.admin_id, f"{request.role.capitalize()} {request.admin_id} update personal information")
+
+        # 目录索引只收录图书管理员
+        if table_name == 'librarian_information':
+            row = fetch_librarian(conn, request.admin_id)
+            db.after_commit(lambda: librarian_directory.upsert(row))
+            db.after_commit(lambda: profile_cache.invalidate(admin_tag("librarian", request.admin_id), LIBRARIANS_TAG))
+        else:
+            db.after_commit(lambda: profile_cache.invalidate(admin_tag("director", request.admin_id)))
 
-        conn.commit()
-        conn.close()
+    try:
+        await db.transaction(_update)
 
-        # Print to backend console
-        update_data = {"admin_id": request.admin_id}
-        if request.name: update_data["name"] = request.name
-        if request.email: update_data["email"] = request.email
-        if request.phone: update_data["phone"] = request.phone
-        print(f"Updated information for {request.role} {request.admin_id}: {update_data}")
+        # 只记录修改了哪些字段，联系方式不写进日志
+        changed = [field for field in ("name", "email", "phone") if getattr(request, field)]
+        logger.info("Updated information for %s %s: %s", request.role, request.admin_id, ", ".join(changed))
 
         return {
             "status": "success",
@@ -353,4 +330,4 @@ async def update_librarian_director_information(request: UpdateLibrarianDirector
         raise HTTPException(status_code=500, detail="Database error")
     except Exception as e:
         logger.error(f"Error updating {request.role} information: {e}")
-        raise HTTPException(status_code=500, detail="Server error")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Server error")
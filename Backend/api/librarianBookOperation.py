@@ -1,10 +1,27 @@
 from annotated_types import Len
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends, File, UploadFile, Query
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import iterate_in_threadpool
+from typing import AsyncIterator
+import json
+import os
 import sqlite3
 import logging
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+from db import Database, get_db, writer
+from db.pagination import (
+    DEFAULT_LIMIT, MAX_LIMIT, InvalidPageRequest, SortKey,
+    resolve_sort, where_sql, encode_cursor, decode_cursor, page_response,
+)
+from services.circulation import report_counts
+from services.audit import record_action, day_start, day_end
+from services.catalog_import import ImportFormatError, detect_format, read_rows, validate_book, insert_books, run_import
+from services.search_cache import catalog_version
+from services.catalog_snapshot import catalog_snapshot, BOOK_COLUMNS
+from services.activity_calendar import calendar_cache
+from services.response_cache import reader_tag
+from services.overdue import overdue_as_of
+
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
@@ -23,6 +40,19 @@ class UpdateBookRequest(BaseModel):
 
 
 
+def fetch_book(conn: sqlite3.Connection, book_id: int) -> Optional[tuple]:
+    return conn.execute(f"SELECT {', '.join(BOOK_COLUMNS)} FROM book WHERE book_id = ?", (book_id,)).fetchone()
+
+
+def _import_chunk(conn: sqlite3.Connection, books: list[tuple], numbers: list[int]) -> tuple:
+    first_id, last_id, rejected = insert_books(conn, books, numbers)
+    # 同一块的 book_id 连续，提交后按顺序写入内存快照，并使缓存的搜索结果失效
+    rows = [(first_id + offset, *book) for offset, book in enumerate(books)]
+    writer.after_commit(lambda: catalog_snapshot.upsert_many(rows))
+    writer.after_commit(catalog_version.bump)
+    return first_id, last_id, rejected
+
+
 @router.get("/libarian-add-books")
 async def add_new_books(
         book_name: str,
@@ -30,43 +60,33 @@ async def add_new_books(
         publisher: str,
         publish_year: str,
         location: str,
-        if_available: int
+        if_available: int,
+        db: Database = Depends(get_db)
     ):
-    try:
-
-        conn = sqlite3.connect('library.db')
+    def _add(conn: sqlite3.Connection):
         cursor = conn.cursor()
 
-        # 获取当前最大序号，用于生成新的 reader_id
-        cursor.execute("SELECT MAX(book_id) FROM book")
-        max_result = cursor.fetchone()[0]
-
-        if max_result is None:
-            # 如果还没有任何 reader 记录，从 1 开始
-            new_book_id = 1
-        else:
-            new_book_id = max_result + 1
-
-
+        # book_id 为 AUTOINCREMENT，由数据库分配
         cursor.execute("""
-            INSERT INTO book(book_id, book_name, author, publisher, publish_year, location, if_available)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (new_book_id, book_name, author, publisher, publish_year, location, if_available))
+            INSERT INTO book(book_name, author, publisher, publish_year, location, if_available)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (book_name, author, publisher, publish_year, location, if_available))
+        new_book_id = cursor.lastrowid
 
-        from datetime import datetime
-        # 记录日志
-        date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        operation = f"librarian add book {new_book_id}"
+        # 记录审计日志
+        record_action(conn, "librarian", None, "create", "book", new_book_id, f"librarian add book {new_book_id}")
 
-        cursor.execute("""
-            INSERT INTO operation_log (date, operation)
-            VALUES (?, ?)
-        """, (date, operation))
+        # 提交后先写入内存快照（按数据库中保存的值），再使缓存的搜索结果失效
+        row = fetch_book(conn, new_book_id)
+        db.after_commit(lambda: catalog_snapshot.upsert(row))
+        db.after_commit(catalog_version.bump)
 
-        conn.commit()
-        conn.close()
+        return new_book_id
 
-        print(f"book successfully added: {new_book_id}")
+    try:
+        new_book_id = await db.transaction(_add)
+
+        logger.info("book successfully added: %s", new_book_id)
 
         return {
             "status": "success",
@@ -74,26 +94,73 @@ async def add_new_books(
         }
 
     except sqlite3.Error as e:
-        logger.error(f"Database error in register_reader: {e}")
+        logger.error(f"Database error in add_new_books: {e}")
+        raise HTTPException(status_code=500, detail="Database error")
+    except Exception as e:
+        logger.error(f"Error adding book: {e}")
+        raise HTTPException(status_code=500, detail="Server error")
+
+
+@router.post("/import-books")
+async def import_books(
+        file: UploadFile = File(...),
+        format: Optional[str] = None,
+        dry_run: bool = False,
+        db: Database = Depends(get_db)
+    ):
+    """
+    Bulk-import books from an uploaded CSV, JSON or XLSX file
+    The format comes from the file extension unless `format` is given. The
+    response is NDJSON: one progress line per committed chunk, with the errors
+    of the rows in that chunk, then a "done" line with the totals
+    """
+    def _write(books: list[tuple], numbers: list[int]) -> tuple:
+        # 在线程池中调用，等待写线程提交这一块
+        return db.writer.submit(_import_chunk, books, numbers).result()
+
+    async def _lines(events) -> AsyncIterator[str]:
+        started = False
+        try:
+            async for event in iterate_in_threadpool(events):
+                started = True
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        except ImportFormatError as e:
+            if not started:
+                raise
+            # 已经开始输出，只能在最后一行报告错误
+            yield json.dumps({"event": "failed", "error": str(e)}, ensure_ascii=False) + "\n"
+
+    try:
+        fmt = detect_format(file.filename, format)
+
+        events = run_import(read_rows(file.file, fmt), validate_book, _write, dry_run=dry_run)
+        body = await _start_stream(_lines(events))
+
+        logger.info("Importing books from %s (%s)%s", file.filename, fmt, " (dry run)" if dry_run else "")
+
+        return StreamingResponse(body, media_type="application/x-ndjson")
+
+    except ImportFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except sqlite3.Error as e:
+        logger.error(f"Database error in import_books: {e}")
         raise HTTPException(status_code=500, detail="Database error")
     except Exception as e:
-        logger.error(f"Error registering reader: {e}")
+        logger.error(f"Error importing books: {e}")
         raise HTTPException(status_code=500, detail="Server error")
 
 
 @router.post("/update-book")
-async def update_book(request: UpdateBookRequest):
+async def update_book(request: UpdateBookRequest, db: Database = Depends(get_db)):
     """
     Update book information by librarian
     """
-    try:
-        conn = sqlite3.connect('library.db')
+    def _update(conn: sqlite3.Connection):
         cursor = conn.cursor()
 
         # 检查图书是否存在
         cursor.execute("SELECT 1 FROM book WHERE book_id = ?", (request.book_id,))
         if not cursor.fetchone():
-            conn.close()
             raise HTTPException(status_code=404, detail="Book not found")
 
         # 构建更新语句
@@ -125,7 +192,6 @@ async def update_book(request: UpdateBookRequest):
             params.append(request.if_available)
 
         if not updates:
-            conn.close()
             raise HTTPException(status_code=400, detail="No fields to update")
 
         # 添加 book_id 到参数列表用于 WHERE 子句
@@ -135,19 +201,18 @@ async def update_book(request: UpdateBookRequest):
         query = f"UPDATE book SET {', '.join(updates)} WHERE book_id = ?"
         cursor.execute(query, params)
         
-        from datetime import datetime
-        date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        operation = f"librarian update book {request.book_id}"
+        # 记录审计日志
+        record_action(conn, "librarian", None, "update", "book", request.book_id, f"librarian update book {request.book_id}")
 
-        cursor.execute("""
-            INSERT INTO operation_log (date, operation)
-            VALUES (?, ?)
-        """, (date, operation))
+        # 提交后先更新内存快照，再使缓存的搜索结果失效
+        row = fetch_book(conn, request.book_id)
+        db.after_commit(lambda: catalog_snapshot.upsert(row))
+        db.after_commit(catalog_version.bump)
 
-        conn.commit()
-        conn.close()
+    try:
+        await db.transaction(_update)
 
-        print(f"Updated book information for book_id: {request.book_id}")
+        logger.info("Updated book information for book_id: %s", request.book_id)
 
         return {
             "status": "success",
@@ -165,13 +230,12 @@ async def update_book(request: UpdateBookRequest):
 
 
 @router.delete("/delete-book")
-async def delete_book(book_id: int):
+async def delete_book(book_id: int, db: Database = Depends(get_db)):
     """
     Delete a book by book_id
     Note: This will also delete related borrow records due to foreign key constraints
     """
-    try:
-        conn = sqlite3.connect('library.db')
+    def _delete(conn: sqlite3.Connection):
         cursor = conn.cursor()
 
         # 检查图书是否存在
@@ -179,7 +243,6 @@ async def delete_book(book_id: int):
         result = cursor.fetchone()
         
         if not result:
-            conn.close()
             raise HTTPException(status_code=404, detail="Book not found")
 
         book_name = result[0]
@@ -192,34 +255,37 @@ async def delete_book(book_id: int):
         
         active_borrowings = cursor.fetchone()[0]
         if active_borrowings > 0:
-            conn.close()
             raise HTTPException(
                 status_code=400, 
                 detail=f"Cannot delete book with {active_borrowings} active borrowing(s). Please return all books first."
             )
 
         # 删除借阅记录（先删除依赖记录）
-        cursor.execute("DELETE FROM borrow_record WHERE book_id = ?", (book_id,))
+        cursor.execute("DELETE FROM borrow_record WHERE book_id = ? RETURNING student_id", (book_id,))
+        # 这些读者已缓存的活动日历中包含被删除的借阅记录
+        readers = {row[0] for row in cursor.fetchall()}
 
         # 删除图书信息
         cursor.execute("DELETE FROM book WHERE book_id = ?", (book_id,))
 
         if cursor.rowcount == 0:
-            conn.close()
             raise HTTPException(status_code=404, detail="Book not found")
 
-        from datetime import datetime
-        date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        operation = f"librarian delete the book has ID = {book_id}"
+        # 记录审计日志
+        record_action(conn, "librarian", None, "delete", "book", book_id, f"librarian delete the book has ID = {book_id}")
 
-        cursor.execute("""
-            INSERT INTO operation_log (date, operation)
-            VALUES (?, ?)
-        """, (date, operation))
-        conn.commit()
-        conn.close()
+        # 提交后先更新内存快照，再使缓存的搜索结果失效
+        db.after_commit(lambda: catalog_snapshot.remove(book_id))
+        db.after_commit(catalog_version.bump)
+        if readers:
+            db.after_commit(lambda: calendar_cache.invalidate(*map(reader_tag, readers)))
+
+        return book_name
+
+    try:
+        book_name = await db.transaction(_delete)
 
-        print(f"Deleted book: {book_id}, book_name: {book_name}")
+        logger.info("Deleted book: %s, book_name: %s", book_id, book_name)
 
         return {
             "status": "success",
@@ -237,101 +303,111 @@ async def delete_book(book_id: int):
     
 
 
+# 流式输出时每次从游标读取的行数
+STREAM_BATCH = int(os.environ.get("LIBRARY_STREAM_BATCH", "500"))
+
+# 报表明细各部分：(统计字段名, 查询语句, 明细列名, 是否按日期过滤)
+REPORT_SECTIONS = [
+    # Books not returned until today (all time)
+    ("books didn't return until today", """
+        SELECT b.book_name, b.author, br.student_id, br.borrow_date, br.due_date
+        FROM borrow_record br
+        JOIN book b ON br.book_id = b.book_id
+        WHERE br.return_date IS NULL OR br.return_date = ''
+    """, ("book_name", "author", "student_id", "borrow_date", "due_date"), False),
+    # Books borrowed today
+    ("books borrowed today", """
+        SELECT b.book_name, b.author, br.student_id, br.borrow_date, br.due_date
+        FROM borrow_record br
+        JOIN book b ON br.book_id = b.book_id
+        WHERE DATE(br.borrow_date) = DATE(?)
+    """, ("book_name", "author", "student_id", "borrow_date", "due_date"), True),
+    # Overdue books as of the provided date
+    ("overdue_books", """
+        SELECT b.book_name, b.author, br.student_id, br.borrow_date, br.due_date
+        FROM borrow_record br
+        JOIN book b ON br.book_id = b.book_id
+        WHERE (br.return_date IS NULL OR br.return_date = '')
+        AND br.due_date < DATE(?)
+    """, ("book_name", "author", "student_id", "borrow_date", "due_date"), True),
+    # Books returned today
+    ("books returned today", """
+        SELECT b.book_name, b.author, br.student_id, br.borrow_date, br.return_date
+        FROM borrow_record br
+        JOIN book b ON br.book_id = b.book_id
+        WHERE DATE(br.return_date) = DATE(?)
+    """, ("book_name", "author", "student_id", "borrow_date", "return_date"), True),
+]
+
+
+def _json_array(cursor: sqlite3.Cursor, columns: tuple):
+    """
+    Yield the cursor rows as a JSON array of objects, STREAM_BATCH rows per chunk
+    Returns the number of rows written
+    """
+    count = 0
+    yield "["
+    while True:
+        rows = cursor.fetchmany(STREAM_BATCH)
+        if not rows:
+            break
+        chunk = ", ".join(json.dumps(dict(zip(columns, row)), ensure_ascii=False) for row in rows)
+        yield (", " if count else "") + chunk
+        count += len(rows)
+    yield "]"
+    return count
+
+
+async def _start_stream(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """
+    Pull the first chunk before the response starts, so a query that fails
+    right away still turns into a normal error response
+    """
+    first = await chunks.__anext__()
+
+    async def _body():
+        yield first
+        try:
+            async for chunk in chunks:
+                yield chunk
+        except Exception as e:
+            logger.error(f"Streaming response aborted: {e}")
+            raise
+
+    return _body()
+
+
 @router.get("/view-report")
-async def view_library_report(date: str):
+async def view_library_report(date: str, details: bool = False, db: Database = Depends(get_db)):
     """
     View library report including return books, No returns, borrowed books, and overdue books
+    The counts come from the daily_circulation summary; with details=true the
+    detail lists follow, streamed straight from the cursors
     """
-    try:
-        conn = sqlite3.connect('library.db')
-        cursor = conn.cursor()
+    def _report(conn: sqlite3.Connection):
+        counts = report_counts(conn, date)
+        yield "{" + ", ".join(f"{json.dumps(name)}: {count}" for name, count in counts.items())
+        for name, sql, columns, by_date in REPORT_SECTIONS:
+            yield f", {json.dumps(f'{name} detail')}: "
+            yield from _json_array(conn.execute(sql, (date,) if by_date else ()), columns)
+        yield "}"
 
-        # Books not returned until today (all time)
-        cursor.execute("""
-            SELECT b.book_name, b.author, br.student_id, br.borrow_date, br.due_date
-            FROM borrow_record br
-            JOIN book b ON br.book_id = b.book_id
-            WHERE br.return_date IS NULL OR br.return_date = ''
-        """)
-        no_return_books_detail = cursor.fetchall()
-        no_return_books = len(no_return_books_detail)
-
-        # Books borrowed today
-        cursor.execute("""
-            SELECT b.book_name, b.author, br.student_id, br.borrow_date, br.due_date
-            FROM borrow_record br
-            JOIN book b ON br.book_id = b.book_id
-            WHERE DATE(br.borrow_date) = DATE(?)
-        """, (date,))
-        borrowed_books_detail = cursor.fetchall()
-        borrowed_books = len(borrowed_books_detail)
-
-        # Books returned today
-        cursor.execute("""
-            SELECT b.book_name, b.author, br.student_id, br.borrow_date, br.return_date
-            FROM borrow_record br
-            JOIN book b ON br.book_id = b.book_id
-            WHERE DATE(br.return_date) = DATE(?)
-        """, (date,))
-        returned_books_detail = cursor.fetchall()
-        returned_books = len(returned_books_detail)
-
-        # Overdue books as of the provided date
-        cursor.execute("""
-            SELECT b.book_name, b.author, br.student_id, br.borrow_date, br.due_date
-            FROM borrow_record br
-            JOIN book b ON br.book_id = b.book_id
-            WHERE (br.return_date IS NULL OR br.return_date = '')
-            AND br.due_date < DATE(?)
-        """, (date,))
-        overdue_books_detail = cursor.fetchall()
-        overdue_books = len(overdue_books_detail)
+    try:
+        # 无法解析的日期会让 DATE(?) 为 NULL，逾期数随之出错
+        try:
+            day_start(date)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="date must be YYYY-MM-DD")
+        date = date[:10]
 
-        conn.close()
+        if not details:
+            return await db.run(report_counts, date)
 
-        return {
-            "books didn't return until today": no_return_books,
-            "books didn't return until today detail": [
-                {
-                    "book_name": row[0],
-                    "author": row[1],
-                    "student_id": row[2],
-                    "borrow_date": row[3],
-                    "due_date": row[4]
-                } for row in no_return_books_detail
-            ],
-            "books borrowed today": borrowed_books,
-            "books borrowed today detail": [
-                {
-                    "book_name": row[0],
-                    "author": row[1],
-                    "student_id": row[2],
-                    "borrow_date": row[3],
-                    "due_date": row[4]
-                } for row in borrowed_books_detail
-            ],
-            "overdue_books": overdue_books,
-            "overdue_books detail": [
-                {
-                    "book_name": row[0],
-                    "author": row[1],
-                    "student_id": row[2],
-                    "borrow_date": row[3],
-                    "due_date": row[4]
-                } for row in overdue_books_detail
-            ],
-            "books returned today": returned_books,
-            "books returned today detail": [
-                {
-                    "book_name": row[0],
-                    "author": row[1],
-                    "student_id": row[2],
-                    "borrow_date": row[3],
-                    "return_date": row[4]
-                } for row in returned_books_detail
-            ]
-        }
+        body = await _start_stream(db.stream(_report))
+        return StreamingResponse(body, media_type="application/json")
 
+    except HTTPException:
+        raise
     except sqlite3.Error as e:
         logger.error(f"Database error in view_library_report: {e}")
         raise HTTPException(status_code=500, detail="Database error")
@@ -339,31 +415,127 @@ async def view_library_report(date: str):
         logger.error(f"Error viewing library report: {e}")
         raise HTTPException(status_code=500, detail="Server error")
 
-@router.get("/view-library-logs")
-async def view_library_logs(date: str):
+# 逾期天数 = as_of - due_date，按逾期天数排序就是按 due_date 排序（record_id 作为决胜列）
+OVERDUE_SORTS = {
+    "-days_overdue": SortKey("o.due_date", "o.record_id"),
+    "days_overdue": SortKey("o.due_date", "o.record_id", descending=True),
+}
+
+
+@router.get("/overdue")
+async def list_overdue(
+    student_id: Optional[str] = None,
+    sort: str = "-days_overdue",
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    cursor: Optional[str] = None,
+    include_total: bool = True,
+    db: Database = Depends(get_db),
+):
+    """
+    Loans still out past their due date, read from the overdue_loan set
+    sort: -days_overdue (most overdue first) or days_overdue
+    as_of is the day the set was last rolled to; days_overdue counts from it
+    """
+    def _list(conn: sqlite3.Connection, key: SortKey):
+        after = decode_cursor(cursor, sort, len(key.columns))
+        where, params = [], []
+        if student_id is not None:
+            where.append("o.student_id = ?")
+            params.append(student_id)
+        page_where, page_params = list(where), list(params)
+        if after is not None:
+            page_where.append(key.seek())
+            page_params.extend(after)
+
+        as_of = overdue_as_of(conn)
+        rows = conn.execute(f"""
+            SELECT
+                o.record_id,
+                o.student_id,
+                o.book_id,
+                b.book_name,
+                b.author,
+                br.borrow_date,
+                o.due_date,
+                br.renew,
+                CAST(JULIANDAY(?) - JULIANDAY(o.due_date) AS INTEGER) AS days_overdue
+            FROM overdue_loan o
+            JOIN borrow_record br ON br.record_id = o.record_id
+            JOIN book b ON b.book_id = o.book_id
+            {where_sql(page_where)}
+            ORDER BY {key.order_by()}
+            LIMIT ?
+        """, (as_of, *page_params, limit + 1)).fetchall()
+
+        total = None
+        if include_total:
+            total = conn.execute(f"SELECT COUNT(*) FROM overdue_loan o {where_sql(where)}", params).fetchone()[0]
+        return as_of, rows, total
+
     try:
-        conn = sqlite3.connect('library.db')
-        cursor = conn.cursor()
+        key = resolve_sort(sort, OVERDUE_SORTS)
+        as_of, rows, total = await db.run(_list, key)
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(sort, key.cursor_values(rows[-1]))
+
+        loans = [
+            {
+                "record_id": row[0],
+                "student_id": row[1],
+                "book_id": row[2],
+                "book_name": row[3],
+                "author": row[4],
+                "borrow_date": row[5],
+                "due_date": row[6],
+                "renew": row[7],
+                "days_overdue": row[8],
+            }
+            for row in rows
+        ]
+
+        logger.debug("Found %d overdue loans as of %s", len(loans), as_of)
+
+        return {"as_of": as_of, **page_response("overdue", loans, next_cursor, total)}
+
+    except InvalidPageRequest as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except sqlite3.Error as e:
+        logger.error(f"Database error in list_overdue: {e}")
+        raise HTTPException(status_code=500, detail="Database error")
+    except Exception as e:
+        logger.error(f"Error listing overdue loans: {e}")
+        raise HTTPException(status_code=500, detail="Server error")
 
-        
-        cursor.execute("""
-            SELECT date, operation FROM operation_log
-            WHERE DATE(date) = DATE(?)
-            ORDER BY date ASC
-        """, (date,))
 
-        rows = cursor.fetchall()
-        conn.close()
+@router.get("/view-library-logs")
+async def view_library_logs(date: str, db: Database = Depends(get_db)):
+    def _logs(conn: sqlite3.Connection, start: int, end: int):
+        yield "{" + f'"date": {json.dumps(date, ensure_ascii=False)}, "logs": '
+        yield from _json_array(conn.execute("""
+            SELECT datetime(ts, 'unixepoch', 'localtime') AS date, message AS operation
+            FROM audit_log
+            WHERE ts >= ? AND ts < ?
+            ORDER BY ts ASC, audit_id ASC
+        """, (start, end)), ("date", "operation"))
+        yield "}"
 
-        logs = [{"date": r[0], "operation": r[1]} for r in rows]
+    try:
+        try:
+            start, end = day_start(date), day_end(date)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="date must be YYYY-MM-DD")
 
-        return {"date": date, "logs": logs}
+        body = await _start_stream(db.stream(_logs, start, end))
+        return StreamingResponse(body, media_type="application/json")
 
+    except HTTPException:
+        raise
     except sqlite3.Error as e:
         logger.error(f"Database error in view_library_logs: {e}")
         raise HTTPException(status_code=500, detail="Database error")
     except Exception as e:
         logger.error(f"Error viewing library logs: {e}")
         raise HTTPException(status_code=500, detail="Server error")
-        
-
@@ -1,12 +1,23 @@
 from annotated_types import Len
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends, Query, File, UploadFile
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import Optional
 import sqlite3
 import logging
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+from db import Database, get_db
+from db.pagination import DEFAULT_LIMIT, MAX_LIMIT, InvalidPageRequest, encode_cursor, decode_cursor, page_response
+from services.directory_index import reader_directory, fetch_reader
+from services.audit import record_action
+from services.catalog_import import ImportFormatError, detect_format, read_rows, run_import
+from services.reader_enrollment import reader_validator, enroll_readers, hash_roster_passwords
+from services.id_allocator import id_allocator, format_reader_id, READER_SEQUENCE
+from services.passwords import password_hasher
+from services.sessions import session_store
+from services.response_cache import profile_cache, reader_tag
+from services.activity_calendar import calendar_cache
+
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
@@ -21,47 +32,32 @@ class UpdateReaderRequest(BaseModel):
     major: Optional[str] = None
 
 @router.get("/search-readers")
-async def search_readers(query: str):
+async def search_readers(
+    query: str,
+    sort: str = "relevance",
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    cursor: Optional[str] = None,
+    include_total: bool = True,
+    db: Database = Depends(get_db),
+):
     """
     search readers
+    sort: relevance (exact matches first), reader_id, student_id or name
+    Pass the returned next_cursor back as cursor to get the following page
     """
     try:
+        after = decode_cursor(cursor, sort, 3 if sort == "relevance" else 2)
 
-        conn = sqlite3.connect('library.db')
-        cursor = conn.cursor()
-        
-        # Search for books by book_id, book_name, or author
-        cursor.execute("""
-            SELECT reader_id, student_id, name, email, phone, department, major
-            FROM reader_information 
-            WHERE student_id LIKE ? OR name LIKE ? OR phone LIKE ? OR email LIKE ? OR department LIKE ? OR major LIKE ?
-            ORDER BY reader_id
-        """, (f'%{query}%', f'%{query}%', f'%{query}%', f'%{query}%', f'%{query}%', f'%{query}%'))
-        
-        results = cursor.fetchall()
-        conn.close()
-        
-        # Format results as a list of dictionaries
-        readers = []
-        for row in results:
-            reader = {
-                "reader_id": row[0],
-                "student_id": row[1],
-                "name": row[2],
-                "email": row[3],
-                "phone": row[4],
-                "department": row[5],
-                "major": row[6]
-            }
-            readers.append(reader)
-        
-        # Print results to backend console
-        print(f"Search results for '{query}': {len(readers)} readers found")
-        for reader in readers:
-            print(reader)
-        
-        return {"readers": readers}
-        
+        # 在内存目录索引中按学号、电话、邮箱、姓名等做精确/前缀匹配，不访问数据库；在线程池中执行，不阻塞事件循环
+        readers, last, total = await run_in_threadpool(reader_directory.search, query, sort, after, limit, include_total)
+        next_cursor = encode_cursor(sort, last) if last else None
+
+        logger.debug("Reader search: %d of %s readers returned", len(readers), total)
+
+        return page_response("readers", readers, next_cursor, total)
+
+    except InvalidPageRequest as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except sqlite3.Error as e:
         logger.error(f"Database error in search_readers: {e}")
         raise HTTPException(status_code=500, detail="Database error")
@@ -72,169 +68,139 @@ async def search_readers(query: str):
 
 
 @router.get("/add-new-reader")
-async def add_new_reader(student_id: str, name: str, password: str, email: str, phone: str, department: str, major: str):
-    try:
-        logger.info(f"Attempting to add new reader with student_id: {student_id}, name: {name}")
-
-        if len(student_id) != 9:
-            logger.warning(f"Invalid student_id length: {student_id} (length: {len(student_id)})")
-            raise HTTPException(status_code=400, detail="ID must be 9 digits")
-
-        conn = sqlite3.connect('library.db')
+async def add_new_reader(student_id: str, name: str, password: str, email: str, phone: str, department: str, major: str, db: Database = Depends(get_db)):
+    def _add(conn: sqlite3.Connection):
         cursor = conn.cursor()
 
-        logger.info("Connected to database successfully")
-
         # 检查是否已存在相同的 student_id
         cursor.execute("SELECT 1 FROM reader_information WHERE student_id = ?", (student_id,))
         existing_record = cursor.fetchone()
-        logger.info(f"Check for existing student_id {student_id}, found: {existing_record is not None}")
 
         if existing_record:
-            conn.close()
-            logger.warning(f"Student_id {student_id} already exists in database")
+            logger.debug("student_id %s already has an account", student_id)
             raise HTTPException(status_code=400, detail="this id already had an account")
 
-        # 获取当前最大序号，用于生成新的 reader_id
-        # 先查找所有"Reader X"格式的ID，按数值排序获取最大值
-        cursor.execute("SELECT reader_id FROM reader_information WHERE reader_id LIKE 'Reader %' ORDER BY CAST(SUBSTR(reader_id, 8) AS INTEGER) DESC LIMIT 1")
-        fetch_result = cursor.fetchone()
-        max_reader_result = fetch_result[0] if fetch_result else None
-
-        # 检查是否有非"Reader X"格式的ID
-        cursor.execute("SELECT reader_id FROM reader_information WHERE reader_id NOT LIKE 'Reader %' ORDER BY reader_id DESC LIMIT 1")
-        fetch_result2 = cursor.fetchone()
-        max_other_result = fetch_result2[0] if fetch_result2 else None
-
-        logger.info(f"Max 'Reader X' format result: {max_reader_result}")
-        logger.info(f"Max other format result: {max_other_result}")
-
-        # 确定真正的最大值
-        if max_reader_result is None and max_other_result is None:
-            # 如果没有任何记录，从 1 开始
-            logger.info("No existing reader records found, starting with next_number = 1")
-            next_number = 1
-        elif max_reader_result is None:
-            # 只有其他格式，按之前的逻辑处理
-            max_result = max_other_result
-            try:
-                numbers = [int(s) for s in str(max_result).split() if s.isdigit()]
-                logger.info(f"Found numbers in max_result: {numbers}")
-                if numbers:
-                    current_max = max(numbers)  # 使用最大的数字
-                    next_number = current_max + 1
-                    logger.info(f"Calculated next_number from other format: {next_number}")
-                else:
-                    logger.info("No numbers found in max_result, using next_number = 1")
-                    next_number = 1
-            except Exception as e:
-                logger.warning(f"Could not parse other format max reader_id '{max_result}': {e}")
-                next_number = 1
-        elif max_other_result is None:
-            # 只有"Reader X"格式，使用该值
-            max_result = max_reader_result
-            try:
-                max_str = str(max_result)
-                logger.info(f"Parsing max reader_id string: '{max_str}'")
-
-                if max_str.startswith('Reader '):
-                    current_max_part = max_str.split(' ')[-1]  # 获取最后一个部分（数字）
-                    logger.info(f"Extracted number part: '{current_max_part}'")
-                    current_max = int(current_max_part)
-                    next_number = current_max + 1
-                    logger.info(f"Calculated next_number from 'Reader X' format: {next_number}")
-            except Exception as e:
-                # 如果格式不正確或解析失败，从1开始并记录问题
-                logger.warning(f"Could not parse 'Reader X' format max reader_id '{max_result}': {e}")
-                next_number = 1
-        else:
-            # 两种格式都有，需要比较它们的数值部分
-            try:
-                # 解析"Reader X"格式的数字部分
-                reader_max_part = max_reader_result.split(' ')[-1]
-                reader_max_number = int(reader_max_part)
-
-                # 解析其他格式中的数字
-                other_numbers = [int(s) for s in str(max_other_result).split() if s.isdigit()]
-                other_max_number = max(other_numbers) if other_numbers else 0
-
-                # 使用较大的数值
-                max_number = max(reader_max_number, other_max_number)
-                next_number = max_number + 1
-                logger.info(f"Calculated next_number by comparing both formats: {next_number}")
-            except Exception as e:
-                logger.warning(f"Could not compare both formats: {e}, defaulting to 'Reader X' logic")
-                # 回退到"Reader X"格式的逻辑
-                max_str = str(max_reader_result)
-                if max_str.startswith('Reader '):
-                    current_max_part = max_str.split(' ')[-1]
-                    current_max = int(current_max_part)
-                    next_number = current_max + 1
-                    logger.info(f"Calculated next_number from 'Reader X' format: {next_number}")
-                else:
-                    next_number = 1
-
-        # 生成新的 reader_id
-        new_reader_id = f"Reader {next_number}"
-        logger.info(f"Generated new reader_id: {new_reader_id}")
+        # 从编号序列中分配新的 reader_id
+        new_reader_id = format_reader_id(id_allocator.next_id(conn, READER_SEQUENCE))
+        logger.debug("Allocated reader_id %s", new_reader_id)
 
         # 插入新記錄，包含生成的 reader_id
-        # 如果 name 为空或默认值，使用默认名称
-        if not name or name.strip() == "":
-            name = "default user name, please edit it"
-            logger.info("Using default name for new reader")
-
-        logger.info(f"Executing INSERT statement with values: reader_id={new_reader_id}, student_id={student_id}, name={name}, email={email}, phone={phone}, department={department}, major={major}")
 
         cursor.execute("""
             INSERT INTO reader_information(reader_id, student_id, name, password, email, phone, department, major)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (new_reader_id, student_id, name, password, email, phone, department, major))
+        """, (new_reader_id, student_id, name, password_hash, email, phone, department, major))
 
-        # 记录日志
-        from datetime import datetime
-        date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        operation = f"librarian add new reader who has student_id = {student_id}"
+        # 记录审计日志
+        record_action(conn, "librarian", None, "create", "reader", student_id, f"librarian add new reader who has student_id = {student_id}")
 
-        cursor.execute("""
-            INSERT INTO operation_log (date, operation)
-            VALUES (?, ?)
-        """, (date, operation))
+        # 提交后更新内存目录索引
+        row = fetch_reader(conn, student_id)
+        db.after_commit(lambda: reader_directory.upsert(row))
+        return new_reader_id
+
+    try:
+        if len(student_id) != 9:
+            raise HTTPException(status_code=400, detail="ID must be 9 digits")
+
+        # 如果 name 为空或默认值，使用默认名称
+        if not name or name.strip() == "":
+            name = "default user name, please edit it"
+            logger.debug("Using default name for new reader")
 
-        logger.info("INSERT statement executed successfully, now committing transaction")
-        conn.commit()
-        logger.info("Transaction committed successfully")
-        conn.close()
-        logger.info(f"Database connection closed. Successfully added reader: {new_reader_id}, student_id: {student_id}")
+        # 密码哈希在进程池中计算，不占用写线程
+        password_hash = await password_hasher.hash(password)
+        new_reader_id = await db.transaction(_add)
 
-        print(f"Add new reader: {new_reader_id}, student_id: {student_id}")
+        logger.info("Add new reader: %s, student_id: %s", new_reader_id, student_id)
 
         return {
             "status": "success",
             "message": "Added successfully"
         }
 
+    except HTTPException:
+        raise
+    except sqlite3.Error as e:
+        logger.error(f"Database error in add_new_reader: {e}")
+        raise HTTPException(status_code=500, detail="Database error")
+    except Exception as e:
+        logger.error(f"Error adding reader: {e}")
+        raise HTTPException(status_code=500, detail="Server error")
+
+
+@router.post("/enroll-readers")
+async def enroll_readers_from_roster(
+        file: UploadFile = File(...),
+        format: Optional[str] = None,
+        dry_run: bool = False,
+        db: Database = Depends(get_db)
+    ):
+    """
+    Enroll every student of an uploaded roster (CSV, JSON or XLSX)
+    Rows are inserted in chunked transactions; the response summarises how many
+    readers were enrolled, the block of reader ids they got, and why each
+    rejected row failed
+    """
+    def _enroll(conn: sqlite3.Connection, readers: list[tuple], numbers: list[int]):
+        first_id, last_id, rejected, rows = enroll_readers(conn, readers, numbers)
+        # 提交后批量更新内存目录索引
+        db.after_commit(lambda: reader_directory.upsert_many(rows))
+        return first_id, last_id, rejected
+
+    def _write(readers: list[tuple], numbers: list[int]) -> tuple:
+        # 在线程池中调用：先在哈希进程池中批量哈希密码，再等待写线程提交这一块
+        return db.writer.submit(_enroll, hash_roster_passwords(readers), numbers).result()
+
+    def _import(fmt: str) -> tuple[dict, list[dict]]:
+        summary, errors = None, []
+        for event in run_import(read_rows(file.file, fmt), reader_validator(), _write, dry_run=dry_run):
+            errors.extend(event.get("errors", ()))
+            summary = event
+        return summary, errors
+
+    try:
+        fmt = detect_format(file.filename, format)
+
+        summary, errors = await run_in_threadpool(_import, fmt)
+
+        logger.info("Roster %s: %s of %s readers enrolled%s", file.filename, summary["imported"], summary["rows"],
+                    " (dry run)" if dry_run else "")
+
+        return {
+            "status": "success",
+            "message": f"Enrolled {summary['imported']} of {summary['rows']} readers",
+            "rows": summary["rows"],
+            "valid": summary["valid"],
+            "enrolled": summary["imported"],
+            "failed": summary["failed"],
+            "dry_run": dry_run,
+            "first_reader_id": summary["first_id"],
+            "last_reader_id": summary["last_id"],
+            "errors": errors
+        }
+
+    except ImportFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except sqlite3.Error as e:
-        logger.exception(f"Database error in register_reader: {e}")
+        logger.error(f"Database error in enroll_readers_from_roster: {e}")
         raise HTTPException(status_code=500, detail="Database error")
     except Exception as e:
-        logger.exception(f"Error registering reader: {e}")
+        logger.error(f"Error enrolling readers: {e}")
         raise HTTPException(status_code=500, detail="Server error")
 
 
 @router.post("/update-reader")
-async def update_reader(request: UpdateReaderRequest):
+async def update_reader(request: UpdateReaderRequest, db: Database = Depends(get_db)):
     """
     Update reader information by librarian
     """
-    try:
-        conn = sqlite3.connect('library.db')
+    def _update(conn: sqlite3.Connection):
         cursor = conn.cursor()
 
         # 检查读者是否存在
         cursor.execute("SELECT 1 FROM reader_information WHERE student_id = ?", (request.student_id,))
         if not cursor.fetchone():
-            conn.close()
             raise HTTPException(status_code=404, detail="Reader not found")
 
         # 构建更新语句
@@ -255,7 +221,9 @@ async def update_reader(request: UpdateReaderRequest):
 
         if request.password is not None:
             updates.append("password = ?")
-            params.append(request.password)
+            params.append(password_hash)
+            # 修改密码后，该读者已登录的会话全部失效
+            db.after_commit(lambda: session_store.revoke_user(request.student_id, "reader"))
 
         if request.department is not None:
             updates.append("department = ?")
@@ -266,7 +234,6 @@ async def update_reader(request: UpdateReaderRequest):
             params.append(request.major)
 
         if not updates:
-            conn.close()
             raise HTTPException(status_code=400, detail="No fields to update")
 
         # 添加 student_id 到参数列表用于 WHERE 子句
@@ -276,19 +243,18 @@ async def update_reader(request: UpdateReaderRequest):
         query = f"UPDATE reader_information SET {', '.join(updates)} WHERE student_id = ?"
         cursor.execute(query, params)
         
-        from datetime import datetime
-        date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        operation = f"librarian update the information of reader who has student id = {request.student_id}"
+        # 记录审计日志
+        record_action(conn, "librarian", None, "update", "reader", request.student_id, f"librarian update the information of reader who has student id = {request.student_id}")
 
-        cursor.execute("""
-            INSERT INTO operation_log (date, operation)
-            VALUES (?, ?)
-        """, (date, operation))
+        row = fetch_reader(conn, request.student_id)
+        db.after_commit(lambda: reader_directory.upsert(row))
+        db.after_commit(lambda: profile_cache.invalidate(reader_tag(request.student_id)))
 
-        conn.commit()
-        conn.close()
+    try:
+        password_hash = await password_hasher.hash(request.password) if request.password is not None else None
+        await db.transaction(_update)
 
-        print(f"Updated reader information for student_id: {request.student_id}")
+        logger.info("Updated reader information for student_id: %s", request.student_id)
 
         return {
             "status": "success",
@@ -306,13 +272,12 @@ async def update_reader(request: UpdateReaderRequest):
 
 
 @router.delete("/delete-reader")
-async def delete_reader(student_id: str):
+async def delete_reader(student_id: str, db: Database = Depends(get_db)):
     """
     Delete a reader by student_id
     Note: This will also delete related borrow records due to foreign key constraints
     """
-    try:
-        conn = sqlite3.connect('library.db')
+    def _delete(conn: sqlite3.Connection):
         cursor = conn.cursor()
 
         # 检查读者是否存在
@@ -320,7 +285,6 @@ async def delete_reader(student_id: str):
         result = cursor.fetchone()
         
         if not result:
-            conn.close()
             raise HTTPException(status_code=404, detail="Reader not found")
 
         reader_id = result[0]
@@ -333,7 +297,6 @@ async def delete_reader(student_id: str):
         
         active_borrowings = cursor.fetchone()[0]
         if active_borrowings > 0:
-            conn.close()
             raise HTTPException(
                 status_code=400, 
                 detail=f"Cannot delete reader with {active_borrowings} active borrowing(s). Please return all books first."
@@ -344,24 +307,23 @@ async def delete_reader(student_id: str):
         # 删除读者信息
         cursor.execute("DELETE FROM reader_information WHERE student_id = ?", (student_id,))
 
-        # 日志
-        from datetime import datetime
-        date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        operation = f"librarian deleted reader who has student id = {student_id}"
-
-        cursor.execute("""
-            INSERT INTO operation_log (date, operation)
-            VALUES (?, ?)
-        """, (date, operation))
-
         if cursor.rowcount == 0:
-            conn.close()
             raise HTTPException(status_code=404, detail="Reader not found")
 
-        conn.commit()
-        conn.close()
+        # 记录审计日志
+        record_action(conn, "librarian", None, "delete", "reader", student_id, f"librarian deleted reader who has student id = {student_id}")
+
+        db.after_commit(lambda: reader_directory.remove(student_id))
+        db.after_commit(lambda: profile_cache.invalidate(reader_tag(student_id)))
+        db.after_commit(lambda: calendar_cache.invalidate(reader_tag(student_id)))
+        # 已删除账号的会话随之失效
+        db.after_commit(lambda: session_store.revoke_user(student_id, "reader"))
+        return reader_id
+
+    try:
+        reader_id = await db.transaction(_delete)
 
-        print(f"Deleted reader: {reader_id}, student_id: {student_id}")
+        logger.info("Deleted reader: %s, student_id: %s", reader_id, student_id)
 
         return {
             "status": "success",
@@ -0,0 +1,153 @@
+"""
+Concurrency stress test for /api/borrow-book
+
+Fires many concurrent borrow requests at a small pool of books through the
+real FastAPI app (in process, against a temporary copy of the database) and
+checks that every book was lent exactly once per round: one 200 per book, a
+400 for every other request, and one open borrow_record per book afterwards.
+Between rounds the winners return their books. Prints throughput and latency;
+exits 1 on any double lend or unexpected response.
+
+Usage: python -m benchmarks.borrow_stress [--books 10] [--requests 5000] [--concurrency 200] [--rounds 3] [--db path/to/library.db]
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import logging
+from collections import Counter
+
+
+async def _run_round(client, books: list[int], round_number: int, requests: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def _borrow(i: int):
+        book_id = books[i % len(books)]
+        student_id = f"9{round_number:02d}{i:06d}"
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post("/api/borrow-book", params={"student_id": student_id, "book_id": book_id})
+            latencies.append(time.perf_counter() - start)
+        return book_id, student_id, response.status_code
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(_borrow(i) for i in range(requests)))
+    elapsed = time.perf_counter() - start
+    return results, latencies, elapsed
+
+
+def _check_database(path: str, books: list[int]) -> list[str]:
+    conn = sqlite3.connect(path)
+    try:
+        problems = []
+        for book_id in books:
+            open_loans = conn.execute("""
+                SELECT COUNT(*) FROM borrow_record
+                WHERE book_id = ? AND (return_date IS NULL OR return_date = '')
+            """, (book_id,)).fetchone()[0]
+            if_available = conn.execute("SELECT if_available FROM book WHERE book_id = ?", (book_id,)).fetchone()[0]
+            if open_loans != 1 or if_available != 0:
+                problems.append(f"book {book_id}: {open_loans} open loan(s), if_available = {if_available}")
+        return problems
+    finally:
+        conn.close()
+
+
+async def _stress(app, path: str, args) -> int:
+    import httpx
+
+    conn = sqlite3.connect(path)
+    books = [row[0] for row in conn.execute(
+        "SELECT book_id FROM book WHERE if_available = 1 ORDER BY book_id LIMIT ?", (args.books,)
+    )]
+    conn.close()
+    if len(books) < args.books:
+        print(f"Only {len(books)} available books in the database")
+        return 2
+
+    failures = 0
+    total_requests = 0
+    total_elapsed = 0.0
+    all_latencies = []
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://stress") as client:
+            for round_number in range(args.rounds):
+                results, latencies, elapsed = await _run_round(
+                    client, books, round_number, args.requests, args.concurrency)
+                total_requests += len(results)
+                total_elapsed += elapsed
+                all_latencies.extend(latencies)
+
+                codes = Counter(code for _, _, code in results)
+                winners = {}
+                problems = []
+                for book_id, student_id, code in results:
+                    if code == 200:
+                        if book_id in winners:
+                            problems.append(f"book {book_id} lent to both {winners[book_id]} and {student_id}")
+                        winners[book_id] = student_id
+                    elif code != 400:
+                        problems.append(f"book {book_id} for {student_id}: unexpected status {code}")
+                problems += [f"book {book_id} was never lent" for book_id in books if book_id not in winners]
+                problems += _check_database(path, books)
+
+                print(f"round {round_number + 1}: {len(results)} borrows in {elapsed:.2f}s "
+                      f"({len(results) / elapsed:.0f} req/s), status codes {dict(sorted(codes.items()))}")
+                for problem in problems:
+                    print(f"  FAIL {problem}")
+                failures += len(problems)
+
+                # 归还本轮借出的书，供下一轮使用
+                for book_id, student_id in winners.items():
+                    response = await client.get("/api/reader-return-books",
+                                                params={"student_id": student_id, "book_id": book_id})
+                    if response.status_code != 200:
+                        print(f"  FAIL return of book {book_id} by {student_id}: status {response.status_code}")
+                        failures += 1
+
+    latencies_ms = sorted(latency * 1000 for latency in all_latencies)
+    p99 = latencies_ms[min(len(latencies_ms) - 1, int(len(latencies_ms) * 0.99))]
+    print(f"total: {total_requests} borrows on {len(books)} books, {total_requests / total_elapsed:.0f} req/s, "
+          f"latency p50 {statistics.median(latencies_ms):.1f} ms, p99 {p99:.1f} ms")
+    print("no double lends" if failures == 0 else f"{failures} problem(s)")
+    return 1 if failures else 0
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.borrow_stress",
+                                     description="Concurrent borrow stress test")
+    parser.add_argument("--books", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=5000, help="borrow requests per round")
+    parser.add_argument("--concurrency", type=int, default=200, help="requests in flight at once")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--db", default=None, help="database to copy (default: the app's library.db)")
+    args = parser.parse_args(argv)
+
+    # 不能在这里导入 db：连接池在导入时就按 LIBRARY_DB_PATH 创建
+    source = args.db or os.environ.get("LIBRARY_DB_PATH", "library.db")
+
+    # 在临时副本上运行，不修改真实数据库
+    workdir = tempfile.mkdtemp(prefix="borrow_stress_")
+    path = os.path.join(workdir, "library.db")
+    shutil.copy(source, path)
+    os.environ["LIBRARY_DB_PATH"] = path
+    try:
+        # 必须在设置 LIBRARY_DB_PATH 之后再导入应用
+        import main as app_module
+        logging.getLogger().setLevel(logging.WARNING)
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+        return asyncio.run(_stress(app_module.app, path, args))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
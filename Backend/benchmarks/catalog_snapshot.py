@@ -0,0 +1,208 @@
+"""
+Memory and latency benchmark of the in-memory catalog snapshot against SQLite
+
+Fills a temporary copy of the database with synthetic books (1M by default),
+then compares for the same catalog:
+- memory: the loaded CatalogSnapshot vs the same rows held as a plain list of
+  tuples (both measured with tracemalloc), next to the database file size;
+- latency: the SQL path of /api/search-books (search_rows) vs
+  CatalogSnapshot.search for several kinds of query, and the availability
+  check of /api/borrow-book (SELECT if_available vs CatalogSnapshot.availability).
+Every query is run on both paths and the returned book ids are compared;
+exits 1 if any differ.
+
+Usage: python -m benchmarks.catalog_snapshot [--books 1000000] [--queries 200] [--seed 1] [--db path/to/library.db]
+"""
+import argparse
+import itertools
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import logging
+
+SYLLABLES = ["ka", "lo", "mi", "ren", "sto", "via", "tor", "bel", "and", "ques", "lum", "har", "ori", "pen", "dus",
+             "nat", "ver", "sol", "gra", "mon", "fel", "cra", "zen", "ty", "ro", "al", "wi", "es", "ion", "ber"]
+PUBLISHERS = 300
+AUTHORS = 40000
+
+
+def _vocabulary(rng: random.Random, size: int) -> list[str]:
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def _generate(rng: random.Random, count: int, start_id: int):
+    words = _vocabulary(rng, 50000)
+    # 书名用词近似 Zipf 分布：少数常见词，大量罕见词
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(words))))
+    authors = [f"{rng.choice(words).title()} {rng.choice(words).title()}" for _ in range(AUTHORS)]
+    publishers = [f"{rng.choice(words).title()} Press" for _ in range(PUBLISHERS)]
+    for offset in range(count):
+        title = " ".join(rng.choices(words, cum_weights=cum_weights, k=rng.randint(1, 5))).capitalize()
+        year = rng.randint(1900, 2024) if rng.random() > 0.02 else None
+        location = f"{rng.choice('ABCDEFGH')}-{rng.randint(1, 40):02d}-{rng.randint(1, 9)}"
+        yield (start_id + offset, title, rng.choice(authors), rng.choice(publishers), year, location,
+               int(rng.random() > 0.1))
+
+
+def _fill(path: str, count: int, seed: int) -> list[str]:
+    """
+    Bulk-insert synthetic books and rebuild book_fts once instead of per row
+    """
+    from db.migrate import apply_migrations
+
+    conn = sqlite3.connect(path)
+    try:
+        apply_migrations(conn)
+        trigger = conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'book_fts_after_insert'"
+        ).fetchone()[0]
+        start_id = conn.execute("SELECT COALESCE(MAX(book_id), 0) + 1 FROM book").fetchone()[0]
+        rng = random.Random(seed)
+        books = _generate(rng, count, start_id)
+        with conn:
+            conn.execute("DROP TRIGGER book_fts_after_insert")
+            conn.executemany("""
+                INSERT INTO book (book_id, book_name, author, publisher, publish_year, location, if_available)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, books)
+            conn.execute("INSERT INTO book_fts(book_fts) VALUES ('rebuild')")
+            conn.execute(trigger)
+        conn.execute("ANALYZE")
+        return sorted({token for (name,) in conn.execute("SELECT book_name FROM book ORDER BY random() LIMIT 20000")
+                       for token in name.lower().split()})
+    finally:
+        conn.close()
+
+
+def _measure(label: str, load):
+    tracemalloc.start()
+    start = time.perf_counter()
+    value = load()
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"  {label:<28} {size / 2 ** 20:9.1f} MiB  (built in {elapsed:.1f}s)")
+    return value
+
+
+def _percentiles(latencies: list[float]) -> str:
+    latencies = sorted(latency * 1000 for latency in latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    return f"p50 {statistics.median(latencies):8.3f} ms  p99 {p99:8.3f} ms"
+
+
+def _queries(rng: random.Random, words: list[str], count: int, max_id: int) -> dict[str, list[tuple[str, str]]]:
+    common = words[: max(1, len(words) // 50)]
+    return {
+        "word": [(rng.choice(words), "relevance") for _ in range(count)],
+        "prefix (2-3 chars)": [(rng.choice(words)[: rng.randint(2, 3)], "relevance") for _ in range(count)],
+        "two words": [(f"{rng.choice(common)} {rng.choice(words)}", "relevance") for _ in range(count)],
+        "word, by name": [(rng.choice(words), "book_name") for _ in range(count)],
+        "numeric id": [(str(rng.randint(1, max_id)), "relevance") for _ in range(count)],
+        "browse by name": [("", "book_name") for _ in range(count)],
+        "browse by id": [("", "book_id") for _ in range(count)],
+    }
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.catalog_snapshot",
+                                     description="Catalog snapshot memory and latency benchmark")
+    parser.add_argument("--books", type=int, default=1000000, help="synthetic books to add")
+    parser.add_argument("--queries", type=int, default=200, help="queries per kind")
+    parser.add_argument("--limit", type=int, default=20, help="page size")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--db", default=None, help="database to copy (default: the app's library.db)")
+    args = parser.parse_args(argv)
+
+    # 不能在这里导入 db：连接池在导入时就按 LIBRARY_DB_PATH 创建
+    source = args.db or os.environ.get("LIBRARY_DB_PATH", "library.db")
+
+    # 在临时副本上运行，不修改真实数据库
+    workdir = tempfile.mkdtemp(prefix="catalog_snapshot_")
+    path = os.path.join(workdir, "library.db")
+    shutil.copy(source, path)
+    os.environ["LIBRARY_DB_PATH"] = path
+    try:
+        # 必须在设置 LIBRARY_DB_PATH 之后再导入
+        from api.books import search_rows, parse_book_id, build_fts_query, RELEVANCE, BOOK_SORTS
+        from services.catalog_snapshot import CatalogSnapshot, BOOK_COLUMNS
+        logging.getLogger().setLevel(logging.WARNING)
+
+        start = time.perf_counter()
+        words = _fill(path, args.books, args.seed)
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        total_books, max_id = conn.execute("SELECT COUNT(*), MAX(book_id) FROM book").fetchone()
+        print(f"{total_books} books (added {args.books} in {time.perf_counter() - start:.1f}s), "
+              f"database file {os.path.getsize(path) / 2 ** 20:.1f} MiB")
+
+        print("memory:")
+        _measure("rows as list of tuples", lambda: [tuple(row) for row in conn.execute(
+            f"SELECT {', '.join(BOOK_COLUMNS)} FROM book ORDER BY book_id")])
+        snapshot = CatalogSnapshot(True)
+        _measure("catalog snapshot", lambda: snapshot.load(conn))
+        stats = snapshot.stats()
+        print(f"  snapshot: {stats['tokens']} tokens, {stats['postings']} postings, {stats['strings']} strings")
+
+        # 预热：第一次按书名浏览会建立排序数组
+        snapshot.search(None, None, "book_name", None, args.limit, True)
+
+        rng = random.Random(args.seed)
+        sorts = {"relevance": RELEVANCE, **BOOK_SORTS}
+        mismatches = 0
+        print(f"search latency ({args.queries} queries per kind, limit {args.limit}, first page with total):")
+        for kind, queries in _queries(rng, words, args.queries, max_id).items():
+            sql_latencies, snapshot_latencies = [], []
+            for text, sort in queries:
+                match = build_fts_query(text)
+                exact_id = parse_book_id(text)
+                if match is None and sort == "relevance":
+                    sort = "book_id"
+
+                begin = time.perf_counter()
+                sql_rows, sql_total = search_rows(conn, match, exact_id, sorts[sort], None, args.limit, True)
+                sql_latencies.append(time.perf_counter() - begin)
+
+                begin = time.perf_counter()
+                rows, total = snapshot.search(match, exact_id, sort, None, args.limit, True)
+                snapshot_latencies.append(time.perf_counter() - begin)
+
+                if [row[0] for row in sql_rows] != [row[0] for row in rows] or sql_total != total:
+                    mismatches += 1
+                    print(f"  MISMATCH {text!r} sorted by {sort}: total {sql_total} vs {total}")
+            print(f"  {kind:<20} sql      {_percentiles(sql_latencies)}")
+            print(f"  {'':<20} snapshot {_percentiles(snapshot_latencies)}")
+
+        sql_latencies, snapshot_latencies = [], []
+        for _ in range(args.queries * 10):
+            book_id = rng.randint(1, max_id)
+            begin = time.perf_counter()
+            row = conn.execute("SELECT if_available FROM book WHERE book_id = ?", (book_id,)).fetchone()
+            sql_latencies.append(time.perf_counter() - begin)
+            begin = time.perf_counter()
+            available = snapshot.availability(book_id)
+            snapshot_latencies.append(time.perf_counter() - begin)
+            if (None if row is None else row[0] == 1) != available:
+                mismatches += 1
+                print(f"  MISMATCH availability of book {book_id}")
+        print(f"availability check     sql      {_percentiles(sql_latencies)}")
+        print(f"                       snapshot {_percentiles(snapshot_latencies)}")
+        conn.close()
+
+        print("results identical" if mismatches == 0 else f"{mismatches} mismatch(es)")
+        return 1 if mismatches else 0
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,5 @@
+from db.pool import pool, open_connection, PoolTimeout
+from db.writer import SingleWriter, writer
+from db.executor import Database, db, get_db
+
+__all__ = ["pool", "open_connection", "PoolTimeout", "SingleWriter", "writer", "Database", "db", "get_db"]
@@ -0,0 +1,119 @@
+import asyncio
+import contextvars
+import os
+import sqlite3
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Iterator, Optional, Sequence
+
+from db.pool import ConnectionPool, pool
+from db.writer import SingleWriter, writer
+
+logger = logging.getLogger(__name__)
+
+# 数据库线程池大小默认与连接池一致，保证每个线程都能拿到连接
+DB_THREADS = int(os.environ.get("LIBRARY_DB_THREADS", str(pool.size)))
+
+_END = object()
+
+
+class Database:
+    """
+    Awaitable facade over the connection pool and the single writer
+    Reads run on a dedicated thread pool, so a slow query never stalls the event
+    loop that serves the other requests; writes are queued to the writer thread
+    """
+
+    def __init__(self, pool: ConnectionPool, writer: SingleWriter, threads: int):
+        self.pool = pool
+        self.writer = writer
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="db")
+
+    def _call(self, fn: Callable, args: tuple) -> Any:
+        with self.pool.connection() as conn:
+            return fn(conn, *args)
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        """
+        Run fn(conn, *args) on the database thread pool with a pooled connection
+        """
+        loop = asyncio.get_running_loop()
+        # 带上调用方的上下文（请求 id 等），run_in_executor 本身不会传递
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._executor, context.run, self._call, fn, args)
+
+    async def fetch_all(self, sql: str, params: Sequence = ()) -> list[sqlite3.Row]:
+        return await self.run(lambda conn: conn.execute(sql, params).fetchall())
+
+    async def fetch_one(self, sql: str, params: Sequence = ()) -> Optional[sqlite3.Row]:
+        return await self.run(lambda conn: conn.execute(sql, params).fetchone())
+
+    async def stream(self, fn: Callable[..., Iterator], *args) -> AsyncIterator:
+        """
+        Iterate the generator fn(conn, *args) on the database thread pool, one item per hop
+        The generator keeps its pooled connection until it is exhausted or the
+        consumer stops early, so only the item in flight is held in memory
+        """
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        conn = await loop.run_in_executor(self._executor, self.pool.acquire)
+        items = fn(conn, *args)
+        # 消费方取消时，保证 close() 不会与正在执行的 next() 并发
+        lock = threading.Lock()
+
+        def _next():
+            with lock:
+                return context.run(next, items, _END)
+
+        def _finish():
+            with lock:
+                try:
+                    items.close()
+                finally:
+                    self.pool.release(conn)
+
+        try:
+            while True:
+                item = await loop.run_in_executor(self._executor, _next)
+                if item is _END:
+                    break
+                yield item
+        finally:
+            try:
+                self._executor.submit(_finish)
+            except RuntimeError:
+                # 线程池已关闭（服务正在停止）
+                _finish()
+
+    async def transaction(self, fn: Callable[..., Any], *args) -> Any:
+        """
+        Run fn(conn, *args) as one write transaction on the writer thread
+        Its changes are committed when fn returns and rolled back when it raises
+        (including HTTPException); other writes in the same group commit are unaffected
+        """
+        return await self.writer.write(fn, *args)
+
+    def after_commit(self, callback: Callable[[], None]) -> None:
+        """
+        From inside a transaction function: run callback once the transaction has committed
+        """
+        self.writer.after_commit(callback)
+
+    def start(self) -> None:
+        self.writer.start()
+
+    def close(self) -> None:
+        self.writer.stop()
+        self._executor.shutdown(wait=True)
+        self.pool.close()
+
+
+db = Database(pool, writer, DB_THREADS)
+
+
+def get_db() -> Database:
+    """
+    FastAPI dependency returning the shared database facade
+    """
+    return db
@@ -0,0 +1,152 @@
+"""
+Database work per request
+
+open_connection() creates MeteredConnection objects, whose cursors count the
+statements executed, the rows fetched and the time spent in SQLite. The counts
+go to the QueryStats in `query_stats`, which MetricsMiddleware
+(services/metrics.py) sets for each request; the database threads and the
+single writer run jobs in the submitter's context, so a request's reads and
+writes are both counted for it. Work outside a request (startup, background
+jobs, command line tools) goes to `background_stats`. LIBRARY_DB_METRICS=0
+opens plain connections instead (about half a microsecond less per fetched row).
+
+While `statement_log` holds a list, the cursors also append every (sql, params)
+they execute to it; db/query_plans.py uses this to check the plans of the
+statements the routes really run.
+"""
+import os
+import time
+import sqlite3
+import threading
+import contextvars
+from typing import Optional
+
+DB_METRICS = os.environ.get("LIBRARY_DB_METRICS", "1").lower() in ("1", "true", "yes", "on")
+
+
+class QueryStats:
+    """
+    Statements, fetched rows and seconds spent in SQLite for one request; its
+    database calls run one after another, so no lock is needed
+    """
+    __slots__ = ("queries", "rows", "seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.rows = 0
+        self.seconds = 0.0
+
+    def add(self, queries: int, rows: int, seconds: float) -> None:
+        self.queries += queries
+        self.rows += rows
+        self.seconds += seconds
+
+
+class SharedQueryStats(QueryStats):
+    """
+    QueryStats updated from several threads at once
+    """
+    __slots__ = ("_lock",)
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+
+    def add(self, queries: int, rows: int, seconds: float) -> None:
+        with self._lock:
+            QueryStats.add(self, queries, rows, seconds)
+
+
+# 当前请求的统计；为 None 时记入 background_stats
+query_stats: contextvars.ContextVar[Optional[QueryStats]] = contextvars.ContextVar("query_stats", default=None)
+background_stats = SharedQueryStats()
+
+# 非 None 时记录执行过的 (sql, params)，见 db/query_plans.py
+statement_log: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("statement_log", default=None)
+
+
+def _record(queries: int, rows: int, seconds: float) -> None:
+    (query_stats.get() or background_stats).add(queries, rows, seconds)
+
+
+def _log_statement(sql: str, params) -> None:
+    log = statement_log.get()
+    if log is not None:
+        log.append((sql, params))
+
+
+class MeteredCursor(sqlite3.Cursor):
+    def execute(self, sql, params=()):
+        _log_statement(sql, params)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            _record(1, 0, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_params):
+        if statement_log.get() is not None:
+            # 只在记录时展开参数序列，记下第一组参数
+            seq_of_params = list(seq_of_params)
+            if seq_of_params:
+                _log_statement(sql, seq_of_params[0])
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_params)
+        finally:
+            _record(1, 0, time.perf_counter() - start)
+
+    def executescript(self, *args):
+        start = time.perf_counter()
+        try:
+            return super().executescript(*args)
+        finally:
+            _record(1, 0, time.perf_counter() - start)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        _record(0, row is not None, time.perf_counter() - start)
+        return row
+
+    def fetchmany(self, *args):
+        start = time.perf_counter()
+        rows = super().fetchmany(*args)
+        _record(0, len(rows), time.perf_counter() - start)
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        _record(0, len(rows), time.perf_counter() - start)
+        return rows
+
+    def __next__(self):
+        # SQLite 的大部分工作发生在逐行读取时，所以迭代也计时
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            _record(0, 0, time.perf_counter() - start)
+            raise
+        _record(0, 1, time.perf_counter() - start)
+        return row
+
+
+class MeteredConnection(sqlite3.Connection):
+    """
+    Connection whose cursors are MeteredCursor, including the ones created by
+    the execute shortcuts (the C implementation does not go through cursor())
+    """
+
+    def cursor(self, factory=MeteredCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+    def executescript(self, *args):
+        return self.cursor().executescript(*args)
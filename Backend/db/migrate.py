@@ -0,0 +1,88 @@
+import os
+import re
+import sqlite3
+import logging
+from datetime import datetime
+
+from db.pool import DB_PATH
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "migrations")
+MIGRATION_FILE = re.compile(r"^(\d{4})_(\w+)\.sql$")
+
+
+def list_migrations(directory: str = MIGRATIONS_DIR) -> list[tuple[int, str, str]]:
+    """
+    Return (version, name, path) for every numbered migration file, in order
+    """
+    migrations = []
+    for filename in os.listdir(directory):
+        match = MIGRATION_FILE.match(filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(directory, filename)))
+    migrations.sort()
+
+    versions = [version for version, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"Duplicate migration version in {directory}")
+    return migrations
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+    """)
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def apply_migrations(conn: sqlite3.Connection) -> list[int]:
+    """
+    Apply every migration newer than the recorded schema version
+    Each migration and its schema_version row are committed in one transaction
+    """
+    conn.isolation_level = None
+    version = current_version(conn)
+    applied = []
+
+    for number, name, path in list_migrations():
+        if number <= version:
+            continue
+        with open(path, encoding="utf-8") as f:
+            script = f.read()
+
+        applied_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        try:
+            conn.executescript(
+                "BEGIN IMMEDIATE;\n"
+                f"{script}\n;\n"
+                f"INSERT INTO schema_version (version, name, applied_at) VALUES ({number}, '{name}', '{applied_at}');\n"
+                "COMMIT;"
+            )
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise RuntimeError(f"Migration {number:04d}_{name} failed: {e}") from e
+
+        logger.info(f"Applied migration {number:04d}_{name}")
+        applied.append(number)
+
+    return applied
+
+
+def run_migrations(path: str = DB_PATH) -> list[int]:
+    conn = sqlite3.connect(path)
+    try:
+        return apply_migrations(conn)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    applied = run_migrations()
+    print(f"Applied {len(applied)} migration(s); schema is at version {max([0] + [v for v, _, _ in list_migrations()])}")
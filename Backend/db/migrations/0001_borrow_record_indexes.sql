@@ -0,0 +1,21 @@
+-- borrow_record 的查询索引
+
+-- /api/reader-borrowings, /api/reader-activity-calendar, /api/reader-reading-report,
+-- delete_reader: WHERE student_id = ? [ORDER BY / GROUP BY borrow_date]
+CREATE INDEX IF NOT EXISTS idx_borrow_record_student_borrow
+    ON borrow_record(student_id, borrow_date);
+
+-- return_book, renew_book, delete_book: WHERE book_id = ? AND (return_date IS NULL OR return_date = '')
+CREATE INDEX IF NOT EXISTS idx_borrow_record_book_return
+    ON borrow_record(book_id, return_date);
+
+-- /api/view-report 未归还和逾期: (return_date IS NULL OR return_date = '') [AND due_date < ?]
+CREATE INDEX IF NOT EXISTS idx_borrow_record_return_due
+    ON borrow_record(return_date, due_date);
+
+-- /api/view-report 当日借出 / 当日归还: DATE(borrow_date) = DATE(?), DATE(return_date) = DATE(?)
+CREATE INDEX IF NOT EXISTS idx_borrow_record_borrow_day
+    ON borrow_record(DATE(borrow_date));
+
+CREATE INDEX IF NOT EXISTS idx_borrow_record_return_day
+    ON borrow_record(DATE(return_date));
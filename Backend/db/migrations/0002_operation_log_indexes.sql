@@ -0,0 +1,4 @@
+-- /api/view-library-logs: WHERE DATE(date) = DATE(?) ORDER BY date
+-- 包含 operation 列，查询只需读取索引
+CREATE INDEX IF NOT EXISTS idx_operation_log_day
+    ON operation_log(DATE(date), date, operation);
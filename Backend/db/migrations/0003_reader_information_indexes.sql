@@ -0,0 +1,3 @@
+-- 登录、注册、读者信息和读者管理接口: WHERE student_id = ?
+CREATE INDEX IF NOT EXISTS idx_reader_information_student
+    ON reader_information(student_id);
@@ -0,0 +1,32 @@
+-- /api/search-books 的全文索引（书名、作者、出版社）
+-- 外部内容表：正文仍保存在 book 表中，book_fts 只保存倒排索引
+CREATE VIRTUAL TABLE IF NOT EXISTS book_fts USING fts5(
+    book_name,
+    author,
+    publisher,
+    content = 'book',
+    content_rowid = 'book_id',
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+
+INSERT INTO book_fts(book_fts) VALUES ('rebuild');
+
+-- add_new_books / update_book / delete_book 写 book 表时由触发器同步索引
+CREATE TRIGGER IF NOT EXISTS book_fts_after_insert AFTER INSERT ON book BEGIN
+    INSERT INTO book_fts(rowid, book_name, author, publisher)
+    VALUES (new.book_id, new.book_name, new.author, new.publisher);
+END;
+
+CREATE TRIGGER IF NOT EXISTS book_fts_after_delete AFTER DELETE ON book BEGIN
+    INSERT INTO book_fts(book_fts, rowid, book_name, author, publisher)
+    VALUES ('delete', old.book_id, old.book_name, old.author, old.publisher);
+END;
+
+-- 只在被索引的列变化时更新，借还书修改 if_available 不会触发
+CREATE TRIGGER IF NOT EXISTS book_fts_after_update AFTER UPDATE OF book_name, author, publisher ON book BEGIN
+    INSERT INTO book_fts(book_fts, rowid, book_name, author, publisher)
+    VALUES ('delete', old.book_id, old.book_name, old.author, old.publisher);
+    INSERT INTO book_fts(rowid, book_name, author, publisher)
+    VALUES (new.book_id, new.book_name, new.author, new.publisher);
+END;
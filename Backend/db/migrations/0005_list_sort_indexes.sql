@@ -0,0 +1,14 @@
+-- 列表接口键集分页（keyset pagination）使用的排序索引
+-- INTEGER PRIMARY KEY 表的索引末尾自带 rowid，可直接作为排序的唯一决胜列
+
+-- /api/search-books 空查询或 sort=book_name: ORDER BY book_name, book_id
+CREATE INDEX IF NOT EXISTS idx_book_name
+    ON book(book_name);
+
+-- /api/all-librarians sort=name: ORDER BY name, admin_id
+CREATE INDEX IF NOT EXISTS idx_librarian_information_name
+    ON librarian_information(name, admin_id);
+
+-- /api/reader-borrowings sort=due_date: WHERE student_id = ? ORDER BY due_date, record_id
+CREATE INDEX IF NOT EXISTS idx_borrow_record_student_due
+    ON borrow_record(student_id, due_date);
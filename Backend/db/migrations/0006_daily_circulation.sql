@@ -0,0 +1,81 @@
+-- /api/view-report 的每日流通汇总表
+-- borrowed: 当天借出的记录数; returned: 当天归还的记录数;
+-- due: 当前未归还、且应还日期为当天的记录数（未归还总数和逾期数都由它求和得到）
+CREATE TABLE IF NOT EXISTS daily_circulation (
+    day TEXT PRIMARY KEY,
+    borrowed INTEGER NOT NULL DEFAULT 0,
+    returned INTEGER NOT NULL DEFAULT 0,
+    due INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+
+-- 从现有借阅记录生成初始汇总（与 python -m services.circulation rebuild 相同）
+INSERT INTO daily_circulation (day, borrowed, returned, due)
+SELECT day, SUM(borrowed), SUM(returned), SUM(due)
+FROM (
+    SELECT DATE(borrow_date) AS day, 1 AS borrowed, 0 AS returned, 0 AS due
+    FROM borrow_record
+    UNION ALL
+    SELECT DATE(return_date), 0, 1, 0
+    FROM borrow_record WHERE return_date IS NOT NULL AND return_date != ''
+    UNION ALL
+    SELECT DATE(due_date), 0, 0, 1
+    FROM borrow_record WHERE return_date IS NULL OR return_date = ''
+)
+WHERE day IS NOT NULL
+GROUP BY day;
+
+-- borrow_book / return_book / renew_book / delete_book / delete_reader 写 borrow_record 时，
+-- 由触发器在同一事务内更新汇总
+CREATE TRIGGER IF NOT EXISTS daily_circulation_after_insert AFTER INSERT ON borrow_record BEGIN
+    INSERT INTO daily_circulation (day, borrowed)
+    SELECT DATE(new.borrow_date), 1 WHERE DATE(new.borrow_date) IS NOT NULL
+    ON CONFLICT (day) DO UPDATE SET borrowed = borrowed + 1;
+
+    INSERT INTO daily_circulation (day, returned)
+    SELECT DATE(new.return_date), 1
+    WHERE new.return_date IS NOT NULL AND new.return_date != '' AND DATE(new.return_date) IS NOT NULL
+    ON CONFLICT (day) DO UPDATE SET returned = returned + 1;
+
+    INSERT INTO daily_circulation (day, due)
+    SELECT DATE(new.due_date), 1
+    WHERE (new.return_date IS NULL OR new.return_date = '') AND DATE(new.due_date) IS NOT NULL
+    ON CONFLICT (day) DO UPDATE SET due = due + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS daily_circulation_after_delete AFTER DELETE ON borrow_record BEGIN
+    UPDATE daily_circulation SET borrowed = borrowed - 1
+    WHERE day = DATE(old.borrow_date);
+
+    UPDATE daily_circulation SET returned = returned - 1
+    WHERE day = DATE(old.return_date) AND old.return_date != '';
+
+    UPDATE daily_circulation SET due = due - 1
+    WHERE day = DATE(old.due_date) AND (old.return_date IS NULL OR old.return_date = '');
+END;
+
+-- 归还（写 return_date）和续借（改 due_date）：先减去旧记录的贡献，再加上新记录的贡献
+CREATE TRIGGER IF NOT EXISTS daily_circulation_after_update
+AFTER UPDATE OF borrow_date, due_date, return_date ON borrow_record BEGIN
+    UPDATE daily_circulation SET borrowed = borrowed - 1
+    WHERE day = DATE(old.borrow_date);
+
+    UPDATE daily_circulation SET returned = returned - 1
+    WHERE day = DATE(old.return_date) AND old.return_date != '';
+
+    UPDATE daily_circulation SET due = due - 1
+    WHERE day = DATE(old.due_date) AND (old.return_date IS NULL OR old.return_date = '');
+
+    INSERT INTO daily_circulation (day, borrowed)
+    SELECT DATE(new.borrow_date), 1 WHERE DATE(new.borrow_date) IS NOT NULL
+    ON CONFLICT (day) DO UPDATE SET borrowed = borrowed + 1;
+
+    INSERT INTO daily_circulation (day, returned)
+    SELECT DATE(new.return_date), 1
+    WHERE new.return_date IS NOT NULL AND new.return_date != '' AND DATE(new.return_date) IS NOT NULL
+    ON CONFLICT (day) DO UPDATE SET returned = returned + 1;
+
+    INSERT INTO daily_circulation (day, due)
+    SELECT DATE(new.due_date), 1
+    WHERE (new.return_date IS NULL OR new.return_date = '') AND DATE(new.due_date) IS NOT NULL
+    ON CONFLICT (day) DO UPDATE SET due = due + 1;
+END;
@@ -0,0 +1,66 @@
+-- 结构化审计日志，取代自由文本的 operation_log
+-- ts: Unix 时间戳（秒）; actor_role: reader / librarian / director / system;
+-- action: borrow / return / renew / register / create / update / delete;
+-- target_type: book / reader / librarian / director; message: 日志页面显示的原文
+CREATE TABLE IF NOT EXISTS audit_log (
+    audit_id INTEGER PRIMARY KEY,
+    ts INTEGER NOT NULL,
+    actor_role TEXT NOT NULL,
+    actor_id TEXT,
+    action TEXT NOT NULL,
+    target_type TEXT NOT NULL,
+    target_id TEXT,
+    message TEXT NOT NULL
+);
+
+-- /api/view-library-logs 和 /api/audit-log 按时间范围查询
+CREATE INDEX IF NOT EXISTS idx_audit_log_ts
+    ON audit_log(ts);
+
+-- /api/audit-log 按操作者或操作对象过滤，再按时间排序（索引末尾自带 audit_id）
+CREATE INDEX IF NOT EXISTS idx_audit_log_actor
+    ON audit_log(actor_role, actor_id, ts);
+
+CREATE INDEX IF NOT EXISTS idx_audit_log_target
+    ON audit_log(target_type, target_id, ts);
+
+-- 迁移旧日志：按各路由原来写入的句式解析出操作者和操作对象，无法识别的记为 system / unknown
+-- subject 为句中第二个词（Student / Librarian 后的编号），last_word 为句末的编号
+INSERT INTO audit_log (ts, actor_role, actor_id, action, target_type, target_id, message)
+WITH patterns (pattern, actor_role, actor_is_subject, action, target_type, target_is_subject) AS (
+    VALUES
+        ('Student * borrowed book *', 'reader', 1, 'borrow', 'book', 0),
+        ('Student * returned book *', 'reader', 1, 'return', 'book', 0),
+        ('Student * renewed book *', 'reader', 1, 'renew', 'book', 0),
+        ('Student * logged up *', 'reader', 1, 'register', 'reader', 1),
+        ('Student * updated the personal information', 'reader', 1, 'update', 'reader', 1),
+        ('Librarian * update personal information', 'librarian', 1, 'update', 'librarian', 1),
+        ('librarian add new reader *', 'librarian', 0, 'create', 'reader', 0),
+        ('librarian update the information of reader *', 'librarian', 0, 'update', 'reader', 0),
+        ('librarian deleted reader *', 'librarian', 0, 'delete', 'reader', 0),
+        ('librarian add book *', 'librarian', 0, 'create', 'book', 0),
+        ('librarian update book *', 'librarian', 0, 'update', 'book', 0),
+        ('librarian delete the book *', 'librarian', 0, 'delete', 'book', 0),
+        ('director deleted the librarian *', 'director', 0, 'delete', 'librarian', 0),
+        ('director add new librarian *', 'director', 0, 'create', 'librarian', 0)
+),
+legacy AS (
+    SELECT
+        COALESCE(CAST(strftime('%s', date, 'utc') AS INTEGER), 0) AS ts,
+        operation,
+        substr(operation, instr(operation, ' ') + 1,
+               instr(substr(operation, instr(operation, ' ') + 1) || ' ', ' ') - 1) AS subject,
+        replace(operation, rtrim(operation, replace(operation, ' ', '')), '') AS last_word
+    FROM operation_log
+)
+SELECT
+    l.ts,
+    COALESCE(p.actor_role, 'system'),
+    CASE WHEN p.actor_is_subject THEN l.subject END,
+    COALESCE(p.action, 'unknown'),
+    COALESCE(p.target_type, 'unknown'),
+    CASE WHEN p.pattern IS NULL THEN NULL WHEN p.target_is_subject THEN l.subject ELSE l.last_word END,
+    l.operation
+FROM legacy l
+LEFT JOIN patterns p ON l.operation GLOB p.pattern
+ORDER BY l.ts;
@@ -0,0 +1,37 @@
+-- 编号序列表，取代各接口中的 SELECT MAX(...) + 1
+-- next_value: 下一个可分配的编号；由 services/id_allocator.py 按号段预留
+-- reader: reader_id 'Reader N' 中的 N; librarian: admin_id
+-- 图书使用 book 表自身的 AUTOINCREMENT，不在此表中
+CREATE TABLE IF NOT EXISTS id_sequence (
+    name TEXT PRIMARY KEY,
+    next_value INTEGER NOT NULL
+) WITHOUT ROWID;
+
+-- 统一读者编号的大小写：小写 'reader N' 与已有 'Reader N' 冲突的，改用当前最大编号之后的新编号
+UPDATE reader_information AS r
+SET reader_id = 'Reader ' || (m.max_number + c.n)
+FROM (
+    SELECT reader_id, ROW_NUMBER() OVER (ORDER BY CAST(SUBSTR(reader_id, 8) AS INTEGER)) AS n
+    FROM reader_information
+    WHERE reader_id GLOB 'reader *'
+      AND 'Reader ' || SUBSTR(reader_id, 8) IN (SELECT reader_id FROM reader_information)
+) AS c, (
+    SELECT COALESCE(MAX(CAST(SUBSTR(reader_id, 8) AS INTEGER)), 0) AS max_number
+    FROM reader_information
+    WHERE reader_id LIKE 'reader %'
+) AS m
+WHERE r.reader_id = c.reader_id;
+
+-- 其余小写编号直接改为 'Reader N'
+UPDATE reader_information
+SET reader_id = 'Reader ' || SUBSTR(reader_id, 8)
+WHERE reader_id GLOB 'reader *';
+
+INSERT OR IGNORE INTO id_sequence (name, next_value)
+SELECT 'reader', COALESCE(MAX(CAST(SUBSTR(reader_id, 8) AS INTEGER)), 0) + 1
+FROM reader_information
+WHERE reader_id GLOB 'Reader *';
+
+INSERT OR IGNORE INTO id_sequence (name, next_value)
+SELECT 'librarian', COALESCE(MAX(CAST(admin_id AS INTEGER)), 0) + 1
+FROM librarian_information;
@@ -0,0 +1,163 @@
+-- /api/reader-reading-report 的每位读者阅读统计
+-- 读报告时只读 reader_reading_stats 的一行，不再扫描读者的全部借阅历史
+
+-- 每位读者每天借出的册数（用于"一次借书最多的一天"）
+CREATE TABLE IF NOT EXISTS reader_checkout_day (
+    student_id TEXT NOT NULL,
+    day TEXT NOT NULL,
+    books INTEGER NOT NULL,
+    PRIMARY KEY (student_id, day)
+) WITHOUT ROWID;
+
+-- 按册数倒序取最多的一天
+CREATE INDEX IF NOT EXISTS idx_reader_checkout_day_books
+    ON reader_checkout_day(student_id, books, day);
+
+-- total_borrows / open_loans: 借阅总数和未归还数，由 borrow_record 的触发器增量维护
+-- busiest_day / busiest_books / busiest_titles: 借书最多的一天（并列取最近一天）、当天册数、最多 5 个书名（JSON 数组）
+-- favorite_title / favorite_days: 截至 as_of 的 90 天内累计借阅天数最多的书名
+-- as_of: 上述统计的计算日期；每晚的滚动任务（python -m services.reading_stats roll）把它推进到当天
+CREATE TABLE IF NOT EXISTS reader_reading_stats (
+    student_id TEXT PRIMARY KEY,
+    total_borrows INTEGER NOT NULL DEFAULT 0,
+    open_loans INTEGER NOT NULL DEFAULT 0,
+    busiest_day TEXT,
+    busiest_books INTEGER,
+    busiest_titles TEXT,
+    favorite_title TEXT,
+    favorite_days INTEGER,
+    as_of TEXT
+) WITHOUT ROWID;
+
+-- 每晚滚动时找出 as_of 早于今天的读者
+CREATE INDEX IF NOT EXISTS idx_reader_reading_stats_as_of
+    ON reader_reading_stats(as_of);
+
+-- 计数或 as_of 被写入时重新计算这位读者的统计：
+-- 最多的一天按索引取一行，90 天窗口只扫描窗口内的借阅记录
+-- （与原先的 Python 实现一致：按书名合并，未归还的算到今天，每次至少 1 天，并列时取最近借的）
+CREATE TRIGGER IF NOT EXISTS reader_reading_stats_refresh
+AFTER UPDATE OF total_borrows, open_loans, as_of ON reader_reading_stats BEGIN
+    UPDATE reader_reading_stats
+    SET (busiest_day, busiest_books) = (
+        SELECT day, books FROM reader_checkout_day
+        WHERE student_id = new.student_id AND books > 0
+        ORDER BY books DESC, day DESC
+        LIMIT 1
+    )
+    WHERE student_id = new.student_id;
+
+    UPDATE reader_reading_stats
+    SET busiest_titles = (
+        SELECT json_group_array(book_name) FROM (
+            SELECT b.book_name
+            FROM borrow_record br
+            JOIN book b ON b.book_id = br.book_id
+            WHERE br.student_id = new.student_id
+              AND br.borrow_date >= reader_reading_stats.busiest_day
+              AND br.borrow_date < DATE(reader_reading_stats.busiest_day, '+1 day')
+            ORDER BY br.borrow_date DESC, br.record_id DESC
+            LIMIT 5
+        )
+    ),
+    (favorite_title, favorite_days) = (
+        SELECT b.book_name,
+               SUM(MAX(CAST(JULIANDAY(COALESCE(NULLIF(br.return_date, ''), new.as_of))
+                            - JULIANDAY(br.borrow_date) AS INTEGER), 1)) AS days
+        FROM borrow_record br
+        JOIN book b ON b.book_id = br.book_id
+        WHERE br.student_id = new.student_id
+          AND br.borrow_date >= DATE(new.as_of, '-90 days')
+        GROUP BY b.book_name
+        ORDER BY days DESC, MAX(br.borrow_date) DESC, MAX(br.record_id) DESC
+        LIMIT 1
+    )
+    WHERE student_id = new.student_id;
+END;
+
+-- borrow_book / borrow_books 及其他写 borrow_record 的操作：同一事务内更新计数
+CREATE TRIGGER IF NOT EXISTS reader_reading_stats_after_insert AFTER INSERT ON borrow_record BEGIN
+    INSERT INTO reader_checkout_day (student_id, day, books)
+    SELECT new.student_id, DATE(new.borrow_date), 1 WHERE DATE(new.borrow_date) IS NOT NULL
+    ON CONFLICT (student_id, day) DO UPDATE SET books = books + 1;
+
+    INSERT INTO reader_reading_stats (student_id) VALUES (new.student_id)
+    ON CONFLICT (student_id) DO NOTHING;
+
+    UPDATE reader_reading_stats
+    SET total_borrows = total_borrows + 1,
+        open_loans = open_loans + (new.return_date IS NULL OR new.return_date = ''),
+        as_of = DATE('now', 'localtime')
+    WHERE student_id = new.student_id;
+END;
+
+-- delete_book / delete_reader 删除借阅记录
+CREATE TRIGGER IF NOT EXISTS reader_reading_stats_after_delete AFTER DELETE ON borrow_record BEGIN
+    UPDATE reader_checkout_day SET books = books - 1
+    WHERE student_id = old.student_id AND day = DATE(old.borrow_date);
+
+    DELETE FROM reader_checkout_day
+    WHERE student_id = old.student_id AND day = DATE(old.borrow_date) AND books <= 0;
+
+    UPDATE reader_reading_stats
+    SET total_borrows = total_borrows - 1,
+        open_loans = open_loans - (old.return_date IS NULL OR old.return_date = ''),
+        as_of = DATE('now', 'localtime')
+    WHERE student_id = old.student_id;
+END;
+
+-- 还书（写 return_date）；续借只改 due_date，不影响统计
+CREATE TRIGGER IF NOT EXISTS reader_reading_stats_after_update
+AFTER UPDATE OF student_id, book_id, borrow_date, return_date ON borrow_record BEGIN
+    UPDATE reader_checkout_day SET books = books - 1
+    WHERE student_id = old.student_id AND day = DATE(old.borrow_date);
+
+    DELETE FROM reader_checkout_day
+    WHERE student_id = old.student_id AND day = DATE(old.borrow_date) AND books <= 0;
+
+    INSERT INTO reader_checkout_day (student_id, day, books)
+    SELECT new.student_id, DATE(new.borrow_date), 1 WHERE DATE(new.borrow_date) IS NOT NULL
+    ON CONFLICT (student_id, day) DO UPDATE SET books = books + 1;
+
+    -- 记录换了读者时，先从原读者的统计中减去
+    UPDATE reader_reading_stats
+    SET total_borrows = total_borrows - 1,
+        open_loans = open_loans - (old.return_date IS NULL OR old.return_date = ''),
+        as_of = DATE('now', 'localtime')
+    WHERE student_id = old.student_id AND old.student_id IS NOT new.student_id;
+
+    INSERT INTO reader_reading_stats (student_id) VALUES (new.student_id)
+    ON CONFLICT (student_id) DO NOTHING;
+
+    UPDATE reader_reading_stats
+    SET total_borrows = total_borrows + (old.student_id IS NOT new.student_id),
+        open_loans = open_loans + (new.return_date IS NULL OR new.return_date = '')
+                   - (old.student_id IS new.student_id AND (old.return_date IS NULL OR old.return_date = '')),
+        as_of = DATE('now', 'localtime')
+    WHERE student_id = new.student_id;
+END;
+
+-- delete_reader 删除读者后清除其统计
+CREATE TRIGGER IF NOT EXISTS reader_reading_stats_after_reader_delete
+AFTER DELETE ON reader_information BEGIN
+    DELETE FROM reader_checkout_day WHERE student_id = old.student_id;
+    DELETE FROM reader_reading_stats WHERE student_id = old.student_id;
+END;
+
+-- 从现有借阅记录生成初始统计（与 python -m services.reading_stats rebuild 相同）
+INSERT INTO reader_checkout_day (student_id, day, books)
+SELECT student_id, DATE(borrow_date), COUNT(*)
+FROM borrow_record
+WHERE DATE(borrow_date) IS NOT NULL
+GROUP BY student_id, DATE(borrow_date);
+
+INSERT INTO reader_reading_stats (student_id)
+SELECT DISTINCT student_id FROM borrow_record;
+
+-- 写入计数时由 reader_reading_stats_refresh 计算其余各列
+UPDATE reader_reading_stats
+SET (total_borrows, open_loans) = (
+        SELECT COUNT(*), COALESCE(SUM(return_date IS NULL OR return_date = ''), 0)
+        FROM borrow_record br WHERE br.student_id = reader_reading_stats.student_id
+    ),
+    as_of = DATE('now', 'localtime');
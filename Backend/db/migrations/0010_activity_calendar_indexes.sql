@@ -0,0 +1,4 @@
+-- /api/reader-activity-calendar 的归还序列：WHERE student_id = ? AND return_date 在日期范围内 GROUP BY return_date
+-- （借出序列使用 idx_borrow_record_student_borrow，续借序列使用 idx_audit_log_actor）
+CREATE INDEX IF NOT EXISTS idx_borrow_record_student_return
+    ON borrow_record(student_id, return_date);
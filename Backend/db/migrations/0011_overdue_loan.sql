@@ -0,0 +1,54 @@
+-- /api/overdue 的逾期借阅集合
+-- 逾期 = 未归还且 due_date < as_of（与 /api/view-report 的逾期明细条件相同）
+-- as_of 由逾期跟踪任务（services/overdue.py）在每天日期变化后推进
+
+CREATE TABLE IF NOT EXISTS overdue_state (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    as_of TEXT NOT NULL
+);
+
+INSERT OR IGNORE INTO overdue_state (id, as_of) VALUES (1, DATE('now', 'localtime'));
+
+CREATE TABLE IF NOT EXISTS overdue_loan (
+    record_id INTEGER PRIMARY KEY,
+    student_id TEXT NOT NULL,
+    book_id INTEGER NOT NULL,
+    due_date TEXT NOT NULL
+);
+
+-- 按逾期天数排序即按 due_date 排序（record_id 作为决胜列）；按读者过滤时走第二个索引
+CREATE INDEX IF NOT EXISTS idx_overdue_loan_due
+    ON overdue_loan(due_date, record_id);
+CREATE INDEX IF NOT EXISTS idx_overdue_loan_student_due
+    ON overdue_loan(student_id, due_date, record_id);
+
+-- 借阅记录写入时（导入的旧记录可能已经逾期）
+CREATE TRIGGER IF NOT EXISTS overdue_loan_after_insert AFTER INSERT ON borrow_record BEGIN
+    INSERT OR REPLACE INTO overdue_loan (record_id, student_id, book_id, due_date)
+    SELECT new.record_id, new.student_id, new.book_id, new.due_date
+    WHERE (new.return_date IS NULL OR new.return_date = '')
+      AND new.due_date < (SELECT as_of FROM overdue_state WHERE id = 1);
+END;
+
+-- delete_book / delete_reader
+CREATE TRIGGER IF NOT EXISTS overdue_loan_after_delete AFTER DELETE ON borrow_record BEGIN
+    DELETE FROM overdue_loan WHERE record_id = old.record_id;
+END;
+
+-- return_book（写 return_date）移出集合；renew_book（改 due_date）按新的应还日期重新判断
+CREATE TRIGGER IF NOT EXISTS overdue_loan_after_update
+AFTER UPDATE OF student_id, book_id, due_date, return_date ON borrow_record BEGIN
+    DELETE FROM overdue_loan WHERE record_id = old.record_id;
+
+    INSERT INTO overdue_loan (record_id, student_id, book_id, due_date)
+    SELECT new.record_id, new.student_id, new.book_id, new.due_date
+    WHERE (new.return_date IS NULL OR new.return_date = '')
+      AND new.due_date < (SELECT as_of FROM overdue_state WHERE id = 1);
+END;
+
+-- 从现有借阅记录生成初始集合（与 python -m services.overdue rebuild 相同）
+INSERT OR IGNORE INTO overdue_loan (record_id, student_id, book_id, due_date)
+SELECT record_id, student_id, book_id, due_date
+FROM borrow_record
+WHERE (return_date IS NULL OR return_date = '')
+  AND due_date < (SELECT as_of FROM overdue_state WHERE id = 1);
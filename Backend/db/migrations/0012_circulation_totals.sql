@@ -0,0 +1,24 @@
+-- /api/view-report 的未归还总数：单行累计值，读取时不再对 daily_circulation 求和
+-- outstanding = SUM(daily_circulation.due)；由 daily_circulation 上的触发器随每次增删改调整，
+-- 所以 0006 的触发器和 python -m services.circulation rebuild 都会同步更新它
+
+CREATE TABLE IF NOT EXISTS circulation_totals (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    outstanding INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT OR IGNORE INTO circulation_totals (id, outstanding)
+SELECT 1, COALESCE(SUM(due), 0) FROM daily_circulation;
+
+CREATE TRIGGER IF NOT EXISTS circulation_totals_after_insert AFTER INSERT ON daily_circulation BEGIN
+    UPDATE circulation_totals SET outstanding = outstanding + new.due WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS circulation_totals_after_delete AFTER DELETE ON daily_circulation BEGIN
+    UPDATE circulation_totals SET outstanding = outstanding - old.due WHERE id = 1;
+END;
+
+-- 借还、续借的 ON CONFLICT DO UPDATE 也会触发
+CREATE TRIGGER IF NOT EXISTS circulation_totals_after_update AFTER UPDATE OF due ON daily_circulation BEGIN
+    UPDATE circulation_totals SET outstanding = outstanding + new.due - old.due WHERE id = 1;
+END;
@@ -0,0 +1,89 @@
+import base64
+import binascii
+import json
+import os
+from typing import Optional, Sequence
+
+# 列表接口默认每页条数和允许的最大条数
+DEFAULT_LIMIT = int(os.environ.get("LIBRARY_PAGE_SIZE", "50"))
+MAX_LIMIT = int(os.environ.get("LIBRARY_MAX_PAGE_SIZE", "200"))
+
+
+class InvalidPageRequest(ValueError):
+    """
+    Raised for a sort option or cursor that the list endpoint cannot serve
+    """
+
+
+class SortKey:
+    """
+    One allowed sort order of a list endpoint
+    The last column must be unique so that (columns) identifies a row, and the
+    columns must match an index so each page is a range read instead of a sort
+    """
+
+    def __init__(self, *columns: str, descending: bool = False):
+        self.columns = columns
+        self.descending = descending
+
+    def order_by(self) -> str:
+        direction = "DESC" if self.descending else "ASC"
+        return ", ".join(f"{column} {direction}" for column in self.columns)
+
+    def seek(self) -> str:
+        """
+        WHERE condition selecting the rows after the cursor position
+        """
+        placeholders = ", ".join("?" for _ in self.columns)
+        return f"({', '.join(self.columns)}) {'<' if self.descending else '>'} ({placeholders})"
+
+
+    def cursor_values(self, row) -> list:
+        """
+        Sort-key values of a result row, looked up by column name without the table alias
+        """
+        return [row[column.split(".")[-1]] for column in self.columns]
+
+
+def where_sql(conditions: list[str]) -> str:
+    """
+    WHERE clause joining the filter and seek conditions with AND, or "" when there are none
+    """
+    return f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+
+def resolve_sort(sort: str, allowed: dict) -> SortKey:
+    if sort not in allowed:
+        raise InvalidPageRequest(f"Invalid sort '{sort}'. Must be one of: {', '.join(allowed)}")
+    return allowed[sort]
+
+
+def encode_cursor(sort: str, values: Sequence) -> str:
+    """
+    Opaque cursor: the sort name plus the sort-key values of the last row returned
+    """
+    raw = json.dumps([sort, list(values)], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str], sort: str, size: int) -> Optional[list]:
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, values = json.loads(raw)
+    except (binascii.Error, ValueError, TypeError):
+        raise InvalidPageRequest("Invalid cursor")
+    if cursor_sort != sort or not isinstance(values, list) or len(values) != size:
+        raise InvalidPageRequest("Cursor does not belong to this sort order")
+    return values
+
+
+def page_response(key: str, items: list, next_cursor: Optional[str], total: Optional[int]) -> dict:
+    """
+    List response: the original list key plus next_cursor (None on the last page) and, if requested, total
+    """
+    response = {key: items, "next_cursor": next_cursor}
+    if total is not None:
+        response["total"] = total
+    return response
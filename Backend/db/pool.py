@@ -0,0 +1,126 @@
+import os
+import queue
+import sqlite3
+import threading
+import logging
+from contextlib import contextmanager
+
+from db.metrics import DB_METRICS, MeteredConnection
+
+logger = logging.getLogger(__name__)
+
+# 数据库路径和连接池大小可以通过环境变量覆盖
+DB_PATH = os.environ.get("LIBRARY_DB_PATH", "library.db")
+POOL_SIZE = int(os.environ.get("LIBRARY_DB_POOL_SIZE", "8"))
+CHECKOUT_TIMEOUT = float(os.environ.get("LIBRARY_DB_CHECKOUT_TIMEOUT", "10"))
+STATEMENT_CACHE_SIZE = 256
+
+# 连接创建时只执行一次的 PRAGMA
+CONNECTION_PRAGMAS = (
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 268435456",
+)
+
+
+class PoolTimeout(sqlite3.OperationalError):
+    """Raised when no pooled connection becomes free within the checkout timeout"""
+
+
+def open_connection(path: str = DB_PATH) -> sqlite3.Connection:
+    """
+    Open and configure one SQLite connection
+    Rows come back as sqlite3.Row so both row[0] and row["column"] work; the
+    connection counts its statements and rows for /metrics (db/metrics.py)
+    """
+    conn = sqlite3.connect(path, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE,
+                           factory=MeteredConnection if DB_METRICS else sqlite3.Connection)
+    conn.row_factory = sqlite3.Row
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class ConnectionPool:
+    """
+    Bounded pool of long-lived SQLite connections
+    Connections are created lazily up to `size` and reused afterwards
+    """
+
+    def __init__(self, path: str, size: int, timeout: float):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+
+        if can_create:
+            try:
+                return open_connection(self.path)
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise PoolTimeout(f"No database connection available after {self.timeout}s")
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        # 归还前回滚未提交的事务，避免把脏状态带给下一个请求
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error as e:
+            logger.warning(f"Discarding broken pooled connection: {e}")
+            self._discard(conn)
+            return
+
+        if self._closed:
+            self._discard(conn)
+            return
+
+        self._idle.put_nowait(conn)
+
+    def _discard(self, conn: sqlite3.Connection) -> None:
+        with self._lock:
+            self._created -= 1
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self) -> None:
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+
+pool = ConnectionPool(DB_PATH, POOL_SIZE, CHECKOUT_TIMEOUT)
@@ -0,0 +1,128 @@
+"""
+Query plan check for the SQL issued by the API routes
+
+The statements are not copied here: tests/test_query_plans.py calls every API
+route, the startup loads and the background rolls against a test copy of the
+database while record_statements() collects what the connections execute, and
+the trigger bodies are read from sqlite_master. check_plans() runs EXPLAIN QUERY
+PLAN for each distinct statement and reports the ones that fall back to a full
+table scan. Scans that are bounded or intended by design match one of
+ALLOWED_SCANS and are reported with its reason instead of failing.
+
+Usage: python -m pytest tests/test_query_plans.py -s   (prints every plan)
+"""
+import re
+import sqlite3
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Optional
+
+from db.metrics import statement_log
+
+# 只检查这些语句；BEGIN、SAVEPOINT、PRAGMA 等没有查询计划
+PLANNED = re.compile(r"^(SELECT|INSERT|UPDATE|DELETE|REPLACE|WITH)\b", re.IGNORECASE)
+
+# 按设计允许的全表扫描：(规范化 SQL 的正则, 原因)
+ALLOWED_SCANS = [
+    (re.compile(r"^SELECT [\w, ]+ FROM \w+$"),
+     "in-memory index or snapshot is built from the whole table once at startup"),
+    (re.compile(r"^SELECT COUNT\(\*\) FROM \w+( \w+)?$"),
+     "total of an unfiltered list"),
+    (re.compile(r"^SELECT (?!.*\bWHERE\b).* ORDER BY [^()]+ LIMIT \?$"),
+     "first page walks the sort index from the start and stops at LIMIT"),
+]
+
+_TRIGGER_BODY = re.compile(r"\bBEGIN\b(.*)\bEND\s*$", re.IGNORECASE | re.DOTALL)
+_TRIGGER_ROW = re.compile(r"\b(new|old)\.\w+", re.IGNORECASE)
+
+
+def normalize(sql: str) -> str:
+    return " ".join(sql.split())
+
+
+@contextmanager
+def record_statements() -> Iterator[list]:
+    """
+    Collect (sql, params) of every statement run on a metered connection by code
+    in this context, including work it hands to the database threads and the writer
+    """
+    statements: list = []
+    token = statement_log.set(statements)
+    try:
+        yield statements
+    finally:
+        statement_log.reset(token)
+
+
+def trigger_statements(conn: sqlite3.Connection) -> list[tuple[str, str, tuple]]:
+    """
+    (origin, sql, params) for each statement in a trigger body, with new./old.
+    column references turned into parameters
+    """
+    statements = []
+    for name, sql in conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' ORDER BY name"):
+        body = _TRIGGER_BODY.search(sql)
+        if body is None:
+            continue
+        for statement in body.group(1).split(";"):
+            statement = _TRIGGER_ROW.sub("?", statement).strip()
+            if statement:
+                statements.append((f"trigger {name}", statement, (None,) * statement.count("?")))
+    return statements
+
+
+def full_scans(plan: list[str]) -> list[str]:
+    """
+    Plan steps that visit every row of a table, directly or by walking a whole index
+    Virtual table steps (full-text MATCH) are answered by the module's own index,
+    a constant row is the single row of a scalar SELECT without FROM, and a
+    subquery scan reads the rows its own (checked) steps produced
+    """
+    return [
+        step for step in plan
+        if step.startswith("SCAN ") and " VIRTUAL TABLE " not in step and step != "SCAN CONSTANT ROW"
+        and not step.startswith("SCAN (subquery")
+    ]
+
+
+def allowed_scan(sql: str, plan: list[str]) -> Optional[str]:
+    if any(step.startswith("USE TEMP B-TREE FOR") for step in plan):
+        return None
+    for pattern, reason in ALLOWED_SCANS:
+        if pattern.search(sql):
+            return reason
+    return None
+
+
+def check_plans(conn: sqlite3.Connection, statements: Iterable[tuple[str, str, tuple]]) -> list[tuple]:
+    """
+    EXPLAIN QUERY PLAN for each distinct statement, given as (origin, sql, params)
+    Returns (status, origin, sql, plan, note) rows; status is ok, allowed or FULL SCAN
+    """
+    results = []
+    seen = set()
+    for origin, sql, params in statements:
+        sql = normalize(sql)
+        if sql in seen or not PLANNED.match(sql):
+            continue
+        seen.add(sql)
+        plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        scans = full_scans(plan)
+        reason = allowed_scan(sql, plan) if scans else None
+        if not scans:
+            results.append(("ok", origin, sql, plan, ""))
+        elif reason:
+            results.append(("allowed", origin, sql, plan, reason))
+        else:
+            results.append(("FULL SCAN", origin, sql, plan, ""))
+    return results
+
+
+def format_results(results: list[tuple]) -> str:
+    lines = []
+    for status, origin, sql, plan, note in results:
+        lines.append(f"{status:<10} {origin:<45} {' | '.join(plan)}{f'  [{note}]' if note else ''}")
+        if status == "FULL SCAN":
+            lines.append(f"           {sql}")
+    failures = sum(1 for result in results if result[0] == "FULL SCAN")
+    lines.append(f"\n{len(results)} statements checked, {failures} full table scan(s)")
+    return "\n".join(lines)
@@ -0,0 +1,222 @@
+import asyncio
+import contextvars
+import os
+import queue
+import random
+import sqlite3
+import threading
+import time
+import logging
+from concurrent.futures import Future
+from typing import Any, Callable
+
+from db.pool import DB_PATH, open_connection
+
+logger = logging.getLogger(__name__)
+
+# 一次组提交最多合并多少个排队的写事务
+MAX_BATCH = int(os.environ.get("LIBRARY_DB_WRITE_BATCH", "64"))
+# 写锁被其他进程（命令行导入、rebuild 等）占用超过 busy_timeout 时，BEGIN/COMMIT 最多再重试几次
+BUSY_RETRIES = int(os.environ.get("LIBRARY_DB_BUSY_RETRIES", "3"))
+# 第一次重试前的等待秒数，之后每次翻倍并加随机抖动
+BUSY_BACKOFF = float(os.environ.get("LIBRARY_DB_BUSY_BACKOFF", "0.05"))
+
+_STOP = object()
+
+
+def is_busy(error: sqlite3.Error) -> bool:
+    """
+    True for SQLITE_BUSY / SQLITE_LOCKED: another connection holds the lock
+    """
+    code = getattr(error, "sqlite_errorcode", None)
+    if code is not None:
+        return code & 0xFF in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    return "locked" in str(error) or "busy" in str(error)
+
+
+class WriteJob:
+    def __init__(self, fn: Callable, args: tuple):
+        self.fn = fn
+        self.args = args
+        self.future: Future = Future()
+        self.on_commit: list[Callable[[], None]] = []
+        self.on_rollback: list[Callable[[], None]] = []
+        # 提交方的上下文（请求 id 等），任务和回调都在其中执行
+        self.context = contextvars.copy_context()
+
+
+class SingleWriter:
+    """
+    Funnels every write through one connection owned by one thread
+    Jobs queued while a commit is in progress are merged into the next batch:
+    each job runs inside its own SAVEPOINT, the batch is committed once, and
+    every caller gets back its own result or exception
+    """
+
+    def __init__(self, path: str, max_batch: int, busy_retries: int = BUSY_RETRIES,
+                 busy_backoff: float = BUSY_BACKOFF):
+        self.path = path
+        self.max_batch = max_batch
+        self.busy_retries = busy_retries
+        self.busy_backoff = busy_backoff
+        self._queue: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._conn = None
+        self._current = threading.local()
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._conn = open_connection(self.path)
+            # 显式管理事务，关闭 sqlite3 模块的隐式 BEGIN
+            self._conn.isolation_level = None
+            mode = self._conn.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+            if mode.lower() != "wal":
+                logger.warning(f"Could not switch database to WAL mode, journal_mode = {mode}")
+            # WAL 模式下 NORMAL 同步级别不会损坏数据库，只可能丢失最后几次提交
+            self._conn.execute("PRAGMA synchronous = NORMAL")
+            self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, fn: Callable[..., Any], *args) -> Future:
+        if self._thread is None:
+            self.start()
+        job = WriteJob(fn, args)
+        self._queue.put(job)
+        return job.future
+
+    async def write(self, fn: Callable[..., Any], *args) -> Any:
+        """
+        Queue fn(conn, *args) for the writer thread and wait for its committed result
+        """
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def after_commit(self, callback: Callable[[], None]) -> None:
+        """
+        Called from inside a write job: run callback on the writer thread once the
+        job's changes are committed, in commit order; dropped if the job rolls back
+        """
+        job = getattr(self._current, "job", None)
+        if job is None:
+            raise RuntimeError("after_commit() must be called from inside a write job")
+        job.on_commit.append(callback)
+
+    def after_rollback(self, callback: Callable[[], None]) -> None:
+        """
+        Called from inside a write job: run callback on the writer thread if the
+        job's changes are rolled back, either on its own or with its whole batch
+        """
+        job = getattr(self._current, "job", None)
+        if job is None:
+            raise RuntimeError("after_rollback() must be called from inside a write job")
+        job.on_rollback.append(callback)
+
+    @staticmethod
+    def _rolled_back(job: WriteJob) -> None:
+        job.on_commit.clear()
+        callbacks, job.on_rollback = job.on_rollback, []
+        for callback in callbacks:
+            try:
+                job.context.run(callback)
+            except Exception as e:
+                logger.error(f"after_rollback callback failed: {e}")
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            job = self._queue.get()
+            if job is _STOP:
+                break
+            batch = [job]
+            while len(batch) < self.max_batch:
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is _STOP:
+                    stopping = True
+                    break
+                batch.append(job)
+            self._commit_batch(batch)
+
+    def _execute_with_retry(self, conn: sqlite3.Connection, sql: str) -> None:
+        """
+        Run BEGIN IMMEDIATE or COMMIT, retrying a bounded number of times with
+        jittered exponential backoff while another process holds the write lock
+        Both are safe to repeat: a busy BEGIN takes no lock, a busy COMMIT keeps
+        the transaction open
+        """
+        for attempt in range(self.busy_retries + 1):
+            try:
+                conn.execute(sql)
+                return
+            except sqlite3.OperationalError as e:
+                if not is_busy(e) or attempt == self.busy_retries:
+                    raise
+                delay = self.busy_backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+                logger.warning(f"{sql} busy ({e}), retry {attempt + 1}/{self.busy_retries} in {delay:.3f}s")
+                time.sleep(delay)
+
+    def _commit_batch(self, batch: list[WriteJob]) -> None:
+        conn = self._conn
+        outcomes = []
+        try:
+            self._execute_with_retry(conn, "BEGIN IMMEDIATE")
+            for job in batch:
+                if not job.future.set_running_or_notify_cancel():
+                    continue
+                conn.execute("SAVEPOINT write_job")
+                self._current.job = job
+                try:
+                    result = job.context.run(job.fn, conn, *job.args)
+                except BaseException as e:
+                    # 只回滚当前任务，不影响同一批次中的其他任务
+                    conn.execute("ROLLBACK TO write_job")
+                    conn.execute("RELEASE write_job")
+                    self._rolled_back(job)
+                    outcomes.append((job, None, e))
+                else:
+                    conn.execute("RELEASE write_job")
+                    outcomes.append((job, result, None))
+                finally:
+                    self._current.job = None
+            self._execute_with_retry(conn, "COMMIT")
+        except sqlite3.Error as e:
+            logger.error(f"Group commit of {len(batch)} write(s) failed: {e}")
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for job in batch:
+                self._rolled_back(job)
+                if job.future.running():
+                    job.future.set_exception(e)
+            return
+
+        for job, result, error in outcomes:
+            for callback in job.on_commit:
+                try:
+                    job.context.run(callback)
+                except Exception as e:
+                    logger.error(f"after_commit callback failed: {e}")
+            if error is not None:
+                job.future.set_exception(error)
+            else:
+                job.future.set_result(result)
+
+    def stop(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                return
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+            try:
+                self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            except sqlite3.Error as e:
+                logger.warning(f"WAL checkpoint on shutdown failed: {e}")
+            self._conn.close()
+            self._conn = None
+
+
+writer = SingleWriter(DB_PATH, MAX_BATCH)
@@ -1,23 +1,73 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Depends, Response
 from pydantic import BaseModel
 from typing import Optional
+from contextlib import asynccontextmanager
 import uvicorn
 import logging
 from fastapi.middleware.cors import CORSMiddleware
 import sqlite3
 
+from db import Database, db, get_db
+from db.migrate import run_migrations
+from services.directory_index import load_directories
+from services.audit import audit_logger
+from services.catalog_snapshot import catalog_snapshot
+from services.reading_stats import reading_stats_roller
+from services.overdue import overdue_tracker
+from services.passwords import password_hasher
+from services.sessions import session_store, current_session, LOGIN_QUERIES, REHASH_QUERIES
+from services.log_pipeline import log_pipeline, RequestContextMiddleware
+from services.metrics import MetricsMiddleware, render as render_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from services.response_cache import profile_cache
+from services.search_cache import search_metrics
+from services.activity_calendar import calendar_cache
+
 # Import the books API router
 from api.books import router as books_router
 from api.information import router as information_router
 from api.librarianReaderOperation import router as librarian_reader_operation_router
 from api.librarianBookOperation import router as librarian_book_operation_router
 from api.director import router as director_operation_router
+from api.auditLog import router as audit_log_router
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging: every logger goes through the background queue writer (JSON lines)
+log_pipeline.configure()
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Library Management System API")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 日志写线程最先启动、最后停止，保证启动和关闭过程中的日志都能输出
+    log_pipeline.start()
+    # 在其他线程启动前创建密码哈希进程池
+    password_hasher.start()
+    # 先执行尚未应用的数据库迁移
+    run_migrations()
+    # 启动单写线程（同时把数据库切换到 WAL 模式）
+    db.start()
+    # 构建读者/管理员的内存目录索引
+    await db.run(load_directories)
+    # 可选：把图书表加载为内存快照（LIBRARY_CATALOG_SNAPSHOT=1）
+    if catalog_snapshot.enabled:
+        await db.run(catalog_snapshot.load)
+    # 启动审计日志后台写入线程（仅 batched 模式）
+    audit_logger.start()
+    # 每天滚动读者阅读统计的 90 天窗口（启动时补上错过的一次）
+    reading_stats_roller.start()
+    # 日期变化后把新到期未还的借阅加入逾期集合（启动时补上错过的日期）
+    overdue_tracker.start()
+    yield
+    overdue_tracker.stop()
+    reading_stats_roller.stop()
+    # 先把队列中的审计事件写完，再关闭写线程
+    audit_logger.stop()
+    # 关闭数据库线程池和连接池
+    db.close()
+    password_hasher.close()
+    log_pipeline.stop()
+
+
+app = FastAPI(title="Library Management System API", lifespan=lifespan)
 
 # Add CORS middleware to allow requests from frontend
 app.add_middleware(
@@ -26,7 +76,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
 )
+# 按路由统计请求数、状态码、延迟和数据库工作（/metrics）
+app.add_middleware(MetricsMiddleware)
+# 请求 id 与访问日志（最外层，CORS 预检请求也会记录）
+app.add_middleware(RequestContextMiddleware)
 
 # Include the API routers
 app.include_router(books_router, prefix="/api", tags=["books"])
@@ -34,6 +89,7 @@ app.include_router(information_router, prefix="/api", tags=["information"])
 app.include_router(librarian_reader_operation_router, prefix="/api", tags=["librarianReaderOperation"])
 app.include_router(librarian_book_operation_router, prefix="/api", tags=["librarianBookOperation"])
 app.include_router(director_operation_router,prefix = "/api", tags = ["directorOperation"])
+app.include_router(audit_log_router, prefix="/api", tags=["auditLog"])
 
 # Define request model
 class LoginRequest(BaseModel):
@@ -41,117 +97,107 @@ class LoginRequest(BaseModel):
     password: str
     identity: str  # 'reader', 'librarian', or 'director'
 
-def verify_credentials(identity: str, user_id: str, entered_password: str) -> tuple[bool, Optional[str]]:
+def fetch_login(conn: sqlite3.Connection, identity: str, user_id: str) -> Optional[tuple[str, str]]:
     """
-    根据身份和ID验证密码
-    返回 (是否验证成功, 错误信息)
+    一次查询同时取出账号的密码（哈希）和姓名
     """
-    try:
-        # 连接到SQLite数据库
-        conn = sqlite3.connect('library.db')
-        cursor = conn.cursor()
-
-        if identity == 'reader':
-            # 查询读者表 - 使用 student_id 字段
-            cursor.execute("SELECT password FROM reader_information WHERE student_id = ?", (user_id,))
-        elif identity == 'librarian':
-            # 查询管理员表
-            cursor.execute("SELECT password FROM librarian_information WHERE admin_id = ?", (user_id,))
-        elif identity == 'director':
-            cursor.execute("SELECT password FROM director_information WHERE admin_id = ?", (user_id,))
-        else:
-            return False, f"Unknown identity type: {identity}"
-
-        result = cursor.fetchone()
-
-        # 关闭数据库连接
-        conn.close()
-
-        # 如果结果存在且密码匹配，返回True
-        if result and result[0] == entered_password:
-            return True, None
-        else:
-            return False, "Invalid credentials"
-
-    except sqlite3.Error as e:
-        logger.error(f"Database error in verify_credentials: {e}")
-        return False, "Database error"
-    except Exception as e:
-        logger.error(f"Error verifying credentials: {e}")
-        return False, "Server error, please check your id and retry"
+    row = conn.execute(LOGIN_QUERIES[identity], (user_id,)).fetchone()
+    return (row[0], row[1]) if row else None
 
-def get_user_name(identity: str, user_id: str) -> str:
+@app.post("/api/login")
+async def login(request: LoginRequest, db: Database = Depends(get_db)):
     """
-    从数据库获取用户姓名
+    Login endpoint that receives user credentials and identity
     """
+    # 不记录密码
+    logger.info("Login attempt - Identity: %s, ID: %s", request.identity, request.id)
+
+    if request.identity not in LOGIN_QUERIES:
+        raise HTTPException(status_code=401, detail=f"Unknown identity type: {request.identity}")
+
     try:
-        # 连接到SQLite数据库
-        conn = sqlite3.connect('library.db')
-        cursor = conn.cursor()
-
-        if identity == 'reader':
-            # 查询读者姓名
-            cursor.execute("SELECT name FROM reader_information WHERE student_id = ?", (user_id,))
-        elif identity == 'librarian':
-            # 查询管理员姓名
-            cursor.execute("SELECT name FROM librarian_information WHERE admin_id = ?", (user_id,))
-        elif identity == 'director':
-            # 查询馆长姓名
-            cursor.execute("SELECT name FROM librarian_information WHERE admin_id = ?", (user_id,))
-        else:
-            return user_id  # 如果身份未知，返回ID
-
-        result = cursor.fetchone()
-        conn.close()
-
-        if result and result[0]:
-            return result[0]
-        else:
-            return user_id
+        # 查询在数据库线程池中执行，密码校验在哈希进程池中执行，都不阻塞事件循环
+        account = await db.run(fetch_login, request.identity, request.id)
+        if account is None:
+            # 账号不存在时同样计算一次哈希，使响应时间不泄露账号是否存在
+            await password_hasher.hash(request.password)
+            raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    except sqlite3.Error as e:
-        logger.error(f"Database error in get_user_name: {e}")
-        return user_id
-    except Exception as e:
-        logger.error(f"Error getting user name: {e}")
-        return user_id
+        stored_password, full_name = account
+        is_valid, needs_rehash = await password_hasher.verify(request.password, stored_password)
+        if not is_valid:
+            raise HTTPException(status_code=401, detail="Invalid credentials")
 
-@app.post("/api/login")
-async def login(request: LoginRequest):
-    """
-    Login endpoint that receives user credentials and identity
-    """
-    # 终端打印信息
-    print("Received login request:")
-    print(f"  Identity: {request.identity}")
-    print(f"  ID: {request.id}")
-    print(f"  Password: {request.password}")
+        if needs_rehash:
+            # 明文或参数过时的密码在登录成功后原地升级为当前配置的哈希
+            new_hash = await password_hasher.hash(request.password)
 
-    # Also log to file/appropriate logging system in production
-    logger.info(f"Login attempt - Identity: {request.identity}, ID: {request.id}")
+            def _rehash(conn: sqlite3.Connection):
+                conn.execute(REHASH_QUERIES[request.identity], (new_hash, request.id, stored_password))
 
-    # 调用验证函数执行SQL
-    is_valid, error_msg = verify_credentials(request.identity, request.id, request.password)
+            await db.transaction(_rehash)
+            logger.info(f"Upgraded stored password hash for {request.identity} {request.id}")
 
-    if is_valid:
-        # 获取用户姓名
-        user_full_name = get_user_name(request.identity, request.id)
+        token, session = session_store.create(request.id, request.identity, full_name or request.id)
 
         return {
             "status": "success",
             "message": f"Login successful for {request.identity} with ID {request.id}",
             "user_id": request.id,
-            "full_name": user_full_name,  # 添加用户全名信息
+            "full_name": session["full_name"],  # 添加用户全名信息
             "role": request.identity,
-            "token": "dummy_token_for_testing"
+            "token": token,
+            "expires_at": session["expires_at"]
         }
-    else:
-        raise HTTPException(status_code=401, detail=error_msg or "Invalid credentials")
+
+    except HTTPException:
+        raise
+    except sqlite3.Error as e:
+        logger.error(f"Database error in login: {e}")
+        raise HTTPException(status_code=500, detail="Database error")
+    except Exception as e:
+        logger.error(f"Error in login: {e}")
+        raise HTTPException(status_code=500, detail="Server error, please check your id and retry")
+
+@app.get("/api/session")
+async def get_session(session: dict = Depends(current_session)):
+    """
+    The session behind the bearer token; answered from the session cache without touching the database
+    """
+    return {
+        "status": "success",
+        "user_id": session["user_id"],
+        "full_name": session["full_name"],
+        "role": session["role"],
+        "expires_at": session["expires_at"]
+    }
+
+@app.post("/api/logout")
+async def logout(session: dict = Depends(current_session)):
+    session_store.revoke(session["sid"])
+    return {"status": "success", "message": "Logged out"}
 
 # Health check endpoint
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
 
+# Prometheus metrics endpoint (request latency, database work, queues and caches)
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    components = {
+        "audit": audit_logger.metrics(),
+        "profile_cache": profile_cache.metrics(),
+        "search_cache": search_metrics(),
+        "calendar_cache": calendar_cache.metrics(),
+        "log": log_pipeline.metrics(),
+        "reading_stats": {"readers_rolled": reading_stats_roller.readers_rolled},
+        "overdue": {"loans_added": overdue_tracker.loans_added},
+    }
+    if catalog_snapshot.enabled:
+        components["catalog_snapshot"] = catalog_snapshot.stats()
+    return Response(render_metrics(components), media_type=METRICS_CONTENT_TYPE)
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="127.0.0.1", port=8000, log_level="info")
\ No newline at end of file
+    # 日志由 log_pipeline 配置；访问日志由 RequestContextMiddleware 输出（带请求 id）
+    uvicorn.run(app, host="127.0.0.1", port=8000, log_config=None, access_log=False)
\ No newline at end of file
@@ -0,0 +1,131 @@
+"""
+Reading activity calendar behind /api/reader-activity-calendar
+
+A reader's activity over a date range is three day -> count series: loans
+borrowed (borrow_record.borrow_date), loans returned (borrow_record.return_date)
+and renewals (the "renew" events in audit_log, since borrow_record keeps no
+renewal date). Each series is one grouped query over an index.
+
+A range is answered in segments: each past year is one segment, each earlier
+month of the current year another, and whatever falls in the current month or
+later is queried on every request. Activity is always recorded on the day it
+happens, so a closed segment only changes when loans are deleted (delete_book
+and delete_reader invalidate the affected readers). Closed segments are cached
+per reader with their own ETag, and a request for exactly one of them (a whole
+past year, say) is served straight from the cache.
+"""
+import os
+import json
+import logging
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from services.audit import day_start, day_end
+from services.response_cache import ResponseCache, CachedBody, make_body
+
+logger = logging.getLogger(__name__)
+
+CALENDAR_CACHE_SIZE = int(os.environ.get("LIBRARY_CALENDAR_CACHE_SIZE", "5000"))
+
+# 已结束的年份/月份不会再有新的借阅活动，条目不需要 TTL，只在删除借阅记录时失效
+calendar_cache = ResponseCache(CALENDAR_CACHE_SIZE, None)
+
+SERIES = ("activity_data", "return_data", "renew_data")
+
+
+def parse_day(value: str) -> date:
+    """
+    A 'YYYY-MM-DD' query parameter; raises ValueError for anything else
+    """
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def first_activity_day(conn, student_id: str) -> Optional[str]:
+    # 续借晚于借出；旧数据中有归还日期早于借出日期的记录，所以两列各取最小值（各走一个索引）
+    row = conn.execute("""
+        SELECT MIN(
+            (SELECT MIN(borrow_date) FROM borrow_record WHERE student_id = ?1),
+            COALESCE((SELECT MIN(return_date) FROM borrow_record WHERE student_id = ?1 AND return_date > ''), '9999')
+        )
+    """, (student_id,)).fetchone()
+    return row[0]
+
+
+def activity_series(conn, student_id: str, start: date, end: date) -> dict:
+    """
+    The three series of one reader from start to end (inclusive)
+    """
+    until = (end + timedelta(days=1)).isoformat()
+    borrows = conn.execute("""
+        SELECT borrow_date, COUNT(*)
+        FROM borrow_record
+        WHERE student_id = ? AND borrow_date >= ? AND borrow_date < ?
+        GROUP BY borrow_date
+        ORDER BY borrow_date
+    """, (student_id, start.isoformat(), until)).fetchall()
+    returns = conn.execute("""
+        SELECT return_date, COUNT(*)
+        FROM borrow_record
+        WHERE student_id = ? AND return_date >= ? AND return_date < ?
+        GROUP BY return_date
+        ORDER BY return_date
+    """, (student_id, start.isoformat(), until)).fetchall()
+    renewals = conn.execute("""
+        SELECT DATE(ts, 'unixepoch', 'localtime') AS day, COUNT(*)
+        FROM audit_log
+        WHERE actor_role = 'reader' AND actor_id = ? AND ts >= ? AND ts < ? AND action = 'renew'
+        GROUP BY day
+        ORDER BY day
+    """, (student_id, day_start(start.isoformat()), day_end(end.isoformat()))).fetchall()
+    return {
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "activity_data": {day: count for day, count in borrows},
+        "return_data": {day: count for day, count in returns},
+        "renew_data": {day: count for day, count in renewals},
+    }
+
+
+def split_range(start: date, end: date, today: date) -> list[tuple[date, date, bool]]:
+    """
+    Segments covering start..end: (first day, last day, closed)
+    Closed segments are whole years before this one, then whole months of this
+    year before the current month; the open segment is clipped to the range
+    """
+    segments = []
+    month_start = today.replace(day=1)
+    day = start
+    while day <= end and day < month_start:
+        if day.year < today.year:
+            first, last = date(day.year, 1, 1), date(day.year, 12, 31)
+        else:
+            first = day.replace(day=1)
+            last = (first + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+        segments.append((first, last, True))
+        day = last + timedelta(days=1)
+    if end >= month_start:
+        segments.append((max(start, month_start), end, False))
+    return segments
+
+
+def segment_key(student_id: str, first: date, last: date) -> tuple:
+    return ("activity-calendar", student_id, first.isoformat(), last.isoformat())
+
+
+def merge_segments(parts: list[dict], start: date, end: date) -> CachedBody:
+    """
+    One response body for start..end from the segments' series
+    """
+    low, high = start.isoformat(), end.isoformat()
+    content = {"from": low, "to": high, **{series: {} for series in SERIES}}
+    for part in parts:
+        for series in SERIES:
+            content[series].update(
+                (day, count) for day, count in part[series].items() if low <= day <= high
+            )
+    body, etag = make_body(content)
+    return CachedBody(body, etag, (), float("inf"))
+
+
+def cached_content(entry: CachedBody) -> dict:
+    return json.loads(entry.body)
@@ -0,0 +1,193 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+import logging
+from datetime import datetime, timedelta
+
+from db import writer, SingleWriter
+
+logger = logging.getLogger(__name__)
+
+# 持久化模式：sync 在业务事务内同步写入；batched 提交后入队，由后台线程按批写入
+AUDIT_MODE = os.environ.get("LIBRARY_AUDIT_MODE", "sync")
+# batched 模式下事件最多在队列中等待多少毫秒
+AUDIT_FLUSH_MS = int(os.environ.get("LIBRARY_AUDIT_FLUSH_MS", "200"))
+# 队列容量，写满后新事件被丢弃并计数
+AUDIT_QUEUE_SIZE = int(os.environ.get("LIBRARY_AUDIT_QUEUE_SIZE", "10000"))
+# 一次 executemany 最多写入多少条
+AUDIT_BATCH = int(os.environ.get("LIBRARY_AUDIT_BATCH", "500"))
+
+# 审计日志的取值约定（audit_log 表的注释中有同样说明）
+ACTOR_ROLES = ("reader", "librarian", "director", "system")
+ACTIONS = ("borrow", "return", "renew", "register", "create", "update", "delete")
+TARGET_TYPES = ("book", "reader", "librarian", "director")
+
+AUDIT_COLUMNS = ("audit_id", "ts", "actor_role", "actor_id", "action", "target_type", "target_id", "message")
+
+INSERT_SQL = """
+    INSERT INTO audit_log (ts, actor_role, actor_id, action, target_type, target_id, message)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+_STOP = object()
+
+
+def _insert_batch(conn: sqlite3.Connection, events: list[tuple]) -> None:
+    conn.executemany(INSERT_SQL, events)
+
+
+class AuditLogger:
+    """
+    Write-behind pipeline for audit events
+    In "sync" mode each event is inserted inside the caller's transaction. In
+    "batched" mode the event is queued once that transaction commits (so rolled
+    back work is never logged), and a background thread writes everything queued
+    within flush_ms as one executemany job on the single writer. The queue is
+    bounded: when it is full the event is dropped and counted, rather than
+    blocking the writer thread.
+    """
+
+    def __init__(self, writer: SingleWriter, mode: str, flush_ms: int, queue_size: int, batch_size: int):
+        if mode not in ("sync", "batched"):
+            raise ValueError(f"Invalid audit mode '{mode}'. Must be 'sync' or 'batched'")
+        self.writer = writer
+        self.mode = mode
+        self.flush_ms = flush_ms
+        self.batch_size = batch_size
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._enqueued = 0
+        self._dropped = 0
+        self._written = 0
+        self._batches = 0
+
+    def start(self) -> None:
+        if self.mode != "batched":
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+            self._thread.start()
+
+    def record(self, conn: sqlite3.Connection, event: tuple) -> None:
+        # 后台线程未运行时（sync 模式、命令行脚本、关闭之后）直接同步写入
+        if self._thread is None:
+            conn.execute(INSERT_SQL, event)
+            return
+        self.writer.after_commit(lambda: self._enqueue(event))
+
+    def _enqueue(self, event: tuple) -> None:
+        # 运行在写线程上，绝不能阻塞
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            with self._lock:
+                self._dropped += 1
+            logger.warning(f"Audit queue full, dropped event: {event[4]} {event[5]} {event[6]}")
+            return
+        with self._lock:
+            self._enqueued += 1
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            event = self._queue.get()
+            if event is _STOP:
+                break
+            batch = [event]
+            deadline = time.monotonic() + self.flush_ms / 1000
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    event = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if event is _STOP:
+                    stopping = True
+                    break
+                batch.append(event)
+            self._write(batch)
+
+    def _write(self, batch: list[tuple]) -> None:
+        try:
+            self.writer.submit(_insert_batch, batch).result()
+        except Exception as e:
+            logger.error(f"Failed to write {len(batch)} audit event(s): {e}")
+            with self._lock:
+                self._dropped += len(batch)
+            return
+        with self._lock:
+            self._written += len(batch)
+            self._batches += 1
+
+    def stop(self) -> None:
+        """
+        Flush every queued event and stop the background thread
+        Must run before the single writer is stopped
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        # _STOP 排在所有已入队事件之后，线程写完它们才会退出
+        self._queue.put(_STOP)
+        thread.join()
+        logger.info(f"Audit log flushed: {self._written} event(s) written, {self._dropped} dropped")
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "flush_ms": self.flush_ms,
+                "queue_depth": self._queue.qsize(),
+                "queue_capacity": self._queue.maxsize,
+                "enqueued": self._enqueued,
+                "written": self._written,
+                "batches": self._batches,
+                "dropped": self._dropped,
+            }
+
+
+audit_logger = AuditLogger(writer, AUDIT_MODE, AUDIT_FLUSH_MS, AUDIT_QUEUE_SIZE, AUDIT_BATCH)
+
+
+def record_action(conn: sqlite3.Connection, actor_role: str, actor_id, action: str,
+                  target_type: str, target_id, message: str) -> None:
+    """
+    Append one audit entry for the caller's write transaction
+    actor_id is None when the route does not know who the librarian/director is;
+    ids are stored as text so book 123 and reader "123" are looked up the same way.
+    The timestamp is taken now, even when the row is written later in batched mode
+    """
+    audit_logger.record(conn, (
+        int(time.time()), actor_role,
+        None if actor_id is None else str(actor_id),
+        action, target_type,
+        None if target_id is None else str(target_id),
+        message,
+    ))
+
+
+def day_start(date: str) -> int:
+    """
+    Unix timestamp of local midnight at the start of a 'YYYY-MM-DD' date
+    Raises ValueError for anything else
+    """
+    return int(datetime.strptime(date[:10], "%Y-%m-%d").timestamp())
+
+
+def day_end(date: str) -> int:
+    """
+    Unix timestamp of local midnight at the end of the date (exclusive bound)
+    """
+    return int((datetime.strptime(date[:10], "%Y-%m-%d") + timedelta(days=1)).timestamp())
+
+
+def format_ts(ts: int) -> str:
+    return datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S")
@@ -0,0 +1,365 @@
+"""
+Bulk catalog import behind /api/import-books
+
+Rows are read one at a time from CSV, JSON or XLSX input, validated, and
+inserted in chunks: every chunk is one executemany inside one write
+transaction, so a large file never sits in memory and a bad row only costs
+its own entry in the error list. book_id is always assigned by the database.
+
+Columns (CSV header / XLSX first row / JSON object keys):
+  book_name, author           required
+  publisher, location         optional text
+  publish_year                optional integer
+  if_available                optional 0 or 1, default 1
+
+Usage: python -m services.catalog_import FILE [--format csv|json|xlsx] [--dry-run] [--db path/to/library.db]
+JSON input is either one array of objects or one object per line.
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import sqlite3
+import logging
+from datetime import date
+from typing import BinaryIO, Callable, Iterator, Optional
+
+from db.migrate import run_migrations
+from db.pool import DB_PATH, open_connection
+from services.audit import record_action
+
+logger = logging.getLogger(__name__)
+
+# 每个写事务插入多少行
+IMPORT_CHUNK = int(os.environ.get("LIBRARY_IMPORT_CHUNK", "1000"))
+
+IMPORT_FORMATS = ("csv", "json", "xlsx")
+# 文件扩展名到导入格式的映射
+FORMAT_EXTENSIONS = {".csv": "csv", ".json": "json", ".jsonl": "json", ".ndjson": "json", ".xlsx": "xlsx"}
+
+INSERT_SQL = """
+    INSERT INTO book (book_name, author, publisher, publish_year, location, if_available)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+_JSON_READ_SIZE = 64 * 1024
+
+
+class ImportFormatError(ValueError):
+    """
+    The input as a whole cannot be read (unknown format, broken JSON, not a workbook)
+    """
+
+
+def detect_format(filename: Optional[str], fmt: Optional[str] = None) -> str:
+    """
+    The explicit format if given, otherwise the one implied by the file extension
+    """
+    if fmt:
+        fmt = fmt.lower()
+        if fmt not in IMPORT_FORMATS:
+            raise ImportFormatError(f"Invalid format '{fmt}'. Must be one of: {', '.join(IMPORT_FORMATS)}")
+        return fmt
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension not in FORMAT_EXTENSIONS:
+        raise ImportFormatError(f"Cannot tell the format of '{filename}', pass one of: {', '.join(IMPORT_FORMATS)}")
+    return FORMAT_EXTENSIONS[extension]
+
+
+def normalize_column(name) -> str:
+    return str(name or "").strip().lower().replace(" ", "_")
+
+
+def _read_csv(file: BinaryIO) -> Iterator[tuple[int, dict]]:
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    reader = csv.reader(text)
+    try:
+        header = [normalize_column(name) for name in next(reader, [])]
+        for values in reader:
+            if not any(value.strip() for value in values):
+                continue
+            # 行号按文件中的行计算，表头为第 1 行
+            yield reader.line_num, dict(zip(header, values))
+    except (csv.Error, UnicodeDecodeError) as e:
+        raise ImportFormatError(f"Invalid CSV: {e}")
+    finally:
+        text.detach()
+
+
+def _read_json(file: BinaryIO) -> Iterator[tuple[int, object]]:
+    """
+    Decode one JSON value at a time, from an array or from one value per line
+    Items are numbered from 1
+    """
+    text = io.TextIOWrapper(file, encoding="utf-8-sig")
+    decoder = json.JSONDecoder()
+    buf, pos, eof = "", 0, False
+    in_array = None
+    number = 0
+
+    def _more():
+        nonlocal buf, pos, eof
+        data = text.read(_JSON_READ_SIZE)
+        if not data:
+            eof = True
+        buf, pos = buf[pos:] + data, 0
+
+    try:
+        while True:
+            while True:
+                while pos < len(buf) and buf[pos] in " \t\r\n" + ("," if in_array is not None else ""):
+                    pos += 1
+                if pos < len(buf) or eof:
+                    break
+                _more()
+            if in_array is None:
+                in_array = pos < len(buf) and buf[pos] == "["
+                if in_array:
+                    pos += 1
+                continue
+            if pos >= len(buf):
+                if in_array:
+                    raise ImportFormatError("Invalid JSON: the array is not closed")
+                return
+            if buf[pos] == "]" and in_array:
+                return
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError as e:
+                if eof:
+                    raise ImportFormatError(f"Invalid JSON after item {number}: {e.msg}")
+                _more()
+                continue
+            # 数字等值可能被读取边界截断，等读到后续内容再确认
+            if end == len(buf) and not eof:
+                _more()
+                continue
+            number += 1
+            yield number, item
+            pos = end
+    except UnicodeDecodeError as e:
+        raise ImportFormatError(f"Invalid JSON: {e}")
+    finally:
+        text.detach()
+
+
+def _read_xlsx(file: BinaryIO) -> Iterator[tuple[int, dict]]:
+    try:
+        import openpyxl
+    except ImportError:
+        raise ImportFormatError("XLSX import needs the openpyxl package")
+
+    try:
+        workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    except Exception as e:
+        raise ImportFormatError(f"Invalid XLSX workbook: {e}")
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [normalize_column(name) for name in next(rows, ())]
+        # 行号与表格中显示的一致，表头为第 1 行
+        for number, values in enumerate(rows, start=2):
+            if all(value is None or str(value).strip() == "" for value in values):
+                continue
+            yield number, dict(zip(header, values))
+    finally:
+        workbook.close()
+
+
+def read_rows(file: BinaryIO, fmt: str) -> Iterator[tuple[int, object]]:
+    """
+    (row number, raw row) pairs from a binary file in the given format
+    """
+    if fmt == "csv":
+        return _read_csv(file)
+    if fmt == "json":
+        return _read_json(file)
+    if fmt == "xlsx":
+        return _read_xlsx(file)
+    raise ImportFormatError(f"Invalid format '{fmt}'. Must be one of: {', '.join(IMPORT_FORMATS)}")
+
+
+def cell_text(row: dict, field: str, required: bool = False) -> Optional[str]:
+    value = row.get(field)
+    value = "" if value is None else str(value).strip()
+    if not value:
+        if required:
+            raise ValueError(f"{field} is required")
+        return None
+    return value
+
+
+def validate_book(row) -> tuple:
+    """
+    One raw row as the INSERT_SQL parameters; raises ValueError with the reason
+    """
+    if not isinstance(row, dict):
+        raise ValueError("row must be an object")
+    row = {normalize_column(key): value for key, value in row.items()}
+
+    publish_year = cell_text(row, "publish_year")
+    if publish_year is not None:
+        try:
+            # XLSX 中的年份可能是 1999.0
+            year = float(publish_year)
+        except ValueError:
+            raise ValueError(f"publish_year must be a year, got '{publish_year}'")
+        # 范围外的值（如 1e20）超出 SQLite INTEGER，会让整块写入失败
+        if not year.is_integer() or not 0 <= year <= date.today().year + 1:
+            raise ValueError(f"publish_year must be a year, got '{publish_year}'")
+        publish_year = int(year)
+
+    if_available = cell_text(row, "if_available")
+    if if_available is None:
+        if_available = 1
+    elif if_available.lower() in ("1", "1.0", "true"):
+        if_available = 1
+    elif if_available.lower() in ("0", "0.0", "false"):
+        if_available = 0
+    else:
+        raise ValueError(f"if_available must be 0 or 1, got '{if_available}'")
+
+    return (
+        cell_text(row, "book_name", required=True),
+        cell_text(row, "author", required=True),
+        cell_text(row, "publisher"),
+        publish_year,
+        cell_text(row, "location"),
+        if_available,
+    )
+
+
+def insert_books(conn: sqlite3.Connection, books: list[tuple], numbers: list[int]) -> tuple[int, int, list[dict]]:
+    """
+    Insert one chunk inside the caller's write transaction: (first book_id, last book_id, rejected rows)
+    book_id is AUTOINCREMENT and the chunk is written by one writer in one
+    transaction, so the ids of a chunk are contiguous
+    """
+    conn.executemany(INSERT_SQL, books)
+    last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+    first_id = last_id - len(books) + 1
+    for book_id in range(first_id, last_id + 1):
+        # 记录审计日志
+        record_action(conn, "librarian", None, "create", "book", book_id, f"librarian imported book {book_id}")
+    return first_id, last_id, []
+
+
+def run_import(rows: Iterator[tuple[int, object]], validate: Callable[[object], tuple],
+               write: Callable[[list[tuple], list[int]], tuple], chunk_size: int = IMPORT_CHUNK,
+               dry_run: bool = False) -> Iterator[dict]:
+    """
+    Validate and write the rows chunk by chunk, yielding one progress event per
+    chunk and a final "done" event with the totals
+    validate(row) returns the row's values or raises ValueError. write(items, row
+    numbers) stores one chunk in its own transaction and returns (first id, last
+    id, rejected rows); a chunk whose write raises is rolled back and all of
+    its rows are rejected. With dry_run nothing is written
+    """
+    totals = {"rows": 0, "valid": 0, "imported": 0, "failed": 0}
+    first_id = last_id = None
+
+    def _flush(items: list[tuple], numbers: list[int], errors: list[dict]) -> dict:
+        nonlocal first_id, last_id
+        totals["valid"] += len(items)
+        if items and not dry_run:
+            try:
+                chunk_first, chunk_last, rejected = write(items, numbers)
+            except Exception as e:
+                # 写入已回滚：整块记为失败，继续处理后面的块
+                logger.error(f"Import chunk of {len(items)} rows failed: {e}")
+                rejected = [{"row": number, "error": "Database error"} for number in numbers]
+            else:
+                if chunk_last is not None:
+                    first_id = chunk_first if first_id is None else first_id
+                    last_id = chunk_last
+            totals["imported"] += len(items) - len(rejected)
+            errors = sorted(errors + rejected, key=lambda error: error["row"])
+        totals["failed"] += len(errors)
+        return {"event": "progress", **totals, "errors": errors}
+
+    items, numbers, errors = [], [], []
+    for number, row in rows:
+        totals["rows"] += 1
+        try:
+            items.append(validate(row))
+            numbers.append(number)
+        except ValueError as e:
+            errors.append({"row": number, "error": str(e)})
+        if len(items) + len(errors) >= chunk_size:
+            yield _flush(items, numbers, errors)
+            items, numbers, errors = [], [], []
+    if items or errors:
+        yield _flush(items, numbers, errors)
+
+    yield {"event": "done", **totals, "dry_run": dry_run, "first_id": first_id, "last_id": last_id}
+
+
+def import_main(argv: list[str], prog: str, description: str, validate: Callable[[object], tuple],
+                job: Callable[[sqlite3.Connection, list[tuple], list[int]], tuple],
+                prepare: Optional[Callable[[list[tuple]], list[tuple]]] = None) -> int:
+    """
+    Command line front end shared by the import modules
+    Each chunk runs job(conn, items, row numbers) in its own transaction on a
+    private connection; prepare(items), if given, runs before the transaction
+    starts. Exits 1 if any row failed
+    """
+    parser = argparse.ArgumentParser(prog=prog, description=description)
+    parser.add_argument("file")
+    parser.add_argument("--format", choices=IMPORT_FORMATS)
+    parser.add_argument("--dry-run", action="store_true", help="validate only, write nothing")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--chunk", type=int, default=IMPORT_CHUNK)
+    args = parser.parse_args(argv)
+
+    try:
+        fmt = detect_format(args.file, args.format)
+    except ImportFormatError as e:
+        print(e)
+        return 2
+
+    if not args.dry_run:
+        # 与服务启动时一样，先确保触发器和 audit_log 表存在
+        run_migrations(args.db)
+    conn = open_connection(args.db)
+    conn.isolation_level = None
+
+    def _write(items: list[tuple], numbers: list[int]) -> tuple:
+        if prepare is not None:
+            # 耗时的准备工作（如密码哈希）不占用写锁
+            items = prepare(items)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = job(conn, items, numbers)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return result
+
+    try:
+        with open(args.file, "rb") as file:
+            for event in run_import(read_rows(file, fmt), validate, _write, args.chunk, args.dry_run):
+                for error in event.get("errors", ()):
+                    print(f"row {error['row']}: {error['error']}")
+                if event["event"] == "progress":
+                    print(f"{event['rows']} rows read, {event['imported']} imported, {event['failed']} failed")
+                else:
+                    print(f"done: {event['rows']} rows, {event['valid']} valid, {event['imported']} imported, "
+                          f"{event['failed']} failed"
+                          + (f", ids {event['first_id']} to {event['last_id']}" if event["imported"] else ""))
+                    return 1 if event["failed"] else 0
+    except (ImportFormatError, OSError) as e:
+        print(e)
+        return 2
+    finally:
+        conn.close()
+
+
+def main(argv: list[str]) -> int:
+    return import_main(argv, "python -m services.catalog_import", "Import books from a CSV, JSON or XLSX file",
+                       validate_book, insert_books)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
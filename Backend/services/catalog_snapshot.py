@@ -0,0 +1,452 @@
+"""
+Compact in-memory snapshot of the book table (LIBRARY_CATALOG_SNAPSHOT=1)
+
+With the flag set, the whole catalog is loaded at startup into a columnar form:
+book_id and publish_year in typed arrays, the text columns as codes into one
+interned string table, if_available as a bitset, plus an inverted index over the
+tokens of book_name, author and publisher. /api/search-books and the availability
+pre-check of /api/borrow-book are answered from it; every write still goes to
+SQLite first and patches the snapshot after its transaction commits, before
+the catalog version is bumped, so a search cached under the new version has
+already seen the patch.
+
+Search mirrors the SQL path: the book_fts tokenizer (unicode61, case and
+diacritics folded), every term as a prefix, bm25 with the same column weights,
+a numeric query matching book_id first, and the same sort keys and cursors.
+A term that the tokenizer splits in two (e.g. at an underscore) is matched as
+two prefix terms rather than as a phrase.
+
+Writes made by another process (the import CLI) are not seen until the next restart.
+
+Benchmark: python -m benchmarks.catalog_snapshot
+"""
+import os
+import re
+import math
+import functools
+import heapq
+import bisect
+import threading
+import unicodedata
+import logging
+from array import array
+from collections import Counter
+from typing import Iterable, Optional
+
+from db.pagination import InvalidPageRequest
+
+logger = logging.getLogger(__name__)
+
+CATALOG_SNAPSHOT = os.environ.get("LIBRARY_CATALOG_SNAPSHOT", "0").lower() in ("1", "true", "yes", "on")
+
+BOOK_COLUMNS = ("book_id", "book_name", "author", "publisher", "publish_year", "location", "if_available")
+
+# 与 bm25(book_fts, 10.0, 5.0, 1.0) 的列权重一致
+COLUMN_WEIGHTS = (10, 5, 1)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# publish_year 为 NULL 时在数组中的占位值
+YEAR_NULL = -2 ** 31
+# 倒排表中每一项为 (位置 << 16) | 加权词频
+FREQ_BITS = 16
+FREQ_MASK = (1 << FREQ_BITS) - 1
+
+TOKEN = re.compile(r"[^\W_]+")
+# 去除变音符号只作用于此码位以下的字符
+DIACRITIC_LIMIT = 0x2000
+FTS_TERM = re.compile(r'"([^"]*)"\*')
+
+
+@functools.lru_cache(maxsize=65536)
+def _fold(ch: str) -> str:
+    # unicode61 只去掉拉丁、希腊、西里尔等字母上的变音符号，不做兼容分解（假名的浊点、罗马数字保持原样）
+    if ord(ch) >= DIACRITIC_LIMIT:
+        return ch
+    # 已分解形式中单独的变音符号直接去掉
+    return "".join(part for part in unicodedata.normalize("NFD", ch) if not unicodedata.combining(part))
+
+
+def tokenize(text: Optional[str]) -> list[str]:
+    """
+    Tokens as book_fts sees them (unicode61 remove_diacritics 2): letters and
+    digits, lower-cased, with diacritics removed from letters below U+2000
+    """
+    if not text:
+        return []
+    text = text.lower()
+    if not text.isascii():
+        text = "".join(map(_fold, text))
+    return TOKEN.findall(text)
+
+
+def fts_prefixes(match: str) -> list[str]:
+    """
+    The prefix tokens of a query built by build_fts_query ('"term"* "term"*')
+    """
+    return [token for term in FTS_TERM.findall(match) for token in tokenize(term)]
+
+
+class SnapshotRow(tuple):
+    """
+    A result row that, like sqlite3.Row, can also be indexed by column name
+    """
+    __slots__ = ()
+    _positions = {name: i for i, name in enumerate(BOOK_COLUMNS + ("score",))}
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self._positions[key]
+        return tuple.__getitem__(self, key)
+
+
+def _get_bit(bits: bytearray, i: int) -> int:
+    return bits[i >> 3] >> (i & 7) & 1
+
+
+def _set_bit(bits: bytearray, i: int, value) -> None:
+    if i >> 3 >= len(bits):
+        bits.extend(bytes((i >> 3) - len(bits) + 1))
+    if value:
+        bits[i >> 3] |= 1 << (i & 7)
+    else:
+        bits[i >> 3] &= ~(1 << (i & 7)) & 0xFF
+
+
+class CatalogSnapshot:
+    """
+    Rows are addressed by position; positions follow book_id order because
+    book_id is AUTOINCREMENT, so a new book is always appended. Deleted books
+    keep their position with the `alive` bit cleared. Strings are interned and
+    never released, so a long-running process with many edits holds a few
+    stale strings until the next restart.
+    """
+
+    def __init__(self, enabled: bool = CATALOG_SNAPSHOT):
+        self.enabled = enabled
+        self.loaded = False
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.ids = array("q")
+        self.names = array("I")
+        self.authors = array("I")
+        self.publishers = array("I")
+        self.locations = array("I")
+        self.years = array("i")
+        self.lengths = array("H")
+        self.available = bytearray()
+        self.alive = bytearray()
+        # 非整数的 publish_year（旧数据中的文本）单独保存
+        self.odd_years: dict[int, object] = {}
+        self.strings: list[Optional[str]] = [None]
+        self._codes: dict[Optional[str], int] = {None: 0}
+        self.postings: dict[str, array] = {}
+        self.vocabulary: list[str] = []
+        self.live_count = 0
+        self.token_total = 0
+        self._name_order: Optional[array] = None
+
+    # ---- 加载与写入 ----
+
+    def _intern(self, value) -> int:
+        if value is not None and not isinstance(value, str):
+            value = str(value)
+        code = self._codes.get(value)
+        if code is None:
+            code = len(self.strings)
+            self.strings.append(value)
+            self._codes[value] = code
+        return code
+
+    def _token_freqs(self, pos: int) -> tuple[Counter, int]:
+        """
+        Weighted frequency of every token of one book, and its total token count
+        """
+        freqs = Counter()
+        length = 0
+        for weight, column in zip(COLUMN_WEIGHTS, (self.names, self.authors, self.publishers)):
+            tokens = tokenize(self.strings[column[pos]])
+            length += len(tokens)
+            for token in tokens:
+                freqs[token] += weight
+        return freqs, length
+
+    def _index(self, pos: int, bulk: bool = False) -> None:
+        freqs, length = self._token_freqs(pos)
+        self.lengths[pos] = min(length, FREQ_MASK)
+        self.token_total += self.lengths[pos]
+        for token, freq in freqs.items():
+            entry = pos << FREQ_BITS | min(freq, FREQ_MASK)
+            postings = self.postings.get(token)
+            if postings is None:
+                postings = self.postings[token] = array("Q")
+                if not bulk:
+                    bisect.insort(self.vocabulary, token)
+            if not postings or postings[-1] < entry:
+                postings.append(entry)
+            else:
+                bisect.insort(postings, entry)
+
+    def _unindex(self, pos: int) -> None:
+        self.token_total -= self.lengths[pos]
+        for token in self._token_freqs(pos)[0]:
+            postings = self.postings.get(token)
+            if postings is None:
+                continue
+            i = bisect.bisect_left(postings, pos << FREQ_BITS)
+            if i < len(postings) and postings[i] >> FREQ_BITS == pos:
+                del postings[i]
+            if not postings:
+                del self.postings[token]
+                i = bisect.bisect_left(self.vocabulary, token)
+                if i < len(self.vocabulary) and self.vocabulary[i] == token:
+                    del self.vocabulary[i]
+
+    def _name_key(self, pos: int) -> tuple:
+        return self.strings[self.names[pos]], self.ids[pos]
+
+    def _set_values(self, pos: int, row) -> None:
+        _, book_name, author, publisher, publish_year, location, if_available = row
+        self.names[pos] = self._intern(book_name)
+        self.authors[pos] = self._intern(author)
+        self.publishers[pos] = self._intern(publisher)
+        self.locations[pos] = self._intern(location)
+        self.odd_years.pop(pos, None)
+        if publish_year is None:
+            self.years[pos] = YEAR_NULL
+        elif isinstance(publish_year, int) and YEAR_NULL < publish_year < 2 ** 31:
+            self.years[pos] = publish_year
+        else:
+            self.years[pos] = YEAR_NULL
+            self.odd_years[pos] = publish_year
+        _set_bit(self.available, pos, if_available == 1)
+
+    def _append(self, row, bulk: bool = False) -> None:
+        pos = len(self.ids)
+        self.ids.append(row[0])
+        for column in (self.names, self.authors, self.publishers, self.locations):
+            column.append(0)
+        self.years.append(YEAR_NULL)
+        self.lengths.append(0)
+        self._set_values(pos, row)
+        _set_bit(self.alive, pos, 1)
+        self.live_count += 1
+        self._index(pos, bulk)
+        if self._name_order is not None:
+            bisect.insort(self._name_order, pos, key=self._name_key)
+
+    def _position(self, book_id: int) -> Optional[int]:
+        i = bisect.bisect_left(self.ids, book_id)
+        if i < len(self.ids) and self.ids[i] == book_id and _get_bit(self.alive, i):
+            return i
+        return None
+
+    def load(self, conn) -> None:
+        """
+        Replace the snapshot with the current book table (called once at startup)
+        """
+        rows = conn.execute(f"SELECT {', '.join(BOOK_COLUMNS)} FROM book ORDER BY book_id")
+        with self._lock:
+            self._reset()
+            for row in rows:
+                self._append(tuple(row), bulk=True)
+            self.vocabulary = sorted(self.postings)
+            self.loaded = True
+        logger.info(f"Catalog snapshot loaded: {self.live_count} books, {len(self.vocabulary)} tokens, "
+                    f"{len(self.strings)} distinct strings")
+
+    def upsert(self, row) -> None:
+        """
+        Apply a committed insert or update of one book (row in BOOK_COLUMNS order)
+        """
+        if not self.loaded:
+            return
+        row = tuple(row)
+        with self._lock:
+            pos = self._position(row[0])
+            if pos is None:
+                if self.ids and row[0] <= self.ids[-1]:
+                    # book_id 为 AUTOINCREMENT，不应出现比已有编号更小的新书
+                    logger.error(f"Catalog snapshot: book {row[0]} is older than the newest book, not added")
+                    return
+                self._append(row)
+                return
+            old_name = self.strings[self.names[pos]]
+            if self._name_order is not None and old_name != row[1]:
+                i = bisect.bisect_left(self._name_order, self._name_key(pos), key=self._name_key)
+                if i < len(self._name_order) and self._name_order[i] == pos:
+                    del self._name_order[i]
+                else:
+                    self._name_order = None
+            self._unindex(pos)
+            self._set_values(pos, row)
+            self._index(pos)
+            if self._name_order is not None and old_name != row[1]:
+                bisect.insort(self._name_order, pos, key=self._name_key)
+
+    def upsert_many(self, rows: Iterable) -> None:
+        with self._lock:
+            for row in rows:
+                self.upsert(row)
+
+    def remove(self, book_id: int) -> None:
+        if not self.loaded:
+            return
+        with self._lock:
+            pos = self._position(book_id)
+            if pos is None:
+                return
+            self._unindex(pos)
+            _set_bit(self.alive, pos, 0)
+            self.live_count -= 1
+
+    def set_available(self, book_ids: Iterable[int], available: bool) -> None:
+        if not self.loaded:
+            return
+        with self._lock:
+            for book_id in book_ids:
+                pos = self._position(book_id)
+                if pos is not None:
+                    _set_bit(self.available, pos, available)
+
+    # ---- 查询 ----
+
+    def availability(self, book_id: int) -> Optional[bool]:
+        """
+        True / False for a known book, None if there is no such book
+        """
+        with self._lock:
+            pos = self._position(book_id)
+            return None if pos is None else bool(_get_bit(self.available, pos))
+
+    def _row(self, pos: int, *score) -> SnapshotRow:
+        year = self.years[pos]
+        if year == YEAR_NULL:
+            year = self.odd_years.get(pos)
+        strings = self.strings
+        return SnapshotRow((
+            self.ids[pos], strings[self.names[pos]], strings[self.authors[pos]], strings[self.publishers[pos]],
+            year, strings[self.locations[pos]], _get_bit(self.available, pos), *score,
+        ))
+
+    def _prefix_hits(self, prefix: str) -> dict[int, int]:
+        """
+        Weighted frequency of the prefix in every book that contains it
+        """
+        start = bisect.bisect_left(self.vocabulary, prefix)
+        end = bisect.bisect_left(self.vocabulary, prefix + "\U0010ffff", start)
+        if end - start == 1:
+            # 只展开成一个词时直接由倒排表构造
+            return {entry >> FREQ_BITS: entry & FREQ_MASK for entry in self.postings[self.vocabulary[start]]}
+        hits: dict[int, int] = {}
+        get = hits.get
+        for token in self.vocabulary[start:end]:
+            for entry in self.postings[token]:
+                pos = entry >> FREQ_BITS
+                hits[pos] = get(pos, 0) + (entry & FREQ_MASK)
+        return hits
+
+    def _name_order_array(self) -> array:
+        if self._name_order is None:
+            order = [pos for pos in range(len(self.ids)) if _get_bit(self.alive, pos)]
+            order.sort(key=self._name_key)
+            self._name_order = array("I", order)
+        return self._name_order
+
+    def _page(self, entries, after: Optional[list], count: int) -> list:
+        if after is not None:
+            seek = tuple(after)
+            entries = (entry for entry in entries if entry[0] > seek)
+        return heapq.nsmallest(count, entries)
+
+    def _browse(self, sort: str, after: Optional[list], limit: int, include_total: bool) -> tuple[list, Optional[int]]:
+        positions = []
+        if sort == "book_id":
+            start = bisect.bisect_right(self.ids, after[0]) if after is not None else 0
+            order = None
+        else:
+            order = self._name_order_array()
+            start = bisect.bisect_right(order, tuple(after), key=self._name_key) if after is not None else 0
+        for i in range(start, len(self.ids) if order is None else len(order)):
+            pos = i if order is None else order[i]
+            if _get_bit(self.alive, pos):
+                positions.append(pos)
+                if len(positions) > limit:
+                    break
+        return [self._row(pos) for pos in positions], (self.live_count if include_total else None)
+
+    def search(self, match: Optional[str], exact_id: Optional[int], sort: str, after: Optional[list],
+               limit: int, include_total: bool) -> tuple[list, Optional[int]]:
+        """
+        Same rows (up to limit + 1) and total as the SQL path of /api/search-books
+        """
+        try:
+            with self._lock:
+                if match is None:
+                    return self._browse(sort, after, limit, include_total)
+
+                phrases = [self._prefix_hits(prefix) for prefix in fts_prefixes(match)]
+                if phrases:
+                    smallest = min(phrases, key=len)
+                    candidates = [pos for pos in smallest if all(pos in hits for hits in phrases)]
+                else:
+                    candidates = []
+                exact_pos = self._position(exact_id) if exact_id is not None else None
+                if exact_pos is not None:
+                    candidates = [pos for pos in candidates if pos != exact_pos]
+                total = len(candidates) + (exact_pos is not None) if include_total else None
+
+                if sort == "relevance":
+                    rows = []
+                    if after is None and exact_pos is not None:
+                        rows.append(self._row(exact_pos, None))
+                    # 与 FTS5 的 bm25() 相同：idf 按包含该词的图书数计算，文档长度为三列词数之和
+                    books = self.live_count
+                    avgdl = self.token_total / books if books else 1.0
+                    idfs = [max(math.log((books - len(hits) + 0.5) / (len(hits) + 0.5)), 1e-6) for hits in phrases]
+                    lengths = self.lengths
+
+                    def _score(pos: int) -> float:
+                        norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[pos] / avgdl)
+                        score = 0.0
+                        for idf, hits in zip(idfs, phrases):
+                            freq = hits[pos]
+                            # 运算顺序与 FTS5 的实现一致，分数逐位相同，分页游标才能通用
+                            score += idf * ((freq * (BM25_K1 + 1.0)) / (freq + norm))
+                        return -score
+
+                    entries = (((_score(pos), self.ids[pos]), pos) for pos in candidates)
+                    # 第一页最后一行是按编号精确命中的图书时（分数为 NULL），从头开始
+                    seek = after if after is not None and after[0] is not None else None
+                    page = self._page(entries, seek, limit + 1 - len(rows))
+                    rows += [self._row(pos, key[0]) for key, pos in page]
+                    return rows, total
+
+                if exact_pos is not None:
+                    candidates.append(exact_pos)
+                if sort == "book_id":
+                    entries = (((self.ids[pos],), pos) for pos in candidates)
+                else:
+                    entries = ((self._name_key(pos), pos) for pos in candidates)
+                page = self._page(entries, after, limit + 1)
+                return [self._row(pos) for _, pos in page], total
+        except TypeError:
+            # 游标中的值类型与排序列不符
+            raise InvalidPageRequest("Invalid cursor")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "loaded": self.loaded,
+                "books": self.live_count,
+                "positions": len(self.ids),
+                "tokens": len(self.vocabulary),
+                "postings": sum(len(postings) for postings in self.postings.values()),
+                "strings": len(self.strings),
+            }
+
+
+catalog_snapshot = CatalogSnapshot()
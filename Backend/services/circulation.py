@@ -0,0 +1,137 @@
+"""
+Daily circulation summary behind /api/view-report
+
+daily_circulation holds one row per calendar day: loans borrowed and returned
+on that day, and currently outstanding loans due on that day. Triggers on
+borrow_record (migration 0006) keep it current inside every write transaction,
+so the report counts are a handful of primary-key reads instead of scans of
+borrow_record. The outstanding total is kept in the single circulation_totals
+row (migration 0012), maintained by triggers on daily_circulation.
+
+Usage: python -m services.circulation [check|rebuild] [path/to/library.db]
+  check    recompute the summary from borrow_record and list the days (and the
+           outstanding total) that differ
+  rebuild  replace the summary with the recomputed one
+"""
+import sys
+import sqlite3
+import logging
+
+from db.pool import DB_PATH, open_connection
+
+logger = logging.getLogger(__name__)
+
+# 由 borrow_record 重新计算的每日汇总（与迁移 0006 的初始数据一致）
+SUMMARY_SQL = """
+    SELECT day, SUM(borrowed) AS borrowed, SUM(returned) AS returned, SUM(due) AS due
+    FROM (
+        SELECT DATE(borrow_date) AS day, 1 AS borrowed, 0 AS returned, 0 AS due
+        FROM borrow_record
+        UNION ALL
+        SELECT DATE(return_date), 0, 1, 0
+        FROM borrow_record WHERE return_date IS NOT NULL AND return_date != ''
+        UNION ALL
+        SELECT DATE(due_date), 0, 0, 1
+        FROM borrow_record WHERE return_date IS NULL OR return_date = ''
+    )
+    WHERE day IS NOT NULL
+    GROUP BY day
+"""
+
+
+def report_counts(conn: sqlite3.Connection, date: str) -> dict:
+    """
+    The four /api/view-report counts for the given day
+    Outstanding loans are read from the running total; overdue loans are the
+    outstanding ones minus those due on or after the day, a range that only
+    spans the loan period for the current day
+    """
+    outstanding, borrowed, not_due, returned = conn.execute("""
+        SELECT
+            (SELECT outstanding FROM circulation_totals WHERE id = 1),
+            COALESCE((SELECT borrowed FROM daily_circulation WHERE day = DATE(?)), 0),
+            (SELECT COALESCE(SUM(due), 0) FROM daily_circulation WHERE day >= DATE(?)),
+            COALESCE((SELECT returned FROM daily_circulation WHERE day = DATE(?)), 0)
+    """, (date, date, date)).fetchone()
+    overdue = outstanding - not_due
+    return {
+        "books didn't return until today": outstanding,
+        "books borrowed today": borrowed,
+        "overdue_books": overdue,
+        "books returned today": returned,
+    }
+
+
+def check(conn: sqlite3.Connection) -> list[tuple]:
+    """
+    Days whose stored counts differ from borrow_record: (day, stored, expected)
+    Days that only hold zeros count as missing rows; a wrong outstanding total
+    is reported as day "total"
+    """
+    expected = {row[0]: tuple(row[1:]) for row in conn.execute(SUMMARY_SQL)}
+    stored = {
+        row[0]: tuple(row[1:])
+        for row in conn.execute("SELECT day, borrowed, returned, due FROM daily_circulation")
+        if any(row[1:])
+    }
+    mismatches = [
+        (day, stored.get(day), expected.get(day))
+        for day in sorted(expected.keys() | stored.keys())
+        if stored.get(day) != expected.get(day)
+    ]
+    total = conn.execute("SELECT outstanding FROM circulation_totals WHERE id = 1").fetchone()
+    expected_total = sum(counts[2] for counts in expected.values())
+    if total is None or total[0] != expected_total:
+        mismatches.append(("total", total and (total[0],), (expected_total,)))
+    return mismatches
+
+
+def rebuild(conn: sqlite3.Connection) -> int:
+    """
+    Replace the summary with one recomputed from borrow_record, in one transaction
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DELETE FROM daily_circulation")
+        conn.execute(f"INSERT INTO daily_circulation (day, borrowed, returned, due) {SUMMARY_SQL}")
+        # 触发器已随删除和插入调整累计值；这里再按汇总重写一次，修复此前已经偏离的值
+        conn.execute("""
+            INSERT INTO circulation_totals (id, outstanding)
+            SELECT 1, COALESCE(SUM(due), 0) FROM daily_circulation
+            ON CONFLICT (id) DO UPDATE SET outstanding = excluded.outstanding
+        """)
+        days = conn.execute("SELECT COUNT(*) FROM daily_circulation").fetchone()[0]
+        conn.execute("COMMIT")
+    except sqlite3.Error:
+        conn.execute("ROLLBACK")
+        raise
+    return days
+
+
+def main(argv: list[str]) -> int:
+    command = argv[0] if argv else "check"
+    if command not in ("check", "rebuild"):
+        print(__doc__)
+        return 2
+
+    conn = open_connection(argv[1] if len(argv) > 1 else DB_PATH)
+    conn.isolation_level = None
+    try:
+        if command == "rebuild":
+            days = rebuild(conn)
+            print(f"daily_circulation rebuilt: {days} day(s)")
+
+        mismatches = check(conn)
+        for day, stored, expected in mismatches:
+            if day == "total":
+                print(f"circulation_totals: stored outstanding = {stored}, expected {expected}")
+            else:
+                print(f"{day}: stored (borrowed, returned, due) = {stored}, expected {expected}")
+        print(f"{len(mismatches)} day(s) differ from borrow_record")
+        return 1 if mismatches else 0
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
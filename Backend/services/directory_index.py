@@ -0,0 +1,369 @@
+import os
+import bisect
+import heapq
+import sqlite3
+import threading
+import logging
+from itertools import chain, islice
+from typing import Iterable, Iterator, Optional, Sequence
+
+from db.pagination import InvalidPageRequest
+
+logger = logging.getLogger(__name__)
+
+# 前缀匹配至少需要的字符数；更短的查询只做精确匹配
+MIN_PREFIX = int(os.environ.get("LIBRARY_DIRECTORY_MIN_PREFIX", "2"))
+# 一个前缀展开后的匹配记录不超过这么多时，直接取出排序；更多时按排序数组顺序过滤
+SPARSE_PREFIX = int(os.environ.get("LIBRARY_DIRECTORY_SPARSE_PREFIX", "1000"))
+# 匹配记录超过这么多的词，按每种排序缓存一份有序数组
+SMALL_POSTINGS = 64
+# 缓存多少个查询词的匹配总数；写入时按记录增减，不整体失效
+TOTALS_CACHE_SIZE = 256
+
+
+class DirectoryIndex:
+    """
+    In-process lookup index over one directory table (readers or librarians)
+    Each indexed term (lower-cased value, plus each word of multi-word values
+    such as names) maps to the set of record keys that contain it; the distinct
+    terms are kept sorted for prefix lookup. Every sort order has one array of
+    (sort value, key) over all records, and terms with many records also keep
+    their matches presorted per sort order, so a page is produced by lazily
+    merging presorted streams and stops after limit + 1 rows.
+    """
+
+    def __init__(self, columns: Sequence[str], key: str, order_by: str, indexed: Sequence[str],
+                 sortable: Sequence[str] = ()):
+        self.columns = tuple(columns)
+        self.sortable = tuple(sortable)
+        self.order_by = order_by
+        self._key_pos = self.columns.index(key)
+        self._indexed_pos = [self.columns.index(column) for column in indexed]
+        self._sort_pos = {column: self.columns.index(column)
+                          for column in dict.fromkeys((order_by, *self.sortable))}
+        self._records: dict[str, tuple] = {}
+        self._record_terms: dict[str, tuple] = {}
+        self._exact: dict[str, set] = {}
+        self._terms_sorted: list[str] = []
+        self._order: dict[str, list] = {column: [] for column in self._sort_pos}
+        self._postings: dict[tuple[str, str], list] = {}
+        self._totals: dict[str, int] = {}
+        self._lock = threading.RLock()
+
+    def _terms(self, record: tuple) -> set[str]:
+        terms = set()
+        for pos in self._indexed_pos:
+            value = record[pos]
+            if value is None:
+                continue
+            value = str(value).strip().lower()
+            if not value:
+                continue
+            terms.add(value)
+            terms.update(value.split())
+        return terms
+
+    def _entry(self, record: tuple, column: str) -> tuple:
+        """
+        Sort key of a record in one sort order: (value, record key)
+        """
+        return record[self._sort_pos[column]] or "", record[self._key_pos]
+
+    @staticmethod
+    def _matches_term(terms: tuple, term: str) -> bool:
+        if len(term) < MIN_PREFIX:
+            return term in terms
+        return any(word.startswith(term) for word in terms)
+
+    def _count(self, terms: tuple, delta: int) -> None:
+        # 缓存的总数随记录的增删调整
+        for term in self._totals:
+            if self._matches_term(terms, term):
+                self._totals[term] += delta
+
+    @staticmethod
+    def _discard(entries: list, item) -> None:
+        pos = bisect.bisect_left(entries, item)
+        if pos < len(entries) and entries[pos] == item:
+            del entries[pos]
+
+    def _add(self, record: tuple) -> None:
+        key = record[self._key_pos]
+        terms = tuple(self._terms(record))
+        self._records[key] = record
+        self._record_terms[key] = terms
+        for column, entries in self._order.items():
+            bisect.insort(entries, self._entry(record, column))
+        for term in terms:
+            keys = self._exact.get(term)
+            if keys is None:
+                keys = self._exact[term] = set()
+                bisect.insort(self._terms_sorted, term)
+            keys.add(key)
+            for column in self._order:
+                cached = self._postings.get((term, column))
+                if cached is not None:
+                    bisect.insort(cached, self._entry(record, column))
+        self._count(terms, 1)
+
+    def _remove(self, key: str) -> None:
+        record = self._records.pop(key, None)
+        if record is None:
+            return
+        terms = self._record_terms.pop(key)
+        self._count(terms, -1)
+        for column, entries in self._order.items():
+            self._discard(entries, self._entry(record, column))
+        for term in terms:
+            keys = self._exact[term]
+            keys.discard(key)
+            if not keys:
+                del self._exact[term]
+                self._discard(self._terms_sorted, term)
+            for column in self._order:
+                cached = self._postings.get((term, column))
+                if cached is not None:
+                    if keys:
+                        self._discard(cached, self._entry(record, column))
+                    else:
+                        del self._postings[(term, column)]
+
+    def load(self, rows) -> None:
+        """
+        Replace the whole index with the given rows (in `columns` order)
+        """
+        records, record_terms, exact = {}, {}, {}
+        for row in rows:
+            record = tuple(row)
+            key = record[self._key_pos]
+            records[key] = record
+            record_terms[key] = terms = tuple(self._terms(record))
+            for term in terms:
+                exact.setdefault(term, set()).add(key)
+        order = {column: sorted(self._entry(record, column) for record in records.values())
+                 for column in self._sort_pos}
+        with self._lock:
+            self._records, self._record_terms, self._exact = records, record_terms, exact
+            self._terms_sorted = sorted(exact)
+            self._order = order
+            self._postings = {}
+            self._totals = {}
+
+    def upsert(self, row) -> None:
+        record = tuple(row)
+        with self._lock:
+            self._remove(record[self._key_pos])
+            self._add(record)
+
+    def upsert_many(self, rows) -> None:
+        """
+        Upsert a batch of rows with one sort of each sorted array instead of one
+        insort per record and term (used by bulk enrollment)
+        """
+        records = [tuple(row) for row in rows]
+        with self._lock:
+            for record in records:
+                self._remove(record[self._key_pos])
+            new_terms = []
+            for record in records:
+                key = record[self._key_pos]
+                self._records[key] = record
+                self._record_terms[key] = terms = tuple(self._terms(record))
+                self._count(terms, 1)
+                for column, entries in self._order.items():
+                    entries.append(self._entry(record, column))
+                for term in terms:
+                    keys = self._exact.get(term)
+                    if keys is None:
+                        keys = self._exact[term] = set()
+                        new_terms.append(term)
+                    keys.add(key)
+                    # 受影响的词的有序数组下次用到时重建
+                    for column in self._order:
+                        self._postings.pop((term, column), None)
+            for entries in self._order.values():
+                entries.sort()
+            self._terms_sorted.extend(new_terms)
+            self._terms_sorted.sort()
+
+    def remove(self, key: str) -> None:
+        with self._lock:
+            self._remove(key)
+
+    def get(self, key: str) -> Optional[dict]:
+        record = self._records.get(key)
+        return dict(zip(self.columns, record)) if record else None
+
+    def _sorted_postings(self, term: str, column: str) -> list:
+        """
+        (sort value, key) of every record containing the term, in sort order
+        """
+        keys = self._exact.get(term)
+        if not keys:
+            return []
+        if len(keys) <= SMALL_POSTINGS:
+            return sorted(self._entry(self._records[key], column) for key in keys)
+        cached = self._postings.get((term, column))
+        if cached is None:
+            cached = self._postings[(term, column)] = sorted(
+                self._entry(self._records[key], column) for key in keys)
+        return cached
+
+    def _prefix_terms(self, term: str, budget: Optional[int]) -> Optional[list[str]]:
+        """
+        The indexed terms that start with `term` (other than `term` itself), or
+        None when their records exceed `budget`
+        """
+        if len(term) < MIN_PREFIX:
+            return []
+        terms, size = [], 0
+        pos = bisect.bisect_right(self._terms_sorted, term)
+        while pos < len(self._terms_sorted) and self._terms_sorted[pos].startswith(term):
+            prefixed = self._terms_sorted[pos]
+            size += len(self._exact[prefixed])
+            if budget is not None and size > budget:
+                return None
+            terms.append(prefixed)
+            pos += 1
+        return terms
+
+    @staticmethod
+    def _seek(entries: list, after: Optional[tuple]) -> Iterator[tuple]:
+        """
+        The entries of a sorted list that come after the cursor key
+        """
+        start = bisect.bisect_right(entries, after) if after is not None else 0
+        return (entries[pos] for pos in range(start, len(entries)))
+
+    def _prefix_entries(self, term: str, column: str, exclude, after: Optional[tuple]) -> Iterator[tuple]:
+        """
+        Sort keys of the records with a term that starts with `term`, except the
+        keys in `exclude`, in sort order after the cursor key
+        """
+        prefix_terms = self._prefix_terms(term, SPARSE_PREFIX)
+        if prefix_terms is None:
+            # 匹配的记录很多：从游标位置起按排序数组顺序逐条检查，很快就能凑满一页
+            for entry in self._seek(self._order[column], after):
+                key = entry[-1]
+                if key not in exclude and any(word.startswith(term) for word in self._record_terms[key]):
+                    yield entry
+            return
+        keys = set().union(*(self._exact[prefixed] for prefixed in prefix_terms))
+        yield from self._seek(sorted(self._entry(self._records[key], column) for key in keys if key not in exclude),
+                              after)
+
+    def _matches(self, term: str, sort: str, after: Optional[tuple]) -> Iterator[tuple]:
+        """
+        Sort keys of the matching records in page order, starting after the cursor key
+        """
+        column = self.order_by if sort == "relevance" else sort
+        group = 0
+        if sort == "relevance" and after is not None:
+            group, after = after[0], after[1:]
+            if group not in (0, 1):
+                raise InvalidPageRequest("Invalid cursor")
+        if not term:
+            entries = self._seek(self._order[column], after)
+            return ((1, *entry) for entry in entries) if sort == "relevance" else entries
+
+        if sort == "relevance":
+            # 精确匹配在前（组 0），其余前缀匹配在后（组 1）；游标在组 1 时跳过整个组 0
+            exact_keys = self._exact.get(term, ())
+            exact = self._seek(self._sorted_postings(term, column), after) if group == 0 else iter(())
+            prefix = self._prefix_entries(term, column, exact_keys, after if group == 1 else None)
+            return chain(((0, *entry) for entry in exact), ((1, *entry) for entry in prefix))
+        exact = self._seek(self._sorted_postings(term, column), after)
+        return self._unique(heapq.merge(exact, self._prefix_entries(term, column, (), after)))
+
+    @staticmethod
+    def _unique(entries: Iterable[tuple]) -> Iterator[tuple]:
+        # 同一条记录可能同时来自精确匹配和前缀匹配，合并后相邻
+        last = None
+        for entry in entries:
+            if entry != last:
+                yield entry
+            last = entry
+
+    def _total(self, term: str) -> int:
+        if not term:
+            return len(self._records)
+        total = self._totals.get(term)
+        if total is None:
+            # 第一次计算与匹配数成正比，之后由写入增量维护
+            keys = self._exact.get(term, set())
+            prefix_terms = self._prefix_terms(term, None)
+            if prefix_terms:
+                keys = keys.union(*(self._exact[prefixed] for prefixed in prefix_terms))
+            if len(self._totals) >= TOTALS_CACHE_SIZE:
+                self._totals.clear()
+            total = self._totals[term] = len(keys)
+        return total
+
+    def search(self, query: str, sort: str = "relevance", after: Optional[list] = None,
+               limit: Optional[int] = None, include_total: bool = True) -> tuple[list[dict], Optional[list], Optional[int]]:
+        """
+        One page of matches: (records, sort key of the last record if more follow, total matches or None)
+        A term matches records that contain it exactly or, if it has at least
+        MIN_PREFIX characters, as the prefix of an indexed term.
+        sort="relevance" puts exact term matches before prefix matches, each group
+        ordered by `order_by`; any other sort is one of `sortable`. The key is
+        always completed by the record key, so `after` identifies a position and
+        the page starts by seeking to it in the sorted arrays.
+        CPU-bound: call it from a worker thread, not on the event loop.
+        """
+        if sort != "relevance" and sort not in self.sortable:
+            raise InvalidPageRequest(f"Invalid sort '{sort}'. Must be one of: relevance, {', '.join(self.sortable)}")
+        term = query.strip().lower()
+        with self._lock:
+            try:
+                entries = self._matches(term, sort, tuple(after) if after is not None else None)
+                page = list(entries if limit is None else islice(entries, limit + 1))
+            except (TypeError, IndexError):
+                raise InvalidPageRequest("Invalid cursor")
+            more = limit is not None and len(page) > limit
+            if more:
+                page = page[:limit]
+            records = [self._records[entry[-1]] for entry in page]
+            total = self._total(term) if include_total else None
+        next_after = list(page[-1]) if more else None
+        return [dict(zip(self.columns, record)) for record in records], next_after, total
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+
+READER_COLUMNS = ("reader_id", "student_id", "name", "email", "phone", "department", "major")
+LIBRARIAN_COLUMNS = ("admin_id", "name", "email", "phone", "department")
+
+# 读者按 student_id 定位，结果按 reader_id 排序（与原 SQL 一致）
+reader_directory = DirectoryIndex(
+    READER_COLUMNS, key="student_id", order_by="reader_id",
+    indexed=("student_id", "phone", "email", "name", "department", "major"),
+    sortable=("reader_id", "student_id", "name"),
+)
+librarian_directory = DirectoryIndex(
+    LIBRARIAN_COLUMNS, key="admin_id", order_by="admin_id",
+    indexed=("admin_id", "phone", "email", "name"),
+    sortable=("admin_id", "name"),
+)
+
+
+def fetch_reader(conn: sqlite3.Connection, student_id: str) -> Optional[tuple]:
+    return conn.execute(
+        f"SELECT {', '.join(READER_COLUMNS)} FROM reader_information WHERE student_id = ?", (student_id,)
+    ).fetchone()
+
+
+def fetch_librarian(conn: sqlite3.Connection, admin_id) -> Optional[tuple]:
+    return conn.execute(
+        f"SELECT {', '.join(LIBRARIAN_COLUMNS)} FROM librarian_information WHERE admin_id = ?", (admin_id,)
+    ).fetchone()
+
+
+def load_directories(conn: sqlite3.Connection) -> None:
+    """
+    Build both directory indexes from the database (called once at startup)
+    """
+    reader_directory.load(conn.execute(f"SELECT {', '.join(READER_COLUMNS)} FROM reader_information"))
+    librarian_directory.load(conn.execute(f"SELECT {', '.join(LIBRARIAN_COLUMNS)} FROM librarian_information"))
+    logger.info(f"Directory index loaded: {len(reader_directory)} readers, {len(librarian_directory)} librarians")
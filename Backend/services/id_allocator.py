@@ -0,0 +1,70 @@
+import os
+import sqlite3
+import threading
+import logging
+
+from db import writer, SingleWriter
+
+logger = logging.getLogger(__name__)
+
+# 每次从 id_sequence 预留多少个编号；服务重启时未用完的号段会被跳过
+ID_BLOCK = int(os.environ.get("LIBRARY_ID_BLOCK", "20"))
+
+READER_SEQUENCE = "reader"
+LIBRARIAN_SEQUENCE = "librarian"
+
+
+def reserve_ids(conn: sqlite3.Connection, name: str, count: int) -> int:
+    """
+    Take `count` consecutive ids from the named sequence inside the caller's
+    write transaction and return the first one
+    """
+    row = conn.execute("""
+        UPDATE id_sequence SET next_value = next_value + ?
+        WHERE name = ?
+        RETURNING next_value - ?
+    """, (count, name, count)).fetchone()
+    if row is None:
+        raise KeyError(f"Unknown id sequence '{name}'")
+    return row[0]
+
+
+def format_reader_id(number: int) -> str:
+    return f"Reader {number}"
+
+
+class IdAllocator:
+    """
+    Hands out ids from id_sequence a block at a time
+    A block is reserved (and committed) with the write job that first needs it;
+    later jobs take ids from memory without touching the table. If the
+    reserving job rolls back, the cached block is dropped so its ids are
+    reserved again from the database, never handed out twice.
+    next_id() must be called from inside a write job on the single writer;
+    bulk callers and command line tools use reserve_ids() directly.
+    """
+
+    def __init__(self, writer: SingleWriter, block_size: int):
+        self.writer = writer
+        self.block_size = block_size
+        self._blocks: dict[str, list[int]] = {}
+        self._lock = threading.Lock()
+
+    def next_id(self, conn: sqlite3.Connection, name: str) -> int:
+        with self._lock:
+            block = self._blocks.get(name)
+            if block is None or block[0] >= block[1]:
+                first = reserve_ids(conn, name, self.block_size)
+                block = self._blocks[name] = [first, first + self.block_size]
+                # 预留号段的事务回滚时，内存中的号段随之作废
+                self.writer.after_rollback(lambda: self.discard(name))
+            value = block[0]
+            block[0] += 1
+            return value
+
+    def discard(self, name: str) -> None:
+        with self._lock:
+            self._blocks.pop(name, None)
+
+
+id_allocator = IdAllocator(writer, ID_BLOCK)
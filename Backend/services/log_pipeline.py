@@ -0,0 +1,289 @@
+"""
+Non-blocking structured logging for the API server
+
+Every logger propagates to one QueueHandler on the root logger, which only
+copies the record into a bounded queue; a QueueListener thread formats the
+records and writes them to stdout, so a request never waits on console I/O.
+When the queue is full, records are dropped and counted instead of blocking.
+
+Records are JSON lines: ts, level, logger, request_id, msg, any `extra=`
+fields and exc (the traceback). RequestContextMiddleware gives every request an
+id (a valid incoming X-Request-ID header, or a new one), keeps it in a
+contextvar while the request runs, returns it as X-Request-ID and logs one
+access line per request on the "access" logger.
+
+Settings (environment):
+  LIBRARY_LOG_LEVEL         root level, then per-logger overrides,
+                            e.g. "INFO,api.books=DEBUG,access=WARNING"
+  LIBRARY_LOG_DEBUG_SAMPLE  fraction of DEBUG records kept, same syntax,
+                            e.g. "0.01,api.books=0.1" (default 1: keep all)
+  LIBRARY_LOG_FORMAT        json (default) or text
+  LIBRARY_LOG_QUEUE_SIZE    records buffered for the writer thread (default 10000)
+"""
+import os
+import re
+import sys
+import copy
+import json
+import time
+import uuid
+import queue
+import random
+import logging
+import contextvars
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+from typing import Callable, Optional
+
+LOG_LEVEL = os.environ.get("LIBRARY_LOG_LEVEL", "INFO")
+LOG_DEBUG_SAMPLE = os.environ.get("LIBRARY_LOG_DEBUG_SAMPLE", "1")
+LOG_FORMAT = os.environ.get("LIBRARY_LOG_FORMAT", "json").lower()
+LOG_QUEUE_SIZE = int(os.environ.get("LIBRARY_LOG_QUEUE_SIZE", "10000"))
+
+# 当前请求的 id；数据库线程池和写线程执行任务时会带上提交方的上下文
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+# 只接受简单的外部请求 id，避免把任意内容写进日志
+_REQUEST_ID = re.compile(r"[A-Za-z0-9._-]{1,64}")
+
+# LogRecord 自带的属性；其余属性来自 extra=，原样输出为 JSON 字段（uvicorn 的彩色消息除外）
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id",
+                                                                         "color_message"}
+
+access_logger = logging.getLogger("access")
+
+
+def parse_overrides(value: str, convert: Callable[[str], object]) -> tuple[object, dict]:
+    """
+    "default,name=value,..." -> (default or None, {logger name: value})
+    """
+    default, overrides = None, {}
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, sep, setting = part.rpartition("=")
+        if sep:
+            overrides[name.strip()] = convert(setting.strip())
+        else:
+            default = convert(setting)
+    return default, overrides
+
+
+def _level(value: str) -> int:
+    level = logging.getLevelName(value.upper())
+    if not isinstance(level, int):
+        raise ValueError(f"Unknown log level '{value}'")
+    return level
+
+
+class ContextFilter(logging.Filter):
+    """
+    Runs in the logging thread before a record is queued: attaches the request
+    id and drops the DEBUG records that fall outside the logger's sample rate
+    """
+
+    def __init__(self, default_rate: float, rates: dict[str, float]):
+        super().__init__()
+        self.default_rate = default_rate
+        self.rates = rates
+        self._resolved: dict[str, float] = {}
+        self.sampled_out = 0
+
+    def rate_for(self, name: str) -> float:
+        rate = self._resolved.get(name)
+        if rate is None:
+            # 按日志器层级取最具体的设置：api.books 的设置也作用于 api.books.search
+            rate, prefix = self.default_rate, name
+            while prefix:
+                if prefix in self.rates:
+                    rate = self.rates[prefix]
+                    break
+                prefix = prefix.rpartition(".")[0]
+            self._resolved[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.INFO:
+            rate = self.rate_for(record.name)
+            if rate < 1.0 and random.random() >= rate:
+                self.sampled_out += 1
+                return False
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id is not None:
+            entry["request_id"] = request_id
+        entry["msg"] = record.getMessage()
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        if not hasattr(record, "request_id"):
+            record.request_id = None
+        return super().format(record)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    QueueHandler that never blocks the caller: a full queue drops the record
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 在调用方线程合并参数并展开异常，避免后台线程看到已变化的对象；
+        # 与默认实现不同，异常文本保留在 exc_text 中，由格式化器单独输出
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    """
+    Installs the queue handler on the root logger and runs the writer thread
+    """
+
+    def __init__(self, level: str, debug_sample: str, fmt: str, queue_size: int):
+        self.level, self.levels = parse_overrides(level, _level)
+        rate, rates = parse_overrides(debug_sample, float)
+        self.filter = ContextFilter(1.0 if rate is None else rate, rates)
+        self.formatter = TextFormatter() if fmt == "text" else JsonFormatter()
+        self.queue: queue.Queue = queue.Queue(queue_size)
+        self.queue_size = queue_size
+        self.handler = DroppingQueueHandler(self.queue)
+        self.handler.addFilter(self.filter)
+        self.output = logging.StreamHandler(sys.stdout)
+        self.output.setFormatter(self.formatter)
+        self._listener: Optional[QueueListener] = None
+
+    def configure(self) -> None:
+        """
+        Route every logger through the queue (replacing basicConfig and uvicorn's own handlers)
+        Records logged before start() wait in the queue
+        """
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(self.handler)
+        root.setLevel(self.level if self.level is not None else logging.INFO)
+        for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+            uvicorn_logger = logging.getLogger(name)
+            uvicorn_logger.handlers.clear()
+            uvicorn_logger.propagate = True
+        for name, level in self.levels.items():
+            logging.getLogger(name).setLevel(level)
+
+    def start(self) -> None:
+        if self._listener is not None:
+            return
+        self._listener = QueueListener(self.queue, self.output)
+        self._listener.start()
+        root = logging.getLogger()
+        if self.output in root.handlers:
+            root.removeHandler(self.output)
+            root.addHandler(self.handler)
+
+    def stop(self) -> None:
+        """
+        Write out what is still queued, then stop the writer thread; records
+        logged afterwards (the rest of the shutdown) are written directly
+        """
+        listener, self._listener = self._listener, None
+        if listener is None:
+            return
+        listener.stop()
+        root = logging.getLogger()
+        if self.handler in root.handlers:
+            root.removeHandler(self.handler)
+            root.addHandler(self.output)
+
+    def metrics(self) -> dict:
+        return {
+            "queued": self.queue.qsize(),
+            "capacity": self.queue_size,
+            "dropped": self.handler.dropped,
+            "sampled_out": self.filter.sampled_out,
+        }
+
+
+log_pipeline = LogPipeline(LOG_LEVEL, LOG_DEBUG_SAMPLE, LOG_FORMAT, LOG_QUEUE_SIZE)
+
+
+class RequestContextMiddleware:
+    """
+    ASGI middleware: request id for the logs and one access line per request
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                candidate = value.decode("latin-1")
+                if _REQUEST_ID.fullmatch(candidate):
+                    request_id = candidate
+                break
+        if request_id is None:
+            request_id = uuid.uuid4().hex[:16]
+
+        token = request_id_var.set(request_id)
+        start = time.perf_counter()
+        status = 500
+
+        async def _send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = [*message.get("headers", ()), (b"x-request-id", request_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            if access_logger.isEnabledFor(logging.INFO):
+                duration_ms = round((time.perf_counter() - start) * 1000, 3)
+                access_logger.info("%s %s %s %.1fms", scope["method"], scope["path"], status, duration_ms,
+                                   extra={"method": scope["method"], "path": scope["path"],
+                                          "status": status, "duration_ms": duration_ms})
+            request_id_var.reset(token)
@@ -0,0 +1,196 @@
+"""
+Request and database metrics behind /metrics (Prometheus text format)
+
+MetricsMiddleware counts every HTTP request by method, route template and
+status, records its latency in a fixed-bucket histogram and gives it a
+QueryStats (db/metrics.py) that collects the statements, rows and SQLite time
+of the database work done for it. Everything lives in process memory; a scrape
+renders the counters together with the gauges the other services already keep
+(audit queue, response caches, catalog snapshot, log queue, roll jobs).
+
+Routes are labelled with their template ("/api/books/{book_id}"), so the number
+of series stays bounded; requests that match no route are labelled "unmatched".
+"""
+import time
+import threading
+from bisect import bisect_left
+from typing import Optional
+
+from db.metrics import QueryStats, query_stats, background_stats
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 延迟直方图的桶上限（秒）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METHODS = frozenset(("GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"))
+
+
+class RouteMetrics:
+    """
+    Counters of one (method, route): requests per status, latency histogram
+    and the database work of those requests
+    """
+    __slots__ = ("statuses", "buckets", "seconds", "count", "db")
+
+    def __init__(self):
+        self.statuses: dict[int, int] = {}
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.seconds = 0.0
+        self.count = 0
+        self.db = QueryStats()
+
+
+class HttpMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.routes: dict[tuple[str, str], RouteMetrics] = {}
+        self.in_progress = 0
+
+    def observe(self, method: str, route: str, status: int, seconds: float, stats: QueryStats) -> None:
+        with self._lock:
+            metrics = self.routes.get((method, route))
+            if metrics is None:
+                metrics = self.routes[(method, route)] = RouteMetrics()
+            metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+            metrics.buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            metrics.seconds += seconds
+            metrics.count += 1
+            metrics.db.add(stats.queries, stats.rows, stats.seconds)
+
+    def snapshot(self) -> list[tuple[str, str, dict, list, float, int, tuple]]:
+        with self._lock:
+            return [
+                (method, route, dict(m.statuses), list(m.buckets), m.seconds, m.count,
+                 (m.db.queries, m.db.rows, m.db.seconds))
+                for (method, route), m in sorted(self.routes.items())
+            ]
+
+
+http_metrics = HttpMetrics()
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: times each request and collects its database work
+    """
+
+    def __init__(self, app):
+        self.app = app
+        # 路由处理函数 -> 路径模板，首次遇到未知处理函数时从 app.routes 重建
+        self._templates: dict = {}
+
+    def route_template(self, scope) -> str:
+        # Starlette 匹配路由后把处理函数写入 scope["endpoint"]
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        template = self._templates.get(endpoint)
+        if template is None:
+            self._templates = {
+                route.endpoint: route.path for route in scope["app"].routes if hasattr(route, "endpoint")
+            }
+            template = self._templates.get(endpoint, "unmatched")
+        return template
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = query_stats.set(stats)
+        start = time.perf_counter()
+        status = 500
+        http_metrics.in_progress += 1
+
+        async def _send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            seconds = time.perf_counter() - start
+            http_metrics.in_progress -= 1
+            query_stats.reset(token)
+            method = scope["method"] if scope["method"] in METHODS else "OTHER"
+            http_metrics.observe(method, self.route_template(scope), status, seconds, stats)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _number(value) -> str:
+    return repr(value) if isinstance(value, float) else str(int(value))
+
+
+def render(components: Optional[dict[str, dict]] = None) -> str:
+    """
+    The request, database and component metrics in Prometheus text format
+    `components` maps a name to a metrics() dict: numbers become gauges named
+    library_<name>_<key>, strings become labels of library_<name>_info
+    """
+    lines = []
+
+    def family(name: str, kind: str, help_text: str) -> None:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    routes = http_metrics.snapshot()
+
+    family("library_http_requests_total", "counter", "HTTP requests by method, route template and status")
+    for method, route, statuses, _, _, _, _ in routes:
+        for status, count in sorted(statuses.items()):
+            lines.append(f"library_http_requests_total{_labels(method=method, route=route, status=status)} {count}")
+
+    family("library_http_request_duration_seconds", "histogram", "HTTP request latency")
+    for method, route, _, buckets, seconds, count, _ in routes:
+        cumulative = 0
+        for bound, bucket in zip((*LATENCY_BUCKETS, "+Inf"), buckets):
+            cumulative += bucket
+            labels = _labels(method=method, route=route, le=bound)
+            lines.append(f"library_http_request_duration_seconds_bucket{labels} {cumulative}")
+        labels = _labels(method=method, route=route)
+        lines.append(f"library_http_request_duration_seconds_sum{labels} {_number(seconds)}")
+        lines.append(f"library_http_request_duration_seconds_count{labels} {count}")
+
+    family("library_http_requests_in_progress", "gauge", "HTTP requests being handled")
+    lines.append(f"library_http_requests_in_progress {http_metrics.in_progress}")
+
+    # 后台任务、启动过程和命令行工具的数据库工作记在 route="background" 下
+    db_rows = [(_labels(method=method, route=route), db) for method, route, _, _, _, _, db in routes]
+    db_rows.append((_labels(route="background"),
+                    (background_stats.queries, background_stats.rows, background_stats.seconds)))
+    for index, (name, help_text) in enumerate((
+        ("library_db_queries_total", "SQL statements executed"),
+        ("library_db_rows_total", "Rows fetched from SQLite"),
+        ("library_db_seconds_total", "Seconds spent executing statements and fetching rows"),
+    )):
+        family(name, "counter", help_text)
+        for labels, db in db_rows:
+            lines.append(f"{name}{labels} {_number(db[index])}")
+
+    for component, values in (components or {}).items():
+        info = {}
+        for key, value in values.items():
+            if isinstance(value, str):
+                info[key] = value
+            elif isinstance(value, (bool, int, float)):
+                name = f"library_{component}_{key}"
+                family(name, "gauge", f"{component} {key}")
+                lines.append(f"{name} {_number(value)}")
+        if info:
+            name = f"library_{component}_info"
+            family(name, "gauge", f"{component} settings")
+            lines.append(f"{name}{_labels(**info)} 1")
+
+    lines.append("")
+    return "\n".join(lines)
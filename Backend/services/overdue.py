@@ -0,0 +1,213 @@
+"""
+Overdue loan set behind /api/overdue
+
+overdue_loan holds the loans that are still out and were due before
+overdue_state.as_of, with their due date, so the list sorted by days overdue is
+a range read over idx_overdue_loan_due. Triggers on borrow_record (migration
+0011) keep it current inside every write transaction: return_book removes the
+loan, renew_book re-checks it against the new due date, delete_book and
+delete_reader drop it.
+
+Loans become overdue when the date changes rather than when anything is
+written, so OverdueTracker advances `as_of` shortly after
+LIBRARY_OVERDUE_ROLL_TIME (local time, default 00:00, "off" to disable when cron
+runs the command below) and once at startup if a day was missed. A roll only
+reads the open loans due between the old and the new `as_of`.
+
+Usage: python -m services.overdue [check|rebuild|roll] [path/to/library.db]
+  check    recompute the set from borrow_record and list the loans that differ
+  rebuild  replace the set with the recomputed one
+  roll     advance `as_of` to today
+"""
+import os
+import sys
+import sqlite3
+import threading
+import logging
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from db import writer
+from db.pool import DB_PATH, open_connection
+
+logger = logging.getLogger(__name__)
+
+# 每天推进逾期集合的时间（本地时间 HH:MM）；off 表示不在服务内运行
+OVERDUE_ROLL_TIME = os.environ.get("LIBRARY_OVERDUE_ROLL_TIME", "00:00")
+
+# 由 borrow_record 重新计算的逾期集合（与迁移 0011 的初始数据一致）
+OVERDUE_SQL = """
+    SELECT record_id, student_id, book_id, due_date
+    FROM borrow_record
+    WHERE (return_date IS NULL OR return_date = '')
+      AND due_date < ?
+"""
+
+# 日期推进时新逾期的借阅：应还日期落在 [旧 as_of, 新 as_of) 之间
+ROLL_SQL = """
+    INSERT OR IGNORE INTO overdue_loan (record_id, student_id, book_id, due_date)
+    SELECT record_id, student_id, book_id, due_date
+    FROM borrow_record
+    WHERE (return_date IS NULL OR return_date = '')
+      AND due_date >= ? AND due_date < ?
+"""
+
+
+def overdue_as_of(conn: sqlite3.Connection) -> str:
+    return conn.execute("SELECT as_of FROM overdue_state WHERE id = 1").fetchone()[0]
+
+
+def roll_overdue(conn: sqlite3.Connection, today: str) -> int:
+    """
+    Advance `as_of` to today: add the open loans that fell due since the last
+    roll. Returns how many loans were added (0 when already current)
+    """
+    as_of = overdue_as_of(conn)
+    if today == as_of:
+        return 0
+    if today < as_of:
+        # 系统时间被调回：应还日期不早于今天的借阅不再算逾期
+        conn.execute("DELETE FROM overdue_loan WHERE due_date >= ?", (today,))
+        added = 0
+    else:
+        added = conn.execute(ROLL_SQL, (as_of, today)).rowcount
+    conn.execute("UPDATE overdue_state SET as_of = ? WHERE id = 1", (today,))
+    return added
+
+
+def check(conn: sqlite3.Connection) -> list[tuple]:
+    """
+    Loans whose stored entry differs from borrow_record as of the stored
+    `as_of`: (record_id, stored, expected)
+    """
+    as_of = overdue_as_of(conn)
+    expected = {row[0]: tuple(row[1:]) for row in conn.execute(OVERDUE_SQL, (as_of,))}
+    stored = {row[0]: tuple(row[1:]) for row in conn.execute(
+        "SELECT record_id, student_id, book_id, due_date FROM overdue_loan"
+    )}
+    return [
+        (record_id, stored.get(record_id), expected.get(record_id))
+        for record_id in sorted(expected.keys() | stored.keys())
+        if stored.get(record_id) != expected.get(record_id)
+    ]
+
+
+def rebuild(conn: sqlite3.Connection, today: str) -> int:
+    """
+    Replace the set with the loans overdue as of today, in one transaction
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("UPDATE overdue_state SET as_of = ? WHERE id = 1", (today,))
+        conn.execute("DELETE FROM overdue_loan")
+        conn.execute(f"INSERT INTO overdue_loan (record_id, student_id, book_id, due_date) {OVERDUE_SQL}", (today,))
+        loans = conn.execute("SELECT COUNT(*) FROM overdue_loan").fetchone()[0]
+        conn.execute("COMMIT")
+    except sqlite3.Error:
+        conn.execute("ROLLBACK")
+        raise
+    return loans
+
+
+def _parse_roll_time(value: str) -> Optional[tuple[int, int]]:
+    if value.lower() in ("", "off", "0", "false", "no"):
+        return None
+    hour, _, minute = value.partition(":")
+    return int(hour), int(minute or 0)
+
+
+class OverdueTracker:
+    """
+    Background thread that rolls the overdue set once at startup and then every
+    day at `roll_time`, through the single writer
+    """
+
+    def __init__(self, writer, roll_time: str):
+        self.writer = writer
+        self.roll_time = _parse_roll_time(roll_time)
+        self._thread = None
+        self._stop = threading.Event()
+        self.last_roll: Optional[str] = None
+        self.loans_added = 0
+
+    def start(self) -> None:
+        if self.roll_time is None or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="overdue-tracker", daemon=True)
+        self._thread.start()
+
+    def _seconds_until_next_roll(self) -> float:
+        now = datetime.now()
+        hour, minute = self.roll_time
+        next_roll = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if next_roll <= now:
+            next_roll += timedelta(days=1)
+        return (next_roll - now).total_seconds()
+
+    def roll(self) -> int:
+        today = date.today().isoformat()
+        added = self.writer.submit(roll_overdue, today).result()
+        self.last_roll = today
+        self.loans_added += added
+        logger.info(f"Overdue loans rolled to {today}: {added} loan(s) became overdue")
+        return added
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.roll()
+            except Exception as e:
+                logger.error(f"Failed to roll overdue loans: {e}")
+            if self._stop.wait(self._seconds_until_next_roll()):
+                break
+
+    def stop(self) -> None:
+        """
+        Must run before the single writer is stopped
+        """
+        thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._stop.set()
+        thread.join()
+
+
+overdue_tracker = OverdueTracker(writer, OVERDUE_ROLL_TIME)
+
+
+def main(argv: list[str]) -> int:
+    command = argv[0] if argv else "check"
+    if command not in ("check", "rebuild", "roll"):
+        print(__doc__)
+        return 2
+
+    conn = open_connection(argv[1] if len(argv) > 1 else DB_PATH)
+    conn.isolation_level = None
+    try:
+        today = date.today().isoformat()
+        if command == "rebuild":
+            loans = rebuild(conn, today)
+            print(f"overdue_loan rebuilt as of {today}: {loans} loan(s)")
+        elif command == "roll":
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                added = roll_overdue(conn, today)
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+            print(f"overdue_loan rolled to {today}: {added} loan(s) became overdue")
+            return 0
+
+        mismatches = check(conn)
+        for record_id, stored, expected in mismatches:
+            print(f"record {record_id}: stored (student_id, book_id, due_date) = {stored}, expected {expected}")
+        print(f"{len(mismatches)} loan(s) differ from borrow_record")
+        return 1 if mismatches else 0
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
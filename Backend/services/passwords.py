@@ -0,0 +1,159 @@
+"""
+Password hashing for login and every route that stores a password
+
+Stored values look like "pbkdf2_sha256$<iterations>$<salt>$<hash>" or
+"scrypt$<n>$<r>$<p>$<salt>$<hash>" (salt and hash in URL-safe base64).
+Anything else is a legacy plaintext password: it still verifies, and
+verify_password() reports that it needs rehashing, so login upgrades it in place.
+Bulk enrollment stores cheap hashes (ENROLL_PBKDF2_ITERATIONS); their
+parameters are weaker than the configured ones, so login upgrades them the same way.
+
+The KDF runs in a process pool (PasswordHasher) so a login never holds the
+event loop or a database thread. hash_password() and verify_password() are
+plain functions so the pool workers can run them.
+"""
+import os
+import hmac
+import base64
+import hashlib
+import asyncio
+import secrets
+import threading
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# pbkdf2_sha256（默认）或 scrypt
+PASSWORD_KDF = os.environ.get("LIBRARY_PASSWORD_KDF", "pbkdf2_sha256")
+PBKDF2_ITERATIONS = int(os.environ.get("LIBRARY_PBKDF2_ITERATIONS", "200000"))
+# 批量录入名单时使用的低成本迭代次数，登录成功后按上面的配置重新哈希
+ENROLL_PBKDF2_ITERATIONS = int(os.environ.get("LIBRARY_ENROLL_PBKDF2_ITERATIONS", "1000"))
+SCRYPT_N = int(os.environ.get("LIBRARY_SCRYPT_N", "16384"))
+SCRYPT_R = 8
+SCRYPT_P = 1
+# 哈希进程数；0 表示在线程中计算（hashlib 计算期间会释放 GIL）
+HASH_WORKERS = int(os.environ.get("LIBRARY_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+KDFS = ("pbkdf2_sha256", "scrypt")
+SALT_BYTES = 16
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _derive(kdf: str, params: tuple[int, ...], password: str, salt: bytes) -> bytes:
+    if kdf == "pbkdf2_sha256":
+        return hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, params[0])
+    n, r, p = params
+    return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p, maxmem=256 * r * n + 1024 * 1024)
+
+
+def _current_params(kdf: str) -> tuple[int, ...]:
+    return (PBKDF2_ITERATIONS,) if kdf == "pbkdf2_sha256" else (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+
+def hash_password(password: str, kdf: Optional[str] = None) -> str:
+    kdf = kdf or PASSWORD_KDF
+    if kdf not in KDFS:
+        raise ValueError(f"Unknown password KDF '{kdf}'. Must be one of: {', '.join(KDFS)}")
+    return _hash(kdf, _current_params(kdf), password)
+
+
+def hash_enrollment_password(password: str) -> str:
+    """
+    Cheap PBKDF2 hash for bulk enrollment; verify_password() flags it for rehashing
+    unless it already matches the configured KDF and parameters
+    """
+    return _hash("pbkdf2_sha256", (min(ENROLL_PBKDF2_ITERATIONS, PBKDF2_ITERATIONS),), password)
+
+
+def _hash(kdf: str, params: tuple[int, ...], password: str) -> str:
+    salt = secrets.token_bytes(SALT_BYTES)
+    digest = _derive(kdf, params, password, salt)
+    return "$".join([kdf, *map(str, params), _b64encode(salt), _b64encode(digest)])
+
+
+def verify_password(password: str, stored: str) -> tuple[bool, bool]:
+    """
+    Check a password against its stored value
+    Returns (matches, needs_rehash); needs_rehash is true for plaintext values
+    and for hashes made with another KDF or weaker parameters than configured now
+    """
+    kdf, _, rest = (stored or "").partition("$")
+    if kdf not in KDFS or not rest:
+        # 旧数据中的明文密码
+        return hmac.compare_digest(password.encode("utf-8"), (stored or "").encode("utf-8")), True
+    try:
+        # 字段数不对（如 "scrypt$x"）同样按哈希损坏处理
+        *params, salt, digest = rest.split("$")
+        params = tuple(int(value) for value in params)
+        matches = hmac.compare_digest(_derive(kdf, params, password, _b64decode(salt)), _b64decode(digest))
+    except (ValueError, TypeError, OverflowError) as e:
+        logger.error(f"Malformed password hash ({kdf}): {e}")
+        return False, False
+    return matches, kdf != PASSWORD_KDF or params != _current_params(kdf)
+
+
+class PasswordHasher:
+    """
+    Runs hash_password()/verify_password() off the event loop
+    With `workers` > 0 they run in a process pool, started by start() (called
+    early in the lifespan, before the database threads exist) or on first use;
+    with 0 they run in the default thread pool.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        if self.workers <= 0:
+            return
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                # 预先启动工作进程，避免第一次登录时才创建
+                self._pool.submit(_current_params, PASSWORD_KDF).result()
+                logger.info(f"Password hasher started with {self.workers} worker process(es), KDF {PASSWORD_KDF}")
+
+    def close(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    async def _call(self, func, *args):
+        loop = asyncio.get_running_loop()
+        if self.workers <= 0:
+            return await loop.run_in_executor(None, func, *args)
+        self.start()
+        return await loop.run_in_executor(self._pool, func, *args)
+
+    async def hash(self, password: str) -> str:
+        return await self._call(hash_password, password)
+
+    async def verify(self, password: str, stored: str) -> tuple[bool, bool]:
+        return await self._call(verify_password, password, stored)
+
+    def hash_many(self, passwords: list[str], func: Callable[[str], str] = hash_password) -> list[str]:
+        """
+        Hash a batch of passwords across the worker processes (bulk enrollment
+        passes hash_enrollment_password)
+        Blocks until all are done: call it from a worker thread, not the event loop
+        """
+        if self.workers <= 0:
+            return [func(password) for password in passwords]
+        self.start()
+        chunksize = max(1, len(passwords) // (self.workers * 4))
+        return list(self._pool.map(func, passwords, chunksize=chunksize))
+
+
+password_hasher = PasswordHasher(HASH_WORKERS)
@@ -0,0 +1,133 @@
+"""
+Bulk reader enrollment behind /api/enroll-readers
+
+A roster (CSV, JSON or XLSX, read with the catalog import readers) is
+validated row by row and enrolled in chunks. Each chunk is one write
+transaction that finds the already registered student_ids with one set-based
+query, reserves a contiguous block of 'Reader N' ids from the reader id
+sequence, and inserts the new readers with one executemany. Passwords are
+stored as cheap PBKDF2 hashes (LIBRARY_ENROLL_PBKDF2_ITERATIONS), computed for
+the whole chunk before the transaction starts, so no plaintext password is
+stored and a large roster still enrolls in seconds; login rehashes each one
+with the configured KDF.
+
+Columns: student_id (9 characters) and password are required; name defaults
+like /api/add-new-reader; email, phone, department and major are optional.
+
+Usage: python -m services.reader_enrollment FILE [--format csv|json|xlsx] [--dry-run] [--db path/to/library.db]
+A CLI import is not seen by the reader search of a running server until it restarts.
+"""
+import json
+import sys
+import sqlite3
+import logging
+from typing import Callable
+
+from services.audit import record_action
+from services.passwords import password_hasher, hash_enrollment_password
+from services.id_allocator import reserve_ids, format_reader_id, READER_SEQUENCE
+from services.catalog_import import normalize_column, cell_text, import_main
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_NAME = "default user name, please edit it"
+
+INSERT_SQL = """
+    INSERT INTO reader_information(reader_id, student_id, name, password, email, phone, department, major)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def reader_validator() -> Callable[[object], tuple]:
+    """
+    A validate(row) function for one roster; it also rejects a student_id that
+    appears earlier in the same roster
+    Values come back as (student_id, name, password, email, phone, department, major)
+    """
+    seen = set()
+
+    def _validate(row) -> tuple:
+        if not isinstance(row, dict):
+            raise ValueError("row must be an object")
+        row = {normalize_column(key): value for key, value in row.items()}
+
+        student_id = cell_text(row, "student_id", required=True)
+        # XLSX 中的学号可能被读成 123456789.0
+        if student_id.endswith(".0") and student_id[:-2].isdigit():
+            student_id = student_id[:-2]
+        if len(student_id) != 9:
+            raise ValueError("ID must be 9 digits")
+        if student_id in seen:
+            raise ValueError(f"student_id {student_id} appears more than once in the roster")
+        password = cell_text(row, "password", required=True)
+        seen.add(student_id)
+
+        return (
+            student_id,
+            cell_text(row, "name") or DEFAULT_NAME,
+            password,
+            cell_text(row, "email"),
+            cell_text(row, "phone"),
+            cell_text(row, "department"),
+            cell_text(row, "major"),
+        )
+
+    return _validate
+
+
+def hash_roster_passwords(readers: list[tuple]) -> list[tuple]:
+    """
+    The validated rows with each plaintext password replaced by its enrollment hash
+    Blocking: call it from a worker thread, outside the write transaction
+    """
+    hashed = password_hasher.hash_many([reader[2] for reader in readers], hash_enrollment_password)
+    return [(*reader[:2], password, *reader[3:]) for reader, password in zip(readers, hashed)]
+
+
+def enroll_readers(conn: sqlite3.Connection, readers: list[tuple], numbers: list[int]) -> tuple:
+    """
+    Enroll one chunk inside the caller's write transaction; the passwords must
+    already be hashed (hash_roster_passwords)
+    Returns (first reader_id, last reader_id, rejected rows, directory rows of the new readers)
+    """
+    existing = {row[0] for row in conn.execute(
+        "SELECT student_id FROM reader_information WHERE student_id IN (SELECT value FROM json_each(?))",
+        (json.dumps([reader[0] for reader in readers]),)
+    ).fetchall()}
+    rejected = [
+        {"row": number, "error": "this id already had an account"}
+        for number, reader in zip(numbers, readers) if reader[0] in existing
+    ]
+    new_readers = [reader for reader in readers if reader[0] not in existing]
+    if not new_readers:
+        return None, None, rejected, []
+
+    # 在写事务内预留一段连续的 reader_id
+    start = reserve_ids(conn, READER_SEQUENCE, len(new_readers))
+    reader_ids = [format_reader_id(start + offset) for offset in range(len(new_readers))]
+    conn.executemany(INSERT_SQL, [(reader_id, *reader) for reader_id, reader in zip(reader_ids, new_readers)])
+
+    directory_rows = []
+    for reader_id, (student_id, name, _, email, phone, department, major) in zip(reader_ids, new_readers):
+        # 记录审计日志
+        record_action(conn, "librarian", None, "create", "reader", student_id, f"librarian add new reader who has student_id = {student_id}")
+        # 与 READER_COLUMNS 的顺序一致
+        directory_rows.append((reader_id, student_id, name, email, phone, department, major))
+
+    return reader_ids[0], reader_ids[-1], rejected, directory_rows
+
+
+def _enroll_job(conn: sqlite3.Connection, readers: list[tuple], numbers: list[int]) -> tuple:
+    return enroll_readers(conn, readers, numbers)[:3]
+
+
+def main(argv: list[str]) -> int:
+    try:
+        return import_main(argv, "python -m services.reader_enrollment", "Enroll readers from a CSV, JSON or XLSX roster",
+                           reader_validator(), _enroll_job, prepare=hash_roster_passwords)
+    finally:
+        password_hasher.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,316 @@
+"""
+Per-reader reading statistics behind /api/reader-reading-report
+
+reader_reading_stats holds one row per reader: loan totals, the busiest
+checkout day (from reader_checkout_day, one row per reader and day) with up to
+five of that day's titles, and the title with the most days on loan within the
+90 days before `as_of`. Triggers on borrow_record (migration 0009) update the
+counters inside every write transaction, and a trigger on the counters
+recomputes that reader's row, scanning only the loans inside the window. The
+report is then one primary-key read.
+
+Loans still out count up to `as_of`, and the window moves with it, so once a
+day the roll job advances `as_of` for every reader (which refreshes the rows the
+same way); book renames also show up in the report after the next roll.
+ReadingStatsRoller runs it in the server shortly after LIBRARY_STATS_ROLL_TIME
+(local time, default 00:05, "off" to disable when cron runs the command below)
+and once at startup if the last roll was missed.
+
+Usage: python -m services.reading_stats [check|rebuild|roll] [path/to/library.db]
+  check    recompute every reader's report from borrow_record and list the readers that differ
+  rebuild  replace the statistics with ones recomputed from borrow_record
+  roll     advance the 90-day window to today
+"""
+import os
+import sys
+import json
+import sqlite3
+import threading
+import logging
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from db import writer
+from db.pool import DB_PATH, open_connection
+
+logger = logging.getLogger(__name__)
+
+# 每天滚动统计窗口的时间（本地时间 HH:MM）；off 表示不在服务内运行
+STATS_ROLL_TIME = os.environ.get("LIBRARY_STATS_ROLL_TIME", "00:05")
+# 滚动时每个写事务处理的读者数，避免长时间占用写线程
+ROLL_BATCH = 500
+
+ENGAGEMENT_DAYS = 90
+
+REPORT_SQL = """
+    SELECT busiest_day, busiest_books, busiest_titles, favorite_title
+    FROM reader_reading_stats
+    WHERE student_id = ?
+"""
+
+# 与迁移 0009 的初始数据相同；写入计数和 as_of 时由触发器计算其余各列
+REBUILD_SQL = (
+    "DELETE FROM reader_checkout_day",
+    "DELETE FROM reader_reading_stats",
+    """
+    INSERT INTO reader_checkout_day (student_id, day, books)
+    SELECT student_id, DATE(borrow_date), COUNT(*)
+    FROM borrow_record
+    WHERE DATE(borrow_date) IS NOT NULL
+    GROUP BY student_id, DATE(borrow_date)
+    """,
+    "INSERT INTO reader_reading_stats (student_id) SELECT DISTINCT student_id FROM borrow_record",
+    """
+    UPDATE reader_reading_stats
+    SET (total_borrows, open_loans) = (
+            SELECT COUNT(*), COALESCE(SUM(return_date IS NULL OR return_date = ''), 0)
+            FROM borrow_record br WHERE br.student_id = reader_reading_stats.student_id
+        ),
+        as_of = DATE('now', 'localtime')
+    """,
+)
+
+
+def format_month_day(date_obj: Optional[date]) -> str:
+    if not date_obj:
+        return "Someday"
+    month = date_obj.strftime("%B")
+    day = date_obj.day
+    suffix = "th" if 11 <= day <= 13 else {1: "st", 2: "nd", 3: "rd"}.get(day % 10, "th")
+    return f"{month} {day}{suffix}"
+
+
+def _parse_date(date_str: Optional[str]) -> Optional[date]:
+    if not date_str:
+        return None
+    try:
+        return datetime.strptime(date_str, "%Y-%m-%d").date()
+    except ValueError:
+        return None
+
+
+def build_reports(busiest_day: Optional[str], busiest_books: Optional[int], busiest_titles: Optional[str],
+                  favorite_title: Optional[str]) -> list[str]:
+    """
+    The report sentences for one reader_reading_stats row (empty if there is nothing to say)
+    """
+    reports = []
+
+    # 模板一：一次借书最多的一天
+    if busiest_books and busiest_books >= 2:
+        titles = json.loads(busiest_titles or "[]")
+        reports.append(
+            f"On {format_month_day(_parse_date(busiest_day))}, you checked out {busiest_books} books at once — {', '.join(titles)}. Maybe they sparked a few new ideas."
+        )
+
+    # 模板二：近三个月借阅时间最长的书
+    if favorite_title is not None:
+        reports.append(
+            f"Over the past three months, the book you spent the most time with was {favorite_title} — clearly a favorite in your recent reading history."
+        )
+
+    return reports
+
+
+def reading_report(conn: sqlite3.Connection, student_id: str) -> list[str]:
+    row = conn.execute(REPORT_SQL, (student_id,)).fetchone()
+    return build_reports(*row) if row is not None else []
+
+
+def history_reports(history: list[tuple], today: date) -> list[str]:
+    """
+    The same report computed from a reader's whole history, as the endpoint used
+    to: (borrow_date, return_date, book_name) rows, newest borrow first
+    """
+    day_groups = {}
+    for borrow_date, _, book_name in history:
+        date_key = _parse_date(borrow_date)
+        if date_key:
+            day_groups.setdefault(date_key, []).append(book_name)
+
+    busiest_day, busiest_titles = None, []
+    if day_groups:
+        busiest_day, busiest_titles = max(day_groups.items(), key=lambda item: len(item[1]))
+
+    window_start = today - timedelta(days=ENGAGEMENT_DAYS)
+    engagement = {}
+    for borrow_date, return_date, book_name in history:
+        borrow_dt = _parse_date(borrow_date)
+        if not borrow_dt or borrow_dt < window_start:
+            continue
+        return_dt = _parse_date(return_date) or today
+        engagement[book_name] = engagement.get(book_name, 0) + max((return_dt - borrow_dt).days, 1)
+    favorite = max(engagement.items(), key=lambda item: item[1])[0] if engagement else None
+
+    return build_reports(busiest_day and busiest_day.isoformat(), len(busiest_titles),
+                         json.dumps(busiest_titles[:5], ensure_ascii=False), favorite)
+
+
+def check(conn: sqlite3.Connection) -> list[tuple]:
+    """
+    Readers whose stored report differs from one recomputed from borrow_record,
+    as of the stored `as_of`: (student_id, stored, expected)
+    Both break ties in favour of the newest loan (borrow date, then record id)
+    """
+    stored = {row[0]: (row[1], build_reports(*row[2:])) for row in conn.execute(
+        "SELECT student_id, as_of, busiest_day, busiest_books, busiest_titles, favorite_title FROM reader_reading_stats"
+    )}
+    histories: dict[str, list[tuple]] = {}
+    for student_id, borrow_date, return_date, book_name in conn.execute("""
+        SELECT br.student_id, br.borrow_date, br.return_date, b.book_name
+        FROM borrow_record br
+        JOIN book b ON br.book_id = b.book_id
+        ORDER BY br.student_id, br.borrow_date DESC, br.record_id DESC
+    """):
+        histories.setdefault(student_id, []).append((borrow_date, return_date, book_name))
+
+    mismatches = []
+    for student_id in sorted(stored.keys() | histories.keys()):
+        as_of, reports = stored.get(student_id, (None, []))
+        today = _parse_date(as_of) or date.today()
+        expected = history_reports(histories.get(student_id, []), today)
+        if reports != expected:
+            mismatches.append((student_id, reports, expected))
+    return mismatches
+
+
+def rebuild(conn: sqlite3.Connection) -> int:
+    """
+    Replace the statistics with ones recomputed from borrow_record, in one transaction
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for statement in REBUILD_SQL:
+            conn.execute(statement)
+        readers = conn.execute("SELECT COUNT(*) FROM reader_reading_stats").fetchone()[0]
+        conn.execute("COMMIT")
+    except sqlite3.Error:
+        conn.execute("ROLLBACK")
+        raise
+    return readers
+
+
+def roll_batch(conn: sqlite3.Connection, today: str) -> int:
+    """
+    Advance `as_of` to today for up to ROLL_BATCH readers; the refresh trigger
+    recomputes their rows. Returns how many were rolled (0 when all are current)
+    """
+    return conn.execute("""
+        UPDATE reader_reading_stats SET as_of = ?
+        WHERE student_id IN (
+            SELECT student_id FROM reader_reading_stats
+            WHERE as_of < ?
+            LIMIT ?
+        )
+    """, (today, today, ROLL_BATCH)).rowcount
+
+
+def _parse_roll_time(value: str) -> Optional[tuple[int, int]]:
+    if value.lower() in ("", "off", "0", "false", "no"):
+        return None
+    hour, _, minute = value.partition(":")
+    return int(hour), int(minute or 0)
+
+
+class ReadingStatsRoller:
+    """
+    Background thread that rolls the statistics once at startup (if the last
+    roll was missed) and then every day at `roll_time`, through the single writer
+    """
+
+    def __init__(self, writer, roll_time: str):
+        self.writer = writer
+        self.roll_time = _parse_roll_time(roll_time)
+        self._thread = None
+        self._stop = threading.Event()
+        self.last_roll: Optional[str] = None
+        self.readers_rolled = 0
+
+    def start(self) -> None:
+        if self.roll_time is None or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="reading-stats-roller", daemon=True)
+        self._thread.start()
+
+    def _seconds_until_next_roll(self) -> float:
+        now = datetime.now()
+        hour, minute = self.roll_time
+        next_roll = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if next_roll <= now:
+            next_roll += timedelta(days=1)
+        return (next_roll - now).total_seconds()
+
+    def roll(self) -> int:
+        """
+        Roll every reader to today, one writer job per batch so borrows and returns interleave
+        """
+        today = date.today().isoformat()
+        rolled = 0
+        while not self._stop.is_set():
+            count = self.writer.submit(roll_batch, today).result()
+            rolled += count
+            if count < ROLL_BATCH:
+                break
+        self.last_roll = today
+        self.readers_rolled += rolled
+        logger.info(f"Reading statistics rolled to {today}: {rolled} reader(s)")
+        return rolled
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.roll()
+            except Exception as e:
+                logger.error(f"Failed to roll reading statistics: {e}")
+            if self._stop.wait(self._seconds_until_next_roll()):
+                break
+
+    def stop(self) -> None:
+        """
+        Must run before the single writer is stopped
+        """
+        thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._stop.set()
+        thread.join()
+
+
+reading_stats_roller = ReadingStatsRoller(writer, STATS_ROLL_TIME)
+
+
+def main(argv: list[str]) -> int:
+    command = argv[0] if argv else "check"
+    if command not in ("check", "rebuild", "roll"):
+        print(__doc__)
+        return 2
+
+    conn = open_connection(argv[1] if len(argv) > 1 else DB_PATH)
+    conn.isolation_level = None
+    try:
+        if command == "rebuild":
+            readers = rebuild(conn)
+            print(f"reader_reading_stats rebuilt: {readers} reader(s)")
+        elif command == "roll":
+            today = date.today().isoformat()
+            rolled = 0
+            while True:
+                count = roll_batch(conn, today)
+                rolled += count
+                if count < ROLL_BATCH:
+                    break
+            print(f"reader_reading_stats rolled to {today}: {rolled} reader(s)")
+            return 0
+
+        mismatches = check(conn)
+        for student_id, stored, expected in mismatches:
+            print(f"{student_id}: stored {stored}, expected {expected}")
+        print(f"{len(mismatches)} reader(s) differ from borrow_record")
+        return 1 if mismatches else 0
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
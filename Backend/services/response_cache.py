@@ -0,0 +1,169 @@
+"""
+Read-through response cache for the profile endpoints (and, with versioned
+keys, for book search; see services/search_cache.py)
+
+Entries hold the serialized JSON body and its ETag, keyed by route and
+parameters, bounded by LRU order and a TTL. Each entry carries tags naming the
+rows it was built from ("reader:<student_id>", "librarian:<admin_id>",
+"director:<admin_id>", "librarians" for the list); write routes invalidate
+those tags after their transaction commits.
+
+A read that was in flight while an invalidation happened may have seen the old
+row, so put() only stores a body if no invalidation happened since the read
+started (the `generation` it was given); the body is still returned to the caller.
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+
+logger = logging.getLogger(__name__)
+
+PROFILE_CACHE_SIZE = int(os.environ.get("LIBRARY_PROFILE_CACHE_SIZE", "10000"))
+PROFILE_CACHE_TTL = float(os.environ.get("LIBRARY_PROFILE_CACHE_TTL", "300"))
+
+# 浏览器每次都带 If-None-Match 重新验证，数据未变时得到 304
+CACHE_CONTROL = "private, no-cache"
+
+
+class CachedBody:
+    __slots__ = ("body", "etag", "tags", "expires_at")
+
+    def __init__(self, body: bytes, etag: str, tags: tuple[str, ...], expires_at: float):
+        self.body = body
+        self.etag = etag
+        self.tags = tags
+        self.expires_at = expires_at
+
+
+def make_body(content) -> tuple[bytes, str]:
+    # 与 FastAPI JSONResponse 的序列化方式一致
+    body = json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+    return body, f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int, ttl: Optional[float]):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[tuple, CachedBody] = OrderedDict()
+        self._tags: dict[str, set] = {}
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _drop(self, key: tuple) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry.tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def get(self, key: tuple) -> Optional[CachedBody]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= time.monotonic():
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: tuple, content, tags: Iterable[str], generation: int, etag: Optional[str] = None) -> CachedBody:
+        """
+        Cache a response body; `etag` overrides the default content hash
+        """
+        body, content_etag = make_body(content)
+        etag = etag or content_etag
+        # ttl 为 None 时条目只会被 LRU 淘汰或失效
+        expires_at = float("inf") if self.ttl is None else time.monotonic() + self.ttl
+        entry = CachedBody(body, etag, tuple(tags), expires_at)
+        with self._lock:
+            # 读取期间发生过失效，结果可能是旧数据，不缓存
+            if generation != self.generation or self.max_entries <= 0:
+                return entry
+            self._drop(key)
+            self._entries[key] = entry
+            for tag in entry.tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+        return entry
+
+    def invalidate(self, *tags: str) -> None:
+        with self._lock:
+            self.generation += 1
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._drop(key)
+                    self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._tags.clear()
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "capacity": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+profile_cache = ResponseCache(PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL)
+
+
+def reader_tag(student_id: str) -> str:
+    return f"reader:{student_id}"
+
+
+def admin_tag(role: str, admin_id) -> str:
+    return f"{role}:{admin_id}"
+
+
+LIBRARIANS_TAG = "librarians"
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def etag_response(request: Request, entry: CachedBody) -> Response:
+    """
+    The cached body with its ETag, or an empty 304 if the client already has it
+    """
+    headers = {"ETag": entry.etag, "Cache-Control": CACHE_CONTROL}
+    if _etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
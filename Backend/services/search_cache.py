@@ -0,0 +1,66 @@
+"""
+Versioned result cache for /api/search-books
+
+Every committed write that changes what a search can return (adding, updating,
+deleting or importing books, and borrowing or returning them, since results
+include if_available) bumps the catalog version. Cache keys start with the
+version, so entries cached under an older version are never served again and
+simply age out of the LRU. The version starts from the wall clock in
+microseconds, so it keeps increasing across restarts and ETags from an earlier
+process are never mistaken for current ones.
+
+Writes made by another process (the import CLI) do not bump the version of a
+running server; its cached searches stay stale until the next bump or restart.
+"""
+import os
+import time
+import hashlib
+import threading
+import logging
+from typing import Optional
+
+from services.response_cache import ResponseCache
+
+logger = logging.getLogger(__name__)
+
+SEARCH_CACHE_SIZE = int(os.environ.get("LIBRARY_SEARCH_CACHE_SIZE", "2000"))
+
+
+class CatalogVersion:
+    def __init__(self):
+        self._value = time.time_ns() // 1000
+        self._lock = threading.Lock()
+        self.bumps = 0
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+    def bump(self) -> int:
+        with self._lock:
+            self._value += 1
+            self.bumps += 1
+            return self._value
+
+
+catalog_version = CatalogVersion()
+
+# 版本号已包含在键中，条目不需要 TTL
+search_cache = ResponseCache(SEARCH_CACHE_SIZE, None)
+
+
+def search_key(version: int, match: Optional[str], exact_id: Optional[int], *page) -> tuple:
+    """
+    Cache key of one search page: the FTS terms (FTS5 matching is case-insensitive,
+    so they are lower-cased) and the numeric id decide the results, not the raw query text
+    """
+    return ("search-books", version, match.lower() if match else None, exact_id, *page)
+
+
+def search_etag(key: tuple) -> str:
+    digest = hashlib.blake2b(repr(key[2:]).encode("utf-8"), digest_size=8).hexdigest()
+    return f'"v{key[1]}-{digest}"'
+
+
+def search_metrics() -> dict:
+    return {"catalog_version": catalog_version.value, "version_bumps": catalog_version.bumps, **search_cache.metrics()}
@@ -0,0 +1,151 @@
+"""
+Login sessions
+
+/api/login issues a signed token "<payload>.<signature>": the payload is
+URL-safe base64 JSON {"sid", "sub", "role", "exp"} and the signature is
+HMAC-SHA256 over it with LIBRARY_SESSION_SECRET. Live sessions are kept in an
+in-memory TTL cache keyed by sid, so authenticating a request is one HMAC and
+one dict lookup; SQLite is only read at login. Logging out (or a restart)
+drops the session, which invalidates its token even before it expires.
+"""
+import os
+import json
+import time
+import hmac
+import base64
+import hashlib
+import secrets
+import threading
+import logging
+from collections import OrderedDict
+from typing import Optional
+
+from fastapi import Header, HTTPException
+
+logger = logging.getLogger(__name__)
+
+# 未设置时每次启动随机生成，重启后旧令牌全部失效
+SESSION_SECRET = os.environ.get("LIBRARY_SESSION_SECRET") or secrets.token_urlsafe(32)
+SESSION_TTL = int(os.environ.get("LIBRARY_SESSION_TTL", "28800"))
+SESSION_MAX = int(os.environ.get("LIBRARY_SESSION_MAX", "100000"))
+
+ROLES = ("reader", "librarian", "director")
+
+# 每种身份一条查询同时取出密码和姓名
+LOGIN_QUERIES = {
+    "reader": "SELECT password, name FROM reader_information WHERE student_id = ?",
+    "librarian": "SELECT password, name FROM librarian_information WHERE admin_id = ?",
+    "director": "SELECT password, name FROM director_information WHERE admin_id = ?",
+}
+
+# 登录时按同一身份和编号回写重新计算的哈希；密码已被修改则不覆盖
+REHASH_QUERIES = {
+    "reader": "UPDATE reader_information SET password = ? WHERE student_id = ? AND password = ?",
+    "librarian": "UPDATE librarian_information SET password = ? WHERE admin_id = ? AND password = ?",
+    "director": "UPDATE director_information SET password = ? WHERE admin_id = ? AND password = ?",
+}
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+class SessionStore:
+    """
+    In-memory TTL cache of live sessions plus token signing
+    Every session gets the same TTL, so insertion order is expiry order and
+    expired sessions are swept from the front; past `max_sessions` the oldest
+    session is evicted.
+    """
+
+    def __init__(self, secret: str, ttl: int, max_sessions: int):
+        self._key = secret.encode("utf-8")
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _sign(self, payload: str) -> str:
+        return _b64encode(hmac.new(self._key, payload.encode("utf-8"), hashlib.sha256).digest())
+
+    def _sweep(self, now: float) -> None:
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if session["expires_at"] > now and len(self._sessions) <= self.max_sessions:
+                break
+            self._sessions.popitem(last=False)
+
+    def create(self, user_id: str, role: str, full_name: str) -> tuple[str, dict]:
+        now = time.time()
+        sid = secrets.token_urlsafe(16)
+        expires_at = int(now) + self.ttl
+        session = {"sid": sid, "user_id": user_id, "role": role, "full_name": full_name, "expires_at": expires_at}
+        payload = _b64encode(json.dumps(
+            {"sid": sid, "sub": user_id, "role": role, "exp": expires_at}, separators=(",", ":")
+        ).encode("utf-8"))
+        with self._lock:
+            self._sessions[sid] = session
+            self._sweep(now)
+        return f"{payload}.{self._sign(payload)}", session
+
+    def validate(self, token: str) -> Optional[dict]:
+        """
+        The live session behind a token, or None for a forged, expired or revoked one
+        """
+        payload, _, signature = token.partition(".")
+        if not payload or not hmac.compare_digest(signature.encode("utf-8"), self._sign(payload).encode("ascii")):
+            return None
+        try:
+            claims = json.loads(_b64decode(payload))
+        except ValueError:
+            return None
+        if claims.get("exp", 0) <= time.time():
+            return None
+        session = self._sessions.get(claims.get("sid"))
+        if session is None or session["user_id"] != claims.get("sub") or session["role"] != claims.get("role"):
+            return None
+        return session
+
+    def revoke(self, sid: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(sid, None) is not None
+
+    def revoke_user(self, user_id: str, role: str) -> int:
+        """
+        Drop every session of one account (e.g. after its password changes)
+        """
+        with self._lock:
+            sids = [sid for sid, session in self._sessions.items()
+                    if session["user_id"] == user_id and session["role"] == role]
+            for sid in sids:
+                del self._sessions[sid]
+        return len(sids)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+session_store = SessionStore(SESSION_SECRET, SESSION_TTL, SESSION_MAX)
+
+
+def bearer_token(authorization: Optional[str]) -> Optional[str]:
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token.strip():
+        return None
+    return token.strip()
+
+
+async def current_session(authorization: Optional[str] = Header(None)) -> dict:
+    """
+    Dependency for routes that need a logged-in user ("Authorization: Bearer <token>")
+    """
+    token = bearer_token(authorization)
+    session = session_store.validate(token) if token else None
+    if session is None:
+        raise HTTPException(status_code=401, detail="Not logged in or session expired",
+                            headers={"WWW-Authenticate": "Bearer"})
+    return session
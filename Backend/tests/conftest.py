@@ -0,0 +1,48 @@
+"""
+Shared fixtures: the real FastAPI app, started once per test session against a
+temporary copy of library.db, and an httpx client talking to it in process
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 连接池、写线程等在导入时就按 LIBRARY_DB_PATH 创建，必须在导入应用之前设置
+_workdir = tempfile.mkdtemp(prefix="library_tests_")
+DB_PATH = os.path.join(_workdir, "library.db")
+shutil.copy(os.path.join(BACKEND_DIR, "library.db"), DB_PATH)
+os.environ["LIBRARY_DB_PATH"] = DB_PATH
+# 测试中的登录和注册不需要生产强度的哈希
+os.environ.setdefault("LIBRARY_PBKDF2_ITERATIONS", "1000")
+os.environ.setdefault("LIBRARY_LOG_LEVEL", "WARNING")
+sys.path.insert(0, BACKEND_DIR)
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(_workdir, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(scope="session")
+async def app(anyio_backend):
+    import main
+
+    async with main.app.router.lifespan_context(main.app):
+        yield main.app
+
+
+@pytest.fixture
+async def client(app):
+    import httpx
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
@@ -0,0 +1,56 @@
+"""
+A bad publish_year is a per-row rejection, and a chunk whose write fails is
+rolled back without ending the import
+"""
+import json
+import shutil
+import sqlite3
+
+import pytest
+
+from db import db
+from services import catalog_import
+
+pytestmark = pytest.mark.anyio
+
+BOOKS = "book_name,author,publish_year\nGood Year,A,1999\nHuge Year,A,1e20\nFuture Year,A,3000\nAlso Good,A,2001.0\n"
+
+
+def test_publish_year_range():
+    for year in ("1e20", "3000", "-1", "inf", "1999.5"):
+        with pytest.raises(ValueError):
+            catalog_import.validate_book({"book_name": "B", "author": "A", "publish_year": year})
+    assert catalog_import.validate_book({"book_name": "B", "author": "A", "publish_year": "1999.0"})[3] == 1999
+
+
+async def test_import_rejects_out_of_range_year(client):
+    response = await client.post("/api/import-books", files={"file": ("books.csv", BOOKS)})
+    assert response.status_code == 200
+    events = [json.loads(line) for line in response.text.splitlines()]
+    done = events[-1]
+    assert done["event"] == "done"
+    assert (done["imported"], done["failed"]) == (2, 2)
+    assert sorted(error["row"] for event in events for error in event.get("errors", ())) == [3, 4]
+
+
+def test_failed_chunk_is_rolled_back(tmp_path, monkeypatch):
+    path = tmp_path / "library.db"
+    shutil.copy(db.pool.path, path)
+    books = tmp_path / "books.csv"
+    books.write_text("book_name,author\nFirst,A\nSecond,A\n")
+
+    def _fail(conn, items, numbers):
+        catalog_import.insert_books(conn, items, numbers)
+        raise OverflowError("Python int too large to convert to SQLite INTEGER")
+
+    def _count() -> int:
+        conn = sqlite3.connect(path)
+        try:
+            return conn.execute("SELECT COUNT(*) FROM book").fetchone()[0]
+        finally:
+            conn.close()
+
+    before = _count()
+    assert catalog_import.import_main([str(books), "--db", str(path)], "test", "test",
+                                      catalog_import.validate_book, _fail) == 1
+    assert _count() == before
@@ -0,0 +1,49 @@
+"""
+A slow report query runs on the database thread pool, so it must not hold up
+other requests served by the same event loop
+"""
+import asyncio
+import time
+
+import pytest
+
+import api.librarianBookOperation as librarian_book_operation
+
+pytestmark = pytest.mark.anyio
+
+REPORT_SECONDS = 2.0
+
+
+async def _timed(request):
+    start = time.perf_counter()
+    response = await request
+    return response, time.perf_counter() - start
+
+
+async def test_slow_report_does_not_delay_health_and_login(client, monkeypatch):
+    real_report_counts = librarian_book_operation.report_counts
+
+    def slow_report_counts(conn, date):
+        # 模拟一个耗时的报表查询，占用一个数据库线程
+        time.sleep(REPORT_SECONDS)
+        return real_report_counts(conn, date)
+
+    monkeypatch.setattr(librarian_book_operation, "report_counts", slow_report_counts)
+
+    report = asyncio.create_task(_timed(client.get("/api/view-report", params={"date": "2024-01-01"})))
+    await asyncio.sleep(0.1)
+
+    health, health_seconds = await _timed(client.get("/health"))
+    login, login_seconds = await _timed(client.post("/api/login", json={
+        "id": "123996230", "password": "5sy8rLdC", "identity": "reader",
+    }))
+    assert not report.done()
+
+    report_response, report_seconds = await report
+
+    assert health.status_code == 200
+    assert login.status_code == 200
+    assert report_response.status_code == 200
+    assert report_seconds >= REPORT_SECONDS
+    assert health_seconds < REPORT_SECONDS / 4
+    assert login_seconds < REPORT_SECONDS / 4
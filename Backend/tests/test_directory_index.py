@@ -0,0 +1,103 @@
+"""
+DirectoryIndex pages must match a brute-force search over the same records,
+before and after writes
+"""
+import random
+
+import pytest
+
+import services.directory_index as directory_index
+from db.pagination import InvalidPageRequest
+from services.directory_index import DirectoryIndex, READER_COLUMNS
+
+NAMES = ["david", "davidson", "dave", "anna", "ann", "bob", "li wei", "wei"]
+DEPARTMENTS = ["computer science", "data science", "math", None]
+QUERIES = ["", "david", "da", "d", "12", "120", "1", "science", "li wei", "wei", "zzz", "u1", "u10@x.com"]
+SORTS = ["relevance", "reader_id", "student_id", "name"]
+
+
+def _row(rng: random.Random, number: int, student_id: str = None) -> tuple:
+    return (f"Reader {number}", student_id or f"12{rng.randint(0, 9999999):07d}",
+            f"{rng.choice(NAMES)} {rng.choice(NAMES)}", f"u{number}@x.com", f"1{rng.randint(0, 99999):05d}",
+            rng.choice(DEPARTMENTS), rng.choice(DEPARTMENTS))
+
+
+def _new_index() -> DirectoryIndex:
+    return DirectoryIndex(READER_COLUMNS, key="student_id", order_by="reader_id",
+                          indexed=("student_id", "phone", "email", "name", "department", "major"),
+                          sortable=("reader_id", "student_id", "name"))
+
+
+def _expected(index: DirectoryIndex, rows: dict, query: str, sort: str) -> list[str]:
+    term = query.strip().lower()
+    column = READER_COLUMNS.index("reader_id" if sort == "relevance" else sort)
+    matches = []
+    for row in rows.values():
+        terms = index._terms(row)
+        exact = term in terms
+        prefix = len(term) >= directory_index.MIN_PREFIX and any(word.startswith(term) for word in terms)
+        if term and not (exact or prefix):
+            continue
+        group = (0 if term and exact else 1,) if sort == "relevance" else ()
+        matches.append((*group, row[column] or "", row[1]))
+    return [match[-1] for match in sorted(matches)]
+
+
+def _all_pages(index: DirectoryIndex, query: str, sort: str) -> tuple[list[str], int]:
+    keys, after = [], None
+    while True:
+        page, after, total = index.search(query, sort, after, 37)
+        keys.extend(record["student_id"] for record in page)
+        if after is None:
+            return keys, total
+
+
+def _check(index: DirectoryIndex, rows: dict) -> None:
+    for query in QUERIES:
+        for sort in SORTS:
+            expected = _expected(index, rows, query, sort)
+            assert _all_pages(index, query, sort) == (expected, len(expected)), (query, sort)
+
+
+@pytest.mark.parametrize("sparse_prefix", [5, 1000])
+def test_search_matches_brute_force(monkeypatch, sparse_prefix):
+    # 5 时前缀查询走按排序数组过滤的路径，1000 时走取出排序的路径
+    monkeypatch.setattr(directory_index, "SPARSE_PREFIX", sparse_prefix)
+    rng = random.Random(1)
+    rows = {row[1]: row for row in (_row(rng, number) for number in range(1500))}
+    index = _new_index()
+    index.load(rows.values())
+    _check(index, rows)
+
+    # 写入后结果、缓存的有序数组和缓存的总数都要随之更新
+    for student_id in list(rows)[:200]:
+        index.remove(student_id)
+        del rows[student_id]
+    for student_id in list(rows)[:100]:
+        rows[student_id] = _row(rng, 5000, student_id)
+        index.upsert(rows[student_id])
+    added = [_row(rng, number) for number in range(6000, 6300)]
+    index.upsert_many(added)
+    rows.update((row[1], row) for row in added)
+    _check(index, rows)
+
+
+def test_short_query_matches_exact_terms_only():
+    index = _new_index()
+    index.load([("Reader 1", "123456789", "a b", None, None, None, None),
+                ("Reader 2", "223456789", "ab", None, None, None, None)])
+    readers, _, total = index.search("a")
+    assert [reader["student_id"] for reader in readers] == ["123456789"]
+    assert total == 1
+
+
+def test_invalid_sort_and_cursor():
+    index = _new_index()
+    index.load([("Reader 1", "123456789", "anna", None, None, None, None)])
+    with pytest.raises(InvalidPageRequest):
+        index.search("anna", sort="email")
+    with pytest.raises(InvalidPageRequest):
+        index.search("anna", sort="name", after=[1, 2], limit=1)
+    for after in ([], [2, "Reader 1", "123456789"]):
+        with pytest.raises(InvalidPageRequest):
+            index.search("anna", after=after, limit=1)
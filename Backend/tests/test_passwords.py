@@ -0,0 +1,38 @@
+"""
+Stored password values: hashes verify, plaintext asks for a rehash, and a
+malformed hash is a failed verification rather than an error
+"""
+import pytest
+
+from services import passwords
+from services.passwords import hash_password, verify_password
+
+
+def test_hash_round_trip():
+    stored = hash_password("secret")
+    assert verify_password("secret", stored) == (True, False)
+    assert verify_password("other", stored) == (False, False)
+
+
+def test_plaintext_needs_rehash():
+    assert verify_password("secret", "secret") == (True, True)
+
+
+@pytest.mark.parametrize("stored", [
+    "scrypt$x",
+    "pbkdf2_sha256$x",
+    "pbkdf2_sha256$abc$AA$AA",
+    "pbkdf2_sha256$99999999999999999999$AA$AA",
+    "scrypt$1$AA$AA",
+    "pbkdf2_sha256$1000$not base64!$AA",
+])
+def test_malformed_hash_fails(stored):
+    assert verify_password("secret", stored) == (False, False)
+
+
+def test_enrollment_hash_is_upgraded_at_login(monkeypatch):
+    monkeypatch.setattr(passwords, "ENROLL_PBKDF2_ITERATIONS", 10)
+    stored = passwords.hash_enrollment_password("secret")
+    assert stored.startswith("pbkdf2_sha256$10$")
+    # 参数弱于当前配置：校验通过，并要求登录时重新哈希
+    assert verify_password("secret", stored) == (True, True)
@@ -0,0 +1,160 @@
+"""
+Every statement the API routes, the startup loads and the background rolls
+execute must be answered by an index (see db/query_plans.py)
+Run with -s to print every plan.
+"""
+import sqlite3
+from datetime import date, timedelta
+
+import pytest
+
+from db import db
+from db.query_plans import record_statements, trigger_statements, check_plans, format_results
+from services.directory_index import load_directories
+from services.overdue import roll_overdue
+from services.reading_stats import roll_batch
+
+pytestmark = pytest.mark.anyio
+
+READER = "123090404"
+NEW_READER = "987650001"
+BOOK = 2
+TODAY = date.today().isoformat()
+
+
+# (method, path, request kwargs)；顺序有意义：先借书再续借、归还，先新增再修改、删除
+ROUTE_CALLS = [
+    ("POST", "/api/login", {"json": {"id": READER, "password": "x", "identity": "reader"}}),
+    ("POST", "/api/login", {"json": {"id": "1", "password": "x", "identity": "librarian"}}),
+    ("POST", "/api/login", {"json": {"id": "1", "password": "x", "identity": "director"}}),
+    ("GET", "/api/session", {}),
+    ("POST", "/api/logout", {}),
+
+    ("GET", "/api/search-books", {"params": {"query": "atomic habits"}}),
+    ("GET", "/api/search-books", {"params": {"query": "2"}}),
+    ("GET", "/api/search-books", {"params": {"query": "atomic", "sort": "book_name"}}),
+    ("GET", "/api/search-books", {"params": {"query": "", "limit": 2}}),
+    ("GET", "/api/search-books", {"params": {"query": "", "sort": "book_id", "limit": 2}}),
+    ("GET", "/api/search-books/metrics", {}),
+    ("GET", "/api/reader-borrowings", {"params": {"student_id": READER, "limit": 2}}),
+    ("GET", "/api/reader-borrowings", {"params": {"student_id": READER, "sort": "due_date", "limit": 2}}),
+    ("GET", "/api/reader-activity-calendar", {"params": {"student_id": READER}}),
+    ("GET", "/api/reader-reading-report", {"params": {"student_id": READER}}),
+
+    ("POST", "/api/borrow-book", {"params": {"student_id": READER, "book_id": BOOK}}),
+    ("POST", "/api/borrow-book", {"params": {"student_id": READER, "book_id": BOOK}}),
+    ("GET", "/api/reader-renew-books", {"params": {"student_id": READER, "book_id": BOOK}}),
+    ("GET", "/api/reader-return-books", {"params": {"student_id": READER, "book_id": BOOK}}),
+    ("POST", "/api/borrow-books", {"json": {"student_id": READER, "book_ids": [BOOK, 3, 999999]}}),
+    ("POST", "/api/return-books", {"json": {"student_id": READER, "book_ids": [BOOK, 3]}}),
+
+    ("GET", "/api/reader-log-up", {"params": {"student_id": NEW_READER, "password": "pw"}}),
+    ("GET", "/api/reader-information", {"params": {"student_id": NEW_READER}}),
+    ("POST", "/api/update-reader-information", {"json": {"student_id": NEW_READER, "name": "Plan Reader"}}),
+    ("GET", "/api/librarian-director-information", {"params": {"admin_id": "1", "role": "librarian"}}),
+    ("GET", "/api/librarian-director-information", {"params": {"admin_id": "1", "role": "director"}}),
+    ("POST", "/api/update-librarian-director-information",
+     {"json": {"admin_id": "1", "role": "director", "phone": "123"}}),
+
+    ("GET", "/api/libarian-add-books", {"params": {
+        "book_name": "Plan Book", "author": "Plan Author", "publisher": "P", "publish_year": "2020",
+        "location": "A1", "if_available": 1}}),
+    ("POST", "/api/import-books", {"files": {"file": ("books.csv", "book_name,author\nImported,Someone\n")}}),
+    ("POST", "/api/update-book", {"json": {"book_id": 1, "location": "B2"}}),
+    ("DELETE", "/api/delete-book", {"params": {"book_id": 1}}),
+    ("GET", "/api/view-report", {"params": {"date": TODAY}}),
+    ("GET", "/api/view-report", {"params": {"date": TODAY, "details": True}}),
+    ("GET", "/api/overdue", {"params": {"limit": 1}}),
+    ("GET", "/api/overdue", {"params": {"student_id": READER, "sort": "days_overdue", "limit": 1}}),
+    ("GET", "/api/view-library-logs", {"params": {"date": TODAY}}),
+
+    ("GET", "/api/audit-log", {"params": {"limit": 1}}),
+    ("GET", "/api/audit-log", {"params": {"target_type": "book", "target_id": str(BOOK), "since": "2025-01-01",
+                                          "include_total": True, "limit": 1}}),
+    ("GET", "/api/audit-log", {"params": {"actor_role": "reader", "actor_id": READER, "action": "borrow",
+                                          "limit": 1}}),
+    ("GET", "/api/audit-log", {"params": {"since": TODAY, "until": TODAY, "sort": "ts", "limit": 1}}),
+    ("GET", "/api/audit-log/metrics", {}),
+
+    ("GET", "/api/search-readers", {"params": {"query": "reader", "limit": 1}}),
+    ("GET", "/api/add-new-reader", {"params": {
+        "student_id": "987650002", "name": "Added", "password": "pw", "email": "a@b.c", "phone": "1",
+        "department": "D", "major": "M"}}),
+    ("POST", "/api/enroll-readers", {"files": {"file": ("roster.csv", "student_id,password\n987650003,pw\n")}}),
+    ("POST", "/api/update-reader", {"json": {"student_id": "987650002", "email": "x@y.z", "password": "pw2"}}),
+    ("DELETE", "/api/delete-reader", {"params": {"student_id": "987650002"}}),
+
+    ("GET", "/api/search-librarian", {"params": {"query": "spica", "limit": 1}}),
+    ("POST", "/api/add-new-librarian", {"data": {
+        "name": "Plan Librarian", "password": "pw", "email": "l@b.c", "phone": "2", "department": "D"}}),
+    ("GET", "/api/all-librarians", {"params": {"limit": 1}}),
+    ("GET", "/api/all-librarians", {"params": {"sort": "name", "limit": 1}}),
+    ("DELETE", "/api/delete-librarian", {"params": {"admin_id": "2"}}),
+]
+
+# 第二页：用第一页返回的游标，覆盖带 seek 条件的语句
+PAGED_CALLS = [
+    ("/api/search-books", {"query": "", "limit": 2}),
+    ("/api/search-books", {"query": "", "sort": "book_id", "limit": 2}),
+    ("/api/search-books", {"query": "a", "limit": 1}),
+    ("/api/search-books", {"query": "a", "sort": "book_name", "limit": 1}),
+    ("/api/reader-borrowings", {"student_id": READER, "limit": 2}),
+    ("/api/reader-borrowings", {"student_id": READER, "sort": "due_date", "limit": 2}),
+    ("/api/all-librarians", {"limit": 1}),
+    ("/api/all-librarians", {"sort": "name", "limit": 1}),
+    ("/api/audit-log", {"limit": 1}),
+]
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _background_jobs(conn: sqlite3.Connection) -> None:
+    # 明天的滚动会执行真正的推进语句；最后回滚，不改变测试数据库
+    tomorrow = (date.today() + timedelta(days=1)).isoformat()
+    roll_overdue(conn, tomorrow)
+    roll_batch(conn, tomorrow)
+    raise _Rollback()
+
+
+async def _recorded(origin: str, statements: list, call):
+    with record_statements() as recorded:
+        try:
+            return await call
+        finally:
+            statements.extend((origin, sql, params) for sql, params in recorded)
+
+
+async def test_route_statements_use_indexes(app, client):
+    statements = []
+    await _recorded("startup", statements, db.run(load_directories))
+    with pytest.raises(_Rollback):
+        await _recorded("background roll", statements, db.transaction(_background_jobs))
+
+    called = set()
+    for method, path, kwargs in ROUTE_CALLS:
+        response = await _recorded(path, statements, client.request(method, path, **kwargs))
+        assert response.status_code < 500, f"{method} {path}: {response.status_code} {response.text}"
+        called.add(path)
+
+    for path, params in PAGED_CALLS:
+        first = await client.get(path, params=params)
+        next_cursor = first.json()["next_cursor"]
+        assert next_cursor, f"{path} {params} has no second page"
+        response = await _recorded(path, statements, client.get(path, params={**params, "cursor": next_cursor}))
+        assert response.status_code == 200, f"{path}: {response.status_code} {response.text}"
+
+    # 每个 /api 路由都至少调用过一次，新增的路由必须加到 ROUTE_CALLS
+    api_routes = {route.path for route in app.routes if route.path.startswith("/api/")}
+    assert api_routes - called == set()
+
+    conn = sqlite3.connect(db.pool.path)
+    try:
+        results = check_plans(conn, statements + trigger_statements(conn))
+    finally:
+        conn.close()
+
+    report = format_results(results)
+    print(report)
+    assert not [result for result in results if result[0] == "FULL SCAN"], report
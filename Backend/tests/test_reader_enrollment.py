@@ -0,0 +1,35 @@
+"""
+/api/enroll-readers stores enrollment hashes, and the enrolled readers can log in
+"""
+import sqlite3
+
+import pytest
+
+from db import db
+from services import passwords
+
+pytestmark = pytest.mark.anyio
+
+ROSTER = "student_id,password,name\n987660001,first-pw,Roster One\n987660002,second-pw,Roster Two\n"
+
+
+async def test_roster_passwords_are_hashed(client):
+    response = await client.post("/api/enroll-readers", files={"file": ("roster.csv", ROSTER)})
+    assert response.status_code == 200, response.text
+    assert response.json()["enrolled"] == 2
+
+    conn = sqlite3.connect(db.pool.path)
+    try:
+        stored = dict(conn.execute(
+            "SELECT student_id, password FROM reader_information WHERE student_id IN ('987660001', '987660002')"
+        ).fetchall())
+    finally:
+        conn.close()
+    assert stored.keys() == {"987660001", "987660002"}
+    iterations = min(passwords.ENROLL_PBKDF2_ITERATIONS, passwords.PBKDF2_ITERATIONS)
+    assert all(password.startswith(f"pbkdf2_sha256${iterations}$") for password in stored.values())
+
+    login = await client.post("/api/login", json={"id": "987660002", "password": "second-pw", "identity": "reader"})
+    assert login.status_code == 200, login.text
+    wrong = await client.post("/api/login", json={"id": "987660002", "password": "first-pw", "identity": "reader"})
+    assert wrong.status_code != 200
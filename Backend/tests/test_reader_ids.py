@@ -0,0 +1,51 @@
+"""
+Concurrent registrations get unique, contiguous reader ids from id_sequence
+"""
+import sqlite3
+
+import anyio
+import pytest
+
+from db import db
+from services.id_allocator import id_allocator, READER_SEQUENCE
+
+pytestmark = pytest.mark.anyio
+
+CALLS = 60
+
+
+def _call(number: int) -> tuple[str, dict]:
+    student_id = f"98768{number:04d}"
+    if number % 2:
+        return "/api/reader-log-up", {"student_id": student_id, "password": "pw"}
+    return "/api/add-new-reader", {"student_id": student_id, "name": f"Concurrent {number}", "password": "pw",
+                                   "email": "c@x.y", "phone": "1", "department": "D", "major": "M"}
+
+
+async def test_concurrent_registrations_get_contiguous_ids(client):
+    # 丢弃之前测试留下的号段：之后的编号都来自本测试中连续预留的号段
+    id_allocator.discard(READER_SEQUENCE)
+    statuses = {}
+
+    async def _register(number: int) -> None:
+        path, params = _call(number)
+        response = await client.get(path, params=params)
+        statuses[number] = (response.status_code, response.text)
+
+    async with anyio.create_task_group() as tg:
+        for number in range(CALLS):
+            tg.start_soon(_register, number)
+
+    # 违反唯一约束（IntegrityError）的写入会返回 500
+    assert {number: status for number, status in statuses.items() if status[0] != 200} == {}
+
+    conn = sqlite3.connect(db.pool.path)
+    try:
+        reader_ids = [row[0] for row in conn.execute(
+            "SELECT reader_id FROM reader_information WHERE student_id LIKE '98768%'"
+        )]
+    finally:
+        conn.close()
+    numbers = sorted(int(reader_id.removeprefix("Reader ")) for reader_id in reader_ids)
+    assert len(numbers) == CALLS
+    assert numbers == list(range(numbers[0], numbers[0] + CALLS))
@@ -0,0 +1,16 @@
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.mark.parametrize("query", ["²", "99999999999999999999999", " 9223372036854775808 "])
+async def test_numeric_looking_query_that_is_not_a_book_id(client, query):
+    response = await client.get("/api/search-books", params={"query": query})
+    assert response.status_code == 200
+    assert "books" in response.json()
+
+
+async def test_numeric_query_matches_book_id_first(client):
+    response = await client.get("/api/search-books", params={"query": "2"})
+    assert response.status_code == 200
+    assert response.json()["books"][0]["book_id"] == 2
@@ -0,0 +1,22 @@
+"""
+/api/view-report rejects dates it cannot parse instead of miscounting overdue loans
+"""
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.mark.parametrize("date", ["yesterday", "2024-13-01", ""])
+@pytest.mark.parametrize("details", [False, True])
+async def test_invalid_date(client, date, details):
+    response = await client.get("/api/view-report", params={"date": date, "details": details})
+    assert response.status_code == 400
+
+
+async def test_counts(client):
+    response = await client.get("/api/view-report", params={"date": "2000-01-01"})
+    assert response.status_code == 200
+    counts = response.json()
+    # 2000 年之前没有到期的借阅
+    assert counts["overdue_books"] == 0
+    assert counts["books didn't return until today"] >= 0